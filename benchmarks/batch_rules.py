@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Dict, List, Tuple
+
+from src.batch import BatchRuleEvaluator
+from src.models import make_envelope
+from src.rules import evaluate_rules
+from src.state import Config, StateStore
+
+
+def _homes(n_homes: int, seed: int) -> Tuple[List[str], Dict[str, StateStore], Dict[str, Config], BatchRuleEvaluator]:
+    rnd = random.Random(seed)
+    home_ids = [f"home_{i}" for i in range(n_homes)]
+    stores = {h: StateStore() for h in home_ids}
+    cfgs = {h: Config(armed=rnd.random() < 0.5, cooldown_seconds=rnd.choice([0.0, 5.0])) for h in home_ids}
+    batch = BatchRuleEvaluator(n_homes)
+    for h in home_ids:
+        batch.set_config(h, cfgs[h])
+    return home_ids, stores, cfgs, batch
+
+
+def _update(rnd: random.Random, home_id: str, store: StateStore, batch: BatchRuleEvaluator) -> None:
+    """Random telemetry for one home, applied to its StateStore and to the batch columns."""
+    kind = rnd.randrange(3)
+    if kind == 0:
+        dev = f"door_{rnd.randrange(3)}"
+        store.update_telemetry(dev, make_envelope(home_id, dev, "door_window", {"open": rnd.random() < 0.2}))
+        batch.set_open_count(home_id, store.open_contact_count())
+    elif kind == 1:
+        temp, pm10 = rnd.choice([21.5, 65.0]), rnd.choice([12.0, 180.0])
+        store.update_telemetry("env_1", make_envelope(home_id, "env_1", "environment", {"temperature": temp, "pm10": pm10}))
+        batch.set_environment(home_id, temp, pm10)
+    else:
+        delta = rnd.choice([0.05, 0.12, 0.3, 0.9])
+        store.update_telemetry("gas_meter", make_envelope(home_id, "gas_meter", "gas_meter", {"delta": delta}))
+        batch.set_meter_alerts(home_id, store.spiking_meters("gas_meter"), store.anomalous_meters())
+
+
+def run(n_homes: int, n_ticks: int, update_frac: float, check: bool) -> Tuple[float, float]:
+    """
+    Return (per-home evaluate_rules loop, batch) mean milliseconds per tick.
+    Only rule evaluation is timed; with check=True both must agree on every tick.
+    """
+    rnd = random.Random(n_homes)
+    home_ids, stores, cfgs, batch = _homes(n_homes, n_homes)
+    n_updates = max(1, int(n_homes * update_frac))
+    loop_s = batch_s = 0.0
+
+    for tick in range(n_ticks):
+        now_s = 1000.0 + tick
+        for h in rnd.sample(home_ids, n_updates):
+            _update(rnd, h, stores[h], batch)
+
+        t0 = time.perf_counter()
+        expected = {}
+        for h in home_ids:
+            commands, events = evaluate_rules(stores[h], cfgs[h], now_s=now_s)
+            if events:
+                expected[h] = (commands, events)
+        t1 = time.perf_counter()
+        got = batch.evaluate(now_s)
+        t2 = time.perf_counter()
+        loop_s += t1 - t0
+        batch_s += t2 - t1
+
+        if check and got != expected:
+            raise SystemExit(f"mismatch at tick {tick}: {len(got)} vs {len(expected)} homes fired")
+    return loop_s / n_ticks * 1e3, batch_s / n_ticks * 1e3
+
+
+def main() -> None:
+    """
+    Evaluate the builtin rules for every home once per tick: a Python loop
+    over evaluate_rules vs. BatchRuleEvaluator. A random fraction of homes
+    receives telemetry before each tick; results are checked for equality.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--homes", default="10000,100000")
+    ap.add_argument("--ticks", type=int, default=10)
+    ap.add_argument("--update-frac", type=float, default=0.1)
+    ap.add_argument("--no-check", action="store_true")
+    args = ap.parse_args()
+
+    print(f"{'homes':>8} {'loop ms':>10} {'batch ms':>10} {'speedup':>8} {'homes/s (batch)':>16}")
+    for n in (int(x) for x in args.homes.split(",")):
+        loop_ms, batch_ms = run(n, args.ticks, args.update_frac, not args.no_check)
+        print(f"{n:>8} {loop_ms:>10.1f} {batch_ms:>10.2f} {loop_ms / batch_ms:>7.1f}x {n / batch_ms * 1e3:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
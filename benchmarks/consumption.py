@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import argparse
+import time
+from array import array
+from typing import Callable, Dict, Tuple
+
+from src.rollup import ConsumptionRollup
+
+_DAY = 86400
+
+
+def _feed(days: int, interval_s: float, start: float) -> Tuple[ConsumptionRollup, array, array, float]:
+    """One meter reporting every interval_s for `days`; returns rollups, raw samples and µs per sample."""
+    rollup = ConsumptionRollup()
+    n = int(days * _DAY / interval_s)
+    ts = array("d", (start + i * interval_s for i in range(n)))
+    deltas = array("d", (0.001 + (i % 7) * 1e-4 for i in range(n)))
+    t0 = time.perf_counter()
+    for t, d in zip(ts, deltas):
+        rollup.add(t, d)
+    return rollup, ts, deltas, (time.perf_counter() - t0) / n * 1e6
+
+
+def _scan(ts: array, deltas: array, start: float, end: float, step: int) -> Dict[int, float]:
+    """What a query costs without rollups: every raw sample in the range."""
+    out: Dict[int, float] = {}
+    for t, d in zip(ts, deltas):
+        if start <= t < end:
+            b = int(t // step)
+            out[b] = out.get(b, 0.0) + d
+    return out
+
+
+def _ms(fn: Callable[[], object], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+
+def main() -> None:
+    """
+    Per-meter consumption rollups: ingest cost per sample, memory per meter,
+    and query time per step against summing the raw samples of the range.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=31)
+    ap.add_argument("--interval", type=float, default=2.0, help="seconds between meter samples")
+    args = ap.parse_args()
+
+    start = 1_767_225_600.0  # 2026-01-01T00:00:00Z
+    end = start + args.days * _DAY
+    rollup, ts, deltas, us = _feed(args.days, args.interval, start)
+    print(f"{len(ts):,} samples: {us:.2f} µs/sample, rollups {rollup.nbytes() / 1024:.1f} KiB "
+          f"(raw samples {(ts.itemsize + deltas.itemsize) * len(ts) / 1024:.0f} KiB)")
+
+    queries = (
+        ("last day by 15m", end - _DAY, 900),
+        ("last week by hour", end - 7 * _DAY, 3600),
+        (f"{args.days} days by day", start, _DAY),
+    )
+    print(f"{'query':>20} {'level':>7} {'buckets':>8} {'rollup ms':>10} {'scan ms':>9}")
+    for name, t0, step in queries:
+        result = rollup.query(t0, end, step)
+        rollup_ms = _ms(lambda: rollup.query(t0, end, step))
+        scan_ms = _ms(lambda: _scan(ts, deltas, t0, end, step), repeat=1)
+        print(f"{name:>20} {result['level']:>7} {len(result['buckets']):>8} {rollup_ms:>10.3f} {scan_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
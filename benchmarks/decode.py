@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from src import codec
+from src.codec import EnvelopeDecoder, parse_topic
+from src.models import make_envelope, topic
+
+
+def _messages(n: int, n_devices: int) -> List[Tuple[str, bytes]]:
+    msgs = []
+    for i in range(n):
+        dev = f"env_{i % n_devices}"
+        env = make_envelope(
+            "home_1", dev, "environment",
+            {"temperature": round(random.uniform(20, 25), 2), "pm10": round(random.uniform(10, 30), 2)},
+        )
+        msgs.append((topic("home_1", dev, "telemetry"), json.dumps(env).encode("utf-8")))
+    return msgs
+
+
+def _legacy(t: str, raw: bytes) -> Any:
+    """The pre-codec path of _on_message: decode, json.loads, split topic."""
+    payload = json.loads(raw.decode("utf-8"))
+    parts = t.split("/")
+    if len(parts) < 4:
+        return None
+    return parts[-1], payload
+
+
+def _codec_path(dec: EnvelopeDecoder) -> Callable[[str, bytes], Any]:
+    def run(t: str, raw: bytes) -> Any:
+        parsed = parse_topic(t)
+        if parsed is None:
+            return None
+        return parsed[2], dec.decode(raw, parsed[0], parsed[1])
+    return run
+
+
+def _time(fn: Callable[[str, bytes], Any], msgs: List[Tuple[str, bytes]]) -> float:
+    t0 = time.perf_counter()
+    for t, raw in msgs:
+        fn(t, raw)
+    return (time.perf_counter() - t0) / len(msgs) * 1e6
+
+
+def main() -> None:
+    """Compare the legacy decode path with EnvelopeDecoder on each available backend."""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200000)
+    ap.add_argument("--devices", type=int, default=1000)
+    args = ap.parse_args()
+
+    msgs = _messages(args.messages, args.devices)
+    paths: Dict[str, Callable[[str, bytes], Any]] = {"legacy (decode+json.loads+split)": _legacy}
+    paths["codec/json"] = _codec_path(EnvelopeDecoder(loads=codec._stdlib_loads))
+    if codec.orjson is not None:
+        paths["codec/orjson"] = _codec_path(EnvelopeDecoder(loads=codec.orjson.loads))
+    if codec.msgspec is not None:
+        paths["codec/msgspec"] = _codec_path(
+            EnvelopeDecoder(loads=codec.msgspec.json.Decoder(codec.EnvelopeSchema).decode)
+        )
+
+    print(f"{'path':<36} {'us/msg':>8}")
+    for name, fn in paths.items():
+        _time(fn, msgs[:1000])  # warm topic cache
+        print(f"{name:<36} {_time(fn, msgs):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+End-to-end manager benchmark: sustained msgs/sec and sensor-to-command latency.
+
+Modes:
+  direct    calls manager._on_message from the producer thread (no broker)
+  loopback  in-process broker stand-in: topic routing with +/# wildcards and
+            one delivery thread per subscriber, like a paho network loop
+  broker    a real MQTT broker (--broker host:port), manager and harness use paho
+
+Traffic is a mix of the device types in src/devices (environment, meters,
+mobile light, actuator state echoes) across --homes homes, all below rule
+thresholds, plus door_window open/close probes. Every home is armed with no
+cooldown, so each door opening fires the intrusion rule; latency is measured
+from just before the opening is published to the alarm_controller cmd being
+published by the manager.
+
+Results (plus git revision, python and machine info) are written as JSON to
+--out; --baseline prints the change against an earlier results file.
+
+    python -m benchmarks.e2e --modes direct,loopback --messages 200000 --out e2e.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import queue
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from src import manager
+from src.models import ALL_HOMES, topic, wildcard_state, wildcard_telemetry
+from src.state import EventLogger
+from src.wire import WIRE_FORMATS, WireFormat, pack_envelope
+
+Publish = Callable[[str, bytes], None]
+
+
+# -----------------------------
+# Traffic
+# -----------------------------
+# (device_id, device_type, channel, weight); payloads mimic the emulators in src/devices
+MIX: Tuple[Tuple[str, str, str, float], ...] = (
+    ("env_1", "environment", "telemetry", 0.30),
+    ("electricity_meter", "electricity_meter", "telemetry", 0.15),
+    ("water_meter", "water_meter", "telemetry", 0.15),
+    ("gas_meter", "gas_meter", "telemetry", 0.10),
+    ("mobile_light", "mobile_light", "telemetry", 0.10),
+    ("alarm_controller", "alarm_controller", "state", 0.05),
+    ("sprinkler", "sprinkler", "state", 0.05),
+    ("window_1", "door_window", "telemetry", 0.10),  # stays closed
+)
+_UNITS = {"gas_meter": "kg", "electricity_meter": "kWh", "water_meter": "L"}
+
+
+def _payload(rnd: random.Random, device_type: str) -> Dict[str, Any]:
+    if device_type == "environment":
+        return {"temperature": round(rnd.uniform(20, 25), 2), "pm10": round(rnd.uniform(10, 30), 2)}
+    if device_type in _UNITS:
+        # constant delta: the gas spike rule never fires
+        return {"total": round(rnd.uniform(0, 1000), 4), "delta": 0.05, "unit": _UNITS[device_type], "supply_on": True}
+    if device_type == "mobile_light":
+        return {"energy_kwh": round(rnd.uniform(0, 5), 4), "on": False, "level": "LOW"}
+    if device_type == "door_window":
+        return {"open": False}
+    return {"on": False}
+
+
+class Traffic:
+    """Pre-encoded background messages plus per-home door probes (open, then close on the next visit)."""
+
+    def __init__(self, homes: List[str], wire: WireFormat, seed: int = 1, pool: int = 4096) -> None:
+        rnd = random.Random(seed)
+        self.wire = wire
+        self.homes = homes
+        weights = [m[3] for m in MIX]
+        self.background: List[Tuple[str, bytes]] = []
+        for _ in range(pool):
+            dev, dtype, channel, _ = rnd.choices(MIX, weights)[0]
+            home = rnd.choice(homes)
+            raw = pack_envelope(home, dev, dtype, _payload(rnd, dtype), wire)
+            self.background.append((topic(home, dev, channel), raw))
+        self._door_open = {h: False for h in homes}
+        self._next_home = 0
+
+    def probe(self) -> Tuple[str, bytes, Optional[str]]:
+        """Next door message; returns the home id if it is an opening (a latency probe)."""
+        home = self.homes[self._next_home]
+        self._next_home = (self._next_home + 1) % len(self.homes)
+        opening = not self._door_open[home]
+        self._door_open[home] = opening
+        raw = pack_envelope(home, "door_1", "door_window", {"open": opening}, self.wire)
+        return topic(home, "door_1", "telemetry"), raw, home if opening else None
+
+
+# -----------------------------
+# Broker stand-in
+# -----------------------------
+def topic_matches(pattern: str, name: str) -> bool:
+    p, n = pattern.split("/"), name.split("/")
+    for i, part in enumerate(p):
+        if part == "#":
+            return True
+        if i >= len(n) or (part != "+" and part != n[i]):
+            return False
+    return len(p) == len(n)
+
+
+class LoopbackBroker:
+    """In-process MQTT stand-in: each subscriber gets a queue and a delivery thread."""
+
+    def __init__(self) -> None:
+        self._subs: List[Tuple[List[str], "queue.Queue[Any]"]] = []
+        self._threads: List[threading.Thread] = []
+
+    def subscribe(self, patterns: List[str], on_message: Callable[[Any, Any, Any], None]) -> None:
+        q: "queue.Queue[Any]" = queue.Queue()
+
+        def loop() -> None:
+            while True:
+                msg = q.get()
+                if msg is None:
+                    q.task_done()
+                    return
+                try:
+                    on_message(None, None, msg)
+                finally:
+                    q.task_done()
+
+        t = threading.Thread(target=loop, name=f"loopback-{len(self._subs)}", daemon=True)
+        t.start()
+        self._subs.append((patterns, q))
+        self._threads.append(t)
+
+    def publish(self, topic_name: str, payload: bytes, qos: int = 0, retain: bool = False) -> None:
+        msg = SimpleNamespace(topic=topic_name, payload=payload)
+        for patterns, q in self._subs:
+            if any(topic_matches(p, topic_name) for p in patterns):
+                q.put(msg)
+
+    def drain(self) -> None:
+        for _, q in self._subs:
+            q.join()
+
+    def close(self) -> None:
+        for _, q in self._subs:
+            q.put(None)
+        for t in self._threads:
+            t.join(5.0)
+
+
+class _CmdRecorder:
+    """Stands in for the manager's MQTT client; records when alarm cmds are published."""
+
+    def __init__(self, latencies: List[float], sent_at: Dict[str, Deque[float]]) -> None:
+        self.latencies = latencies
+        self.sent_at = sent_at
+
+    def record(self, topic_name: str) -> None:
+        now = time.perf_counter()
+        parts = topic_name.split("/")
+        if len(parts) == 4 and parts[2] == "alarm_controller" and parts[3] == "cmd":
+            pending = self.sent_at.get(parts[1])
+            if pending:
+                self.latencies.append(now - pending.popleft())
+
+    def publish(self, topic_name: str, payload: bytes, qos: int = 0, retain: bool = False) -> None:
+        self.record(topic_name)
+
+    def on_message(self, _client: Any, _userdata: Any, msg: Any) -> None:
+        self.record(msg.topic)
+
+
+# -----------------------------
+# Measurement helpers
+# -----------------------------
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list (0.0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values), max(1, math.ceil(q * len(sorted_values))))
+    return sorted_values[k - 1]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return _max_rss_mb()
+
+
+def _max_rss_mb() -> float:
+    ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return ru / (1024.0 * 1024.0) if platform.system() == "Darwin" else ru / 1024.0
+
+
+def _cpu_s() -> float:
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+def _wait_idle(timeout: float = 60.0) -> None:
+    """Until every queued ingest item has been handled."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        st = manager.ingest.stats()
+        if st["queue_depth"] == 0 and st["processed"] + st["dropped"] >= st["enqueued"]:
+            return
+        time.sleep(0.001)
+    raise TimeoutError("ingest did not drain")
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+# -----------------------------
+# Runs
+# -----------------------------
+def _setup_homes(mode: str, n_homes: int) -> List[str]:
+    homes = [f"bench_{mode}_{i}" for i in range(n_homes)]
+    for h in homes:
+        shard = manager.shards.get(h)
+        shard.cfg.armed = True
+        shard.cfg.cooldown_seconds = 0.0
+    return homes
+
+
+def _connect(mode: str, recorder: _CmdRecorder, broker: Optional[str]) -> Tuple[Publish, Callable[[], None], Callable[[], None]]:
+    """Wire manager + harness for a mode; returns (publish, drain, close)."""
+    if mode == "direct":
+        manager.mqtt_client = recorder
+
+        def publish(t: str, raw: bytes) -> None:
+            manager._on_message(None, None, SimpleNamespace(topic=t, payload=raw))
+
+        return publish, lambda: None, lambda: None
+
+    if mode == "loopback":
+        lb = LoopbackBroker()
+        lb.subscribe([wildcard_telemetry(ALL_HOMES), wildcard_state(ALL_HOMES)], manager._on_message)
+        lb.subscribe(["home/+/+/cmd"], recorder.on_message)
+        manager.mqtt_client = lb
+        return lb.publish, lb.drain, lb.close
+
+    import paho.mqtt.client as mqtt
+
+    host, _, port = (broker or "127.0.0.1:1883").partition(":")
+    clients = []
+    for name, on_message, subs in (
+        ("bench-manager", manager._on_message, [wildcard_telemetry(ALL_HOMES), wildcard_state(ALL_HOMES)]),
+        ("bench-cmds", recorder.on_message, ["home/+/+/cmd"]),
+        ("bench-sensors", None, []),
+    ):
+        c = mqtt.Client(client_id=name, clean_session=True)
+        c.on_message = on_message
+        c.connect(host, int(port or 1883), keepalive=60)
+        for s in subs:
+            c.subscribe(s, qos=0)
+        c.loop_start()
+        clients.append(c)
+    manager.mqtt_client = clients[0]
+    time.sleep(0.5)  # let subscriptions settle
+    sensors = clients[2]
+
+    def close() -> None:
+        for c in clients:
+            c.loop_stop()
+            c.disconnect()
+
+    return (lambda t, raw: sensors.publish(t, raw, qos=0, retain=False)), (lambda: time.sleep(0.5)), close
+
+
+def run(mode: str, n_homes: int, n_messages: int, probe_every: int, rate: float, wire: WireFormat,
+        broker: Optional[str]) -> Dict[str, Any]:
+    homes = _setup_homes(mode, n_homes)
+    traffic = Traffic(homes, wire)
+    latencies: List[float] = []
+    sent_at: Dict[str, Deque[float]] = {h: deque() for h in homes}  # opening send times, oldest first
+    recorder = _CmdRecorder(latencies, sent_at)
+    publish, drain, close = _connect(mode, recorder, broker)
+
+    ingest_before = manager.ingest.stats()
+    background, n_bg = traffic.background, len(traffic.background)
+    probes = 0
+    interval = 1.0 / rate if rate > 0 else 0.0
+
+    cpu0, t0 = _cpu_s(), time.perf_counter()
+    try:
+        for i in range(n_messages):
+            if interval:
+                target = t0 + i * interval
+                while time.perf_counter() < target:
+                    pass
+            if i % probe_every == 0:
+                t, raw, home = traffic.probe()
+                if home is not None:
+                    probes += 1
+                    sent_at[home].append(time.perf_counter())
+            else:
+                t, raw = background[i % n_bg]
+            publish(t, raw)
+        drain()
+        _wait_idle()
+        drain()
+        elapsed = time.perf_counter() - t0
+        cpu = _cpu_s() - cpu0
+    finally:
+        close()
+        manager.mqtt_client = None
+
+    ingest_after = manager.ingest.stats()
+    lat = sorted(x * 1000.0 for x in latencies)
+    return {
+        "mode": mode,
+        "wire": wire,
+        "homes": n_homes,
+        "messages": n_messages,
+        "target_rate": rate or None,
+        "elapsed_s": round(elapsed, 4),
+        "msgs_per_s": round(n_messages / elapsed, 1),
+        "probes": probes,
+        "commands_matched": len(lat),
+        "latency_ms": {
+            "p50": round(percentile(lat, 0.50), 4),
+            "p99": round(percentile(lat, 0.99), 4),
+            "p999": round(percentile(lat, 0.999), 4),
+            "max": round(lat[-1], 4) if lat else 0.0,
+            "mean": round(sum(lat) / len(lat), 4) if lat else 0.0,
+        },
+        "cpu_s": round(cpu, 3),
+        "cpu_pct": round(cpu / elapsed * 100.0, 1),
+        "rss_mb": round(_rss_mb(), 1),
+        "max_rss_mb": round(_max_rss_mb(), 1),
+        "ingest": {k: ingest_after[k] - ingest_before[k] for k in ("enqueued", "processed", "dropped", "rejected", "coalesced", "errors")},
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """One line per (mode, wire) present in both files: throughput and p99 change."""
+    old = {(r["mode"], r["wire"]): r for r in baseline.get("runs", [])}
+    lines = []
+    for r in current["runs"]:
+        b = old.get((r["mode"], r["wire"]))
+        if b is None:
+            continue
+        d_rate = (r["msgs_per_s"] / b["msgs_per_s"] - 1.0) * 100.0 if b["msgs_per_s"] else 0.0
+        b99, c99 = b["latency_ms"]["p99"], r["latency_ms"]["p99"]
+        d_p99 = (c99 / b99 - 1.0) * 100.0 if b99 else 0.0
+        lines.append(f"{r['mode']:>9} {r['wire']:>5}  msgs/s {d_rate:+7.1f}%   p99 {d_p99:+7.1f}%"
+                     f"   (baseline {baseline.get('meta', {}).get('revision')})")
+    return lines
+
+
+def main() -> None:
+    """Run the selected modes and print/write the results."""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--modes", default="direct,loopback", help="comma list of direct|loopback|broker")
+    ap.add_argument("--broker", default=None, help="host:port of a real broker for --modes broker")
+    ap.add_argument("--homes", type=int, default=100)
+    ap.add_argument("--messages", type=int, default=100000)
+    ap.add_argument("--probe-every", type=int, default=50, help="every Nth message is a door probe")
+    ap.add_argument("--rate", type=float, default=0.0, help="paced msgs/s (0 = as fast as possible)")
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json")
+    ap.add_argument("--out", default=None, help="write results as JSON here")
+    ap.add_argument("--baseline", default=None, help="earlier --out file to compare against")
+    args = ap.parse_args()
+
+    # keep benchmark events out of outputs/events.log
+    log_dir = tempfile.mkdtemp(prefix="e2e-bench-")
+    manager.logger = EventLogger(os.path.join(log_dir, "events.log"), max_queue=1_000_000)
+    manager.ingest.start()
+
+    runs = []
+    try:
+        for mode in args.modes.split(","):
+            r = run(mode, args.homes, args.messages, max(2, args.probe_every), args.rate, args.wire, args.broker)
+            runs.append(r)
+            lat = r["latency_ms"]
+            print(f"{mode:>9} {r['msgs_per_s']:>10,.0f} msg/s  p50 {lat['p50']:.3f}  p99 {lat['p99']:.3f}  "
+                  f"p999 {lat['p999']:.3f} ms  cpu {r['cpu_pct']:.0f}%  rss {r['rss_mb']:.0f} MB  "
+                  f"({r['commands_matched']}/{r['probes']} probes)")
+    finally:
+        manager.ingest.stop()
+        manager.logger.close()
+
+    result = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ingest_workers": manager.INGEST_WORKERS,
+            "decoder_backend": manager.decoder.stats()["backend"],
+        },
+        "runs": runs,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            for line in compare(json.load(f), result):
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Tuple
+
+from src.models import DeviceInfo, make_envelope
+from src.persist import StatePersistence
+from src.state import HomeShards
+
+_TYPES = ("door_window", "environment", "electricity_meter")
+
+
+def _reading(device_type: str, i: int) -> dict:
+    if device_type == "door_window":
+        return {"open": bool(i % 2)}
+    if device_type == "environment":
+        return {"temperature": 20.0 + i % 10, "pm10": 15.0}
+    return {"total": float(i), "delta": 0.1, "unit": "kWh"}
+
+
+def _write(state_dir: str, n_devices: int, per_home: int, wal_messages: int, checkpoint: bool) -> float:
+    """Journal a fleet (and optionally checkpoint it), then wal_messages more updates; return write seconds."""
+    shards = HomeShards()
+    p = StatePersistence(state_dir, checkpoint_interval_s=3600.0, max_wal_bytes=1 << 40)
+    p.start(shards)
+    t0 = time.perf_counter()
+    for i in range(n_devices):
+        home_id, device_id, dtype = f"home_{i // per_home}", f"dev_{i % per_home}", _TYPES[i % len(_TYPES)]
+        shard = shards.get(home_id)
+        shard.registry.add(DeviceInfo(device_id, dtype, "sensor"))
+        shard.store.update_telemetry(device_id, make_envelope(home_id, device_id, dtype, _reading(dtype, i)))
+    if checkpoint:
+        p.checkpoint()
+    for j in range(wal_messages):
+        i = j % n_devices
+        home_id, device_id, dtype = f"home_{i // per_home}", f"dev_{i % per_home}", _TYPES[i % len(_TYPES)]
+        shards.get(home_id).store.update_telemetry(device_id, make_envelope(home_id, device_id, dtype, _reading(dtype, j)))
+    p.flush()
+    elapsed = time.perf_counter() - t0
+    p.close(checkpoint=False)  # leave the WAL as a crash would
+    return elapsed
+
+
+def run(n_devices: int, per_home: int, wal_messages: int, checkpoint: bool) -> Tuple[float, float, int, int]:
+    """Return (write s, recovery s, MB on disk, devices recovered)."""
+    state_dir = tempfile.mkdtemp(prefix="startup-bench-")
+    try:
+        write_s = _write(state_dir, n_devices, per_home, wal_messages, checkpoint)
+        size = sum(os.path.getsize(os.path.join(state_dir, f)) for f in os.listdir(state_dir))
+        shards = HomeShards()
+        t0 = time.perf_counter()
+        result = StatePersistence(state_dir).recover(shards)
+        recover_s = time.perf_counter() - t0
+        return write_s, recover_s, size >> 20, result.devices if result is not None else 0
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def main() -> None:
+    """
+    Warm-restart time: recovering N devices (last telemetry + registry)
+    from a checkpoint only, a checkpoint plus a WAL tail, and a WAL only.
+    The checkpoint cases are what CHECKPOINT_WAL_BYTES keeps a restart at.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=100000)
+    ap.add_argument("--per-home", type=int, default=20)
+    ap.add_argument("--wal-messages", type=int, default=100000)
+    args = ap.parse_args()
+
+    cases = (
+        ("checkpoint", True, 0),
+        ("checkpoint+wal", True, args.wal_messages),
+        ("wal only", False, args.wal_messages),
+    )
+    print(f"{'case':>16} {'devices':>9} {'write s':>9} {'recover s':>10} {'MB':>6}")
+    for name, checkpoint, wal_messages in cases:
+        write_s, recover_s, mb, devices = run(args.devices, args.per_home, wal_messages, checkpoint)
+        print(f"{name:>16} {devices:>9} {write_s:>9.2f} {recover_s:>10.2f} {mb:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Tuple
+
+from src.models import make_envelope
+from src.rules import evaluate_rules
+from src.state import Config, StateStore
+
+
+def _populate(store: StateStore, home_id: str, n_contacts: int) -> None:
+    for i in range(n_contacts):
+        store.update_telemetry(f"door_{i}", make_envelope(home_id, f"door_{i}", "door_window", {"open": False}))
+    store.update_telemetry("env_1", make_envelope(home_id, "env_1", "environment", {"temperature": 22.0, "pm10": 20.0}))
+    store.update_telemetry(
+        "gas_meter",
+        make_envelope(home_id, "gas_meter", "gas_meter", {"total": 1.0, "delta": 0.1, "unit": "kg", "supply_on": True}),
+    )
+
+
+def run(n_contacts: int, n_messages: int) -> Tuple[float, float]:
+    """Return mean microseconds per message (store update + rule evaluation) and per snapshot()."""
+    home_id = "home_1"
+    store = StateStore()
+    cfg = Config(armed=False)
+    _populate(store, home_id, n_contacts)
+
+    msgs = [
+        make_envelope(home_id, f"door_{i % n_contacts}", "door_window", {"open": False})
+        for i in range(n_messages)
+    ]
+
+    t0 = time.perf_counter()
+    for m in msgs:
+        store.update_telemetry(m["device_id"], m)
+        evaluate_rules(store, cfg)
+    per_msg = (time.perf_counter() - t0) / n_messages * 1e6
+
+    n_snaps = 1000
+    t0 = time.perf_counter()
+    for _ in range(n_snaps):
+        store.snapshot()
+    return per_msg, (time.perf_counter() - t0) / n_snaps * 1e6
+
+
+def main() -> None:
+    """
+    Per-message cost of update_telemetry + evaluate_rules vs. number of
+    door/window contacts in the store, and the cost of a snapshot(). Both
+    should stay flat.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,10000,100000")
+    ap.add_argument("--messages", type=int, default=20000)
+    args = ap.parse_args()
+
+    print(f"{'devices':>10} {'us/msg':>10} {'us/snapshot':>12}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        per_msg, per_snap = run(n, args.messages)
+        print(f"{n:>10} {per_msg:>10.2f} {per_snap:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
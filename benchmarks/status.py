@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, Tuple
+
+from src.manager import StatusView, _status, _status_lines, _status_response
+from src.models import DeviceInfo, make_envelope
+from src.state import HomeShard
+
+_TYPES = ("door_window", "environment", "electricity_meter")
+
+
+def _populate(n_devices: int) -> HomeShard:
+    shard = HomeShard("home_1")
+    for i in range(n_devices):
+        device_id, dtype = f"dev_{i:06d}", _TYPES[i % len(_TYPES)]
+        shard.registry.add(DeviceInfo(device_id, dtype, "sensor"))
+        shard.store.update_telemetry(device_id, make_envelope("home_1", device_id, dtype, {"value": float(i), "ok": True}))
+    return shard
+
+
+def _full(shard: HomeShard) -> int:
+    """The default body as rendered once per version (not cached here)."""
+    return len(json.dumps(_status(shard), separators=(",", ":")))
+
+
+def _view(view: StatusView) -> Callable[[HomeShard], int]:
+    def render(shard: HomeShard) -> int:
+        if view.ndjson:
+            # the StreamingResponse body, consumed chunk by chunk like the server does
+            return sum(len(chunk) for chunk in _status_lines(shard, shard.store.snapshot(), view))
+        return len(_status_response(shard, None, None, view).body)
+    return render
+
+
+def _measure(render: Callable[[HomeShard], int], shard: HomeShard) -> Tuple[float, float, int]:
+    """(ms, peak MB allocated while rendering, bytes produced); timed without tracemalloc."""
+    render(shard)  # warm the sorted id lists
+    t0 = time.perf_counter()
+    size = render(shard)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    render(shard)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1e3, peak / 1e6, size
+
+
+def main() -> None:
+    """
+    One /status poll by response mode as the fleet grows: the full body, a
+    projected 1000-device page, and the NDJSON stream. Peak memory of the
+    page and NDJSON modes should stay flat.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000,100000")
+    args = ap.parse_args()
+
+    modes: Dict[str, Callable[[HomeShard], int]] = {
+        "full": _full,
+        "page fields=data": _view(StatusView(fields=("data",), limit=1000)),
+        "ndjson": _view(StatusView(ndjson=True)),
+        "ndjson fields=data,ts": _view(StatusView(fields=("data", "ts"), ndjson=True)),
+    }
+    print(f"{'devices':>9} {'mode':>22} {'ms':>9} {'peak MB':>9} {'MB out':>8}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        shard = _populate(n)
+        for name, render in modes.items():
+            ms, peak, size = _measure(render, shard)
+            print(f"{n:>9} {name:>22} {ms:>9.1f} {peak:>9.1f} {size / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import threading
+import time
+from typing import List, Tuple
+
+from src.models import make_envelope
+from src.stream import StreamFilter, StreamHub, Subscriber
+
+
+async def _consume(sub: Subscriber, idle_s: float) -> int:
+    n = 0
+    while True:
+        items = await sub.get(idle_s)
+        if not items:
+            return n
+        n += len(items)
+
+
+async def run(n_subscribers: int, n_messages: int, buffer_size: int) -> Tuple[float, float, dict]:
+    """
+    Return (publish cost in us/msg as seen by the ingest thread, updates
+    buffered for subscribers per second, hub stats). Half the subscribers
+    filter on door_window; the rest take everything.
+    """
+    hub = StreamHub(buffer_size=buffer_size)
+    subs: List[Subscriber] = [
+        hub.subscribe(StreamFilter.parse(device_type="door_window" if i % 2 else None))
+        for i in range(n_subscribers)
+    ]
+    envs = [
+        make_envelope("home_1", f"dev_{i % 50}", "door_window" if i % 3 else "environment", {"open": bool(i % 2)})
+        for i in range(n_messages)
+    ]
+    publish_s = [0.0]
+
+    def produce() -> None:
+        t0 = time.perf_counter()
+        for e in envs:
+            hub.publish("telemetry", "home_1", e["device_id"], e["device_type"], e)
+        publish_s[0] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    producer = threading.Thread(target=produce)
+    producer.start()
+    await asyncio.gather(*(_consume(s, 0.5) for s in subs))
+    producer.join()
+    elapsed = time.perf_counter() - t0 - 0.5  # minus the final idle wait
+    stats = hub.stats()
+    hub.stop()
+    return publish_s[0] / n_messages * 1e6, stats["delivered"] / max(elapsed, 1e-9), stats
+
+
+def main() -> None:
+    """
+    Fan-out of updates from one ingest thread to N asyncio subscribers
+    through StreamHub. The publish cost should stay flat as N grows.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subscribers", default="0,10,1000,5000")
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--buffer", type=int, default=256)
+    args = ap.parse_args()
+
+    print(f"{'subscribers':>12} {'publish us/msg':>15} {'fanned out/s':>14} {'dropped (slow)':>15}")
+    for n in (int(x) for x in args.subscribers.split(",")):
+        publish_us, rate, stats = asyncio.run(run(n, args.messages, args.buffer))
+        print(f"{n:>12} {publish_us:>15.2f} {rate:>14,.0f} {stats['dropped_slow']:>15}")
+
+
+if __name__ == "__main__":
+    main()
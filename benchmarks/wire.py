@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Any, Dict, List, Tuple
+
+from src import codec
+from src.codec import EnvelopeDecoder
+from src.wire import pack_cmd, pack_envelope, unpack_cmd
+
+SAMPLES: List[Tuple[str, str, Dict[str, Any]]] = [
+    ("door_1", "door_window", {"open": True}),
+    ("env_1", "environment", {"temperature": 22.37, "pm10": 18.4}),
+    ("gas_meter", "gas_meter", {"total": 123.4567, "delta": 0.1234, "unit": "kg", "supply_on": True}),
+    ("gas_meter", "gas_meter", {"supply_on": False}),
+    ("mobile_light", "mobile_light", {"energy_kwh": 1.23, "on": True, "level": "HIGH"}),
+    ("alarm_controller", "alarm_controller", {"on": True}),
+]
+
+
+def _rate(fn: Any, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - t0)
+
+
+def main() -> None:
+    """Payload size and encode/decode throughput: JSON vs. compact binary."""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=50000)
+    args = ap.parse_args()
+    n = args.iterations
+    dec = EnvelopeDecoder()
+    dec_std = EnvelopeDecoder(loads=codec._stdlib_loads)
+
+    print(f"backend for 'dec json/s': {codec.BACKEND}")
+    print(
+        f"{'message':<36} {'json B':>7} {'bin B':>6} {'enc json/s':>11} {'enc bin/s':>10}"
+        f" {'dec stdlib/s':>12} {'dec json/s':>11} {'dec bin/s':>10}"
+    )
+    for device_id, dtype, data in SAMPLES:
+        raw_json = pack_envelope("home_1", device_id, dtype, data, "json")
+        raw_bin = pack_envelope("home_1", device_id, dtype, data, "bin")
+        assert dec.decode(raw_bin, "home_1", device_id)["data"] == data
+
+        name = f"{dtype} {sorted(data)}"[:36]
+        print(
+            f"{name:<36} {len(raw_json):>7} {len(raw_bin):>6}"
+            f" {_rate(lambda: pack_envelope('home_1', device_id, dtype, data, 'json'), n):>11.0f}"
+            f" {_rate(lambda: pack_envelope('home_1', device_id, dtype, data, 'bin'), n):>10.0f}"
+            f" {_rate(lambda: dec_std.decode(raw_json, 'home_1', device_id), n):>12.0f}"
+            f" {_rate(lambda: dec.decode(raw_json, 'home_1', device_id), n):>11.0f}"
+            f" {_rate(lambda: dec.decode(raw_bin, 'home_1', device_id), n):>10.0f}"
+        )
+
+    params = {"on": True, "level": "HIGH"}
+    cj = pack_cmd("home_1", "mobile_light", "set", params, "json")
+    cb = pack_cmd("home_1", "mobile_light", "set", params, "bin")
+    assert unpack_cmd(cb, "home_1", "mobile_light")["params"] == params
+    print(
+        f"{'cmd set ' + str(sorted(params)):<36} {len(cj):>7} {len(cb):>6}"
+        f" {_rate(lambda: pack_cmd('home_1', 'mobile_light', 'set', params, 'json'), n):>11.0f}"
+        f" {_rate(lambda: pack_cmd('home_1', 'mobile_light', 'set', params, 'bin'), n):>10.0f}"
+        f" {'':>12}"
+        f" {_rate(lambda: unpack_cmd(cj, 'home_1', 'mobile_light'), n):>11.0f}"
+        f" {_rate(lambda: unpack_cmd(cb, 'home_1', 'mobile_light'), n):>10.0f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
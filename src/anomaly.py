@@ -0,0 +1,239 @@
+"""
+Streaming anomaly detection on utility meter consumption (the `delta`
+field of gas/electricity/water meter telemetry), one detector per meter.
+
+Each sample updates, in O(1) and a few floats of state per meter:
+  - spike:  delta >= spike_ratio x the meter's previous delta (and >=
+            spike_min_delta); the builtin "gas" rule, now per meter
+  - z-score against an EWMA mean/variance of the meter's own deltas
+  - one-sided CUSUM of those z-scores (slow leaks: a small but sustained
+            rise that never crosses the z threshold)
+z-score and CUSUM only flag after `warmup` samples. The EWMA keeps
+adapting, so a new steady level stops being anomalous once it is learned.
+
+MeterDetectors keeps the currently flagged meters in small indexes, so the
+rules read those instead of scanning every meter of a home.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, fields, replace
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Optional, Set
+
+from .models import DeviceId
+
+if TYPE_CHECKING:
+    from .state import Config
+
+# MeterDetector.flags bits
+SPIKE = 1
+ZSCORE = 2
+CUSUM = 4
+ANOMALY = ZSCORE | CUSUM
+
+_FLAG_NAMES = ((SPIKE, "spike"), (ZSCORE, "zscore"), (CUSUM, "cusum"))
+
+
+@dataclass(frozen=True)
+class DetectorConfig:
+    """Detector parameters of one meter type (deviations are in standard deviations)."""
+    enabled: bool = True  # z-score/CUSUM (the spike test only needs spike_ratio > 0)
+    alpha: float = 0.05  # EWMA weight of a new sample
+    warmup: int = 30  # samples before z-score/CUSUM may flag
+    z_threshold: float = 4.0
+    cusum_k: float = 0.5  # slack subtracted from every z-score
+    cusum_h: float = 8.0  # CUSUM decision threshold
+    min_std: float = 1e-3  # floor of the standard deviation (meters with near-constant deltas)
+    spike_ratio: float = 0.0  # 0 = no spike test
+    spike_min_delta: float = 0.0
+    shutoff: bool = False  # anomaly -> "set supply_on=False" to the meter
+    alarm: bool = False  # anomaly -> siren on
+
+    def validate(self) -> None:
+        if not 0.0 < self.alpha <= 1.0:
+            raise ValueError("alpha must be in (0, 1]")
+        if self.warmup < 0 or self.z_threshold <= 0 or self.cusum_k < 0 or self.cusum_h <= 0 or self.min_std <= 0:
+            raise ValueError("warmup must be >= 0, cusum_k >= 0, and z_threshold, cusum_h, min_std > 0")
+        if self.spike_ratio < 0:
+            raise ValueError("spike_ratio must be >= 0")
+
+
+# Defaults per meter type; Config.meter_detectors overrides single fields per type.
+# Anomalies are only logged unless a site opts into shutoff/alarm (the gas spike
+# rule keeps its own shut-off).
+METER_DETECTORS: Dict[str, DetectorConfig] = {
+    "gas_meter": DetectorConfig(),
+    "water_meter": DetectorConfig(),
+    "electricity_meter": DetectorConfig(),
+}
+
+_FIELDS = {f.name: f.type for f in fields(DetectorConfig)}
+
+
+def _coerce(name: str, value: Any) -> Any:
+    kind = _FIELDS[name]
+    if kind == "bool":
+        if not isinstance(value, bool):
+            raise ValueError(f"{name} must be a boolean")
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} must be a number")
+    return int(value) if kind == "int" else float(value)
+
+
+def detector_configs(
+    overrides: Optional[Mapping[str, Mapping[str, Any]]] = None,
+    gas_spike_ratio: float = 2.0,
+    gas_min_delta: float = 0.1,
+) -> Dict[str, DetectorConfig]:
+    """
+    METER_DETECTORS with per-type field overrides applied. The gas_meter
+    spike test takes Config.gas_spike_ratio/gas_min_delta unless overridden.
+    ValueError on unknown meter types, unknown fields or bad values.
+    """
+    out = dict(METER_DETECTORS)
+    out["gas_meter"] = replace(out["gas_meter"], spike_ratio=gas_spike_ratio, spike_min_delta=gas_min_delta)
+    for meter_type, values in (overrides or {}).items():
+        if meter_type not in out:
+            raise ValueError(f"unknown meter type: {meter_type} (expected {', '.join(METER_DETECTORS)})")
+        if not isinstance(values, Mapping):
+            raise ValueError(f"{meter_type}: expected an object of detector fields")
+        unknown = set(values) - set(_FIELDS)
+        if unknown:
+            raise ValueError(f"{meter_type}: unknown fields: {', '.join(sorted(unknown))}")
+        try:
+            out[meter_type] = replace(out[meter_type], **{k: _coerce(k, v) for k, v in values.items()})
+            out[meter_type].validate()
+        except ValueError as e:
+            raise ValueError(f"{meter_type}: {e}") from None
+    return out
+
+
+def configs_for(cfg: "Config") -> Dict[str, DetectorConfig]:
+    """Detector configs of one home."""
+    return detector_configs(cfg.meter_detectors, cfg.gas_spike_ratio, cfg.gas_min_delta)
+
+
+class MeterDetector:
+    """Incremental state of one meter."""
+
+    __slots__ = ("n", "mean", "var", "cusum", "z", "last", "prev", "flags")
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.cusum = 0.0
+        self.z = 0.0
+        self.last: Optional[float] = None
+        self.prev: Optional[float] = None
+        self.flags = 0
+
+    def update(self, x: float, c: DetectorConfig) -> int:
+        """Feed one delta; returns the new flags."""
+        self.prev, self.last = self.last, x
+        flags = 0
+        prev = self.prev
+        if c.spike_ratio > 0 and x >= c.spike_min_delta and prev is not None and prev > 0 and x / prev >= c.spike_ratio:
+            flags |= SPIKE
+
+        if c.enabled and self.n >= c.warmup and self.n > 0:
+            z = (x - self.mean) / max(math.sqrt(self.var), c.min_std)
+            # capped so a long anomaly does not take forever to drain once it ends
+            self.cusum = min(max(0.0, self.cusum + z - c.cusum_k), 2.0 * c.cusum_h)
+            self.z = z
+            if z >= c.z_threshold:
+                flags |= ZSCORE
+            if self.cusum >= c.cusum_h:
+                flags |= CUSUM
+
+        # EWMA mean/variance (West's incremental form); the first sample seeds the mean
+        if self.n == 0:
+            self.mean = x
+        else:
+            diff = x - self.mean
+            incr = c.alpha * diff
+            self.mean += incr
+            self.var = (1.0 - c.alpha) * (self.var + diff * incr)
+        self.n += 1
+        self.flags = flags
+        return flags
+
+    def info(self, device_type: str, c: DetectorConfig) -> Dict[str, Any]:
+        return {
+            "device_type": device_type,
+            "delta": self.last,
+            "prev_delta": self.prev,
+            "mean": round(self.mean, 6),
+            "std": round(math.sqrt(self.var), 6),
+            "z": round(self.z, 3),
+            "cusum": round(self.cusum, 3),
+            "samples": self.n,
+            "flags": [name for bit, name in _FLAG_NAMES if self.flags & bit],
+            "shutoff": c.shutoff,
+            "alarm": c.alarm,
+        }
+
+
+class MeterDetectors:
+    """
+    Detectors of all meters of one home, plus indexes of the meters that
+    are currently flagged. Not thread-safe: StateStore calls it under its lock.
+    """
+
+    def __init__(self, configs: Optional[Dict[str, DetectorConfig]] = None) -> None:
+        self.configs = configs if configs is not None else detector_configs()
+        self._detectors: Dict[DeviceId, MeterDetector] = {}
+        self._types: Dict[DeviceId, str] = {}
+        self._spiking: Dict[str, Set[DeviceId]] = {}
+        self._anomalous: Set[DeviceId] = set()
+
+    def __len__(self) -> int:
+        return len(self._detectors)
+
+    def configure(self, configs: Dict[str, DetectorConfig]) -> None:
+        """New parameters; they apply from the next sample (learned baselines are kept)."""
+        self.configs = configs
+
+    def observe(self, device_id: DeviceId, device_type: str, delta: Any) -> None:
+        c = self.configs.get(device_type)
+        if c is None or isinstance(delta, bool) or not isinstance(delta, (int, float)):
+            return
+        det = self._detectors.get(device_id)
+        if det is None:
+            det = self._detectors[device_id] = MeterDetector()
+            self._types[device_id] = device_type
+        flags = det.update(float(delta), c)
+
+        spiking = self._spiking.setdefault(device_type, set())
+        if flags & SPIKE:
+            spiking.add(device_id)
+        else:
+            spiking.discard(device_id)
+        if flags & ANOMALY:
+            self._anomalous.add(device_id)
+        else:
+            self._anomalous.discard(device_id)
+
+    def forget(self, device_id: DeviceId) -> None:
+        """Drop a meter's detector (e.g. it now reports another device_type)."""
+        if self._detectors.pop(device_id, None) is None:
+            return
+        self._spiking.get(self._types.pop(device_id), set()).discard(device_id)
+        self._anomalous.discard(device_id)
+
+    def _info(self, device_id: DeviceId) -> Dict[str, Any]:
+        dtype = self._types[device_id]
+        return self._detectors[device_id].info(dtype, self.configs.get(dtype, DetectorConfig()))
+
+    def spiking(self, device_type: str) -> Dict[DeviceId, Dict[str, Any]]:
+        """Meters of this type whose last delta was a spike."""
+        return {d: self._info(d) for d in sorted(self._spiking.get(device_type, ()))}
+
+    def anomalous(self) -> Dict[DeviceId, Dict[str, Any]]:
+        """Meters whose last sample was flagged by z-score or CUSUM."""
+        return {d: self._info(d) for d in sorted(self._anomalous)}
+
+    def get(self, device_id: DeviceId) -> Optional[Dict[str, Any]]:
+        return self._info(device_id) if device_id in self._detectors else None
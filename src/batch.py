@@ -0,0 +1,334 @@
+"""
+Batch evaluation of the builtin rules (intrusion, fire, gas, meter_anomaly)
+for many homes.
+
+The inputs of rules.evaluate_rules are kept in columnar NumPy arrays, one
+row per home, and a tick evaluates every home with a handful of vector
+operations. One tick is equivalent to calling evaluate_rules(store, cfg,
+now_s=now_s) once per home: same conditions, edge detection, cooldowns,
+commands and events. Python-level work is only done for homes that fire.
+
+BatchRuleScheduler runs this inside the manager (RULE_EVAL_MODE = "batch"):
+message handling only updates the store and marks the home, and a ticker
+thread evaluates the builtin rules of all homes every tick_s.
+
+Requires NumPy (optional dependency, only needed for this module).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import metrics
+from .models import Command, DeviceId, HomeId
+from .rules import RULE_NAMES, rule_commands, rule_event
+from .state import Config, HomeShard, HomeShards
+
+_INTRUSION, _FIRE, _GAS, _ANOMALY = (RULE_NAMES.index(r) for r in ("intrusion", "fire", "gas", "meter_anomaly"))
+
+MeterAlerts = Dict[DeviceId, Dict[str, Any]]
+
+# column name -> dtype; *_ok columns mark "value present" (None in evaluate_rules)
+_COLUMNS: Dict[str, Any] = {
+    # telemetry
+    "open_count": np.int64,
+    "temp": np.float64,
+    "temp_ok": np.bool_,
+    "pm10": np.float64,
+    "pm10_ok": np.bool_,
+    "gas_spike": np.bool_,  # a gas meter's last delta spiked (StateStore.spiking_meters)
+    "meter_anomaly": np.bool_,  # a meter is flagged by z-score/CUSUM (StateStore.anomalous_meters)
+    # config
+    "armed": np.bool_,
+    "temp_threshold": np.float64,
+    "pm10_threshold": np.float64,
+    "intrusion_enabled": np.bool_,
+    "fire_enabled": np.bool_,
+    "gas_enabled": np.bool_,
+    "anomaly_enabled": np.bool_,
+    "cooldown_seconds": np.float64,
+}
+
+Results = Dict[HomeId, Tuple[List[Command], List[Dict[str, Any]]]]
+
+
+class BatchRuleEvaluator:
+    """
+    Columnar rule state of many homes. Not thread-safe: one owner feeds it
+    (set_* / load_shard) and calls evaluate() once per tick.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.home_ids: List[HomeId] = []
+        self._row: Dict[HomeId, int] = {}
+        self._cap = max(1, capacity)
+        self.cols: Dict[str, np.ndarray] = {name: np.zeros(self._cap, dtype) for name, dtype in _COLUMNS.items()}
+        # per-home edge-detection flags and last trigger time, one column per rule
+        self.active = np.zeros((self._cap, len(RULE_NAMES)), np.bool_)
+        self.last_trigger = np.zeros((self._cap, len(RULE_NAMES)), np.float64)
+        # flagged meters per home (only homes with any), for the commands of the meter rules
+        self._spiking: Dict[HomeId, MeterAlerts] = {}
+        self._anomalous: Dict[HomeId, MeterAlerts] = {}
+
+    def __len__(self) -> int:
+        return len(self.home_ids)
+
+    # -----------------------------
+    # Rows
+    # -----------------------------
+    def _grow(self, need: int) -> None:
+        cap = self._cap
+        while cap < need:
+            cap *= 2
+        if cap == self._cap:
+            return
+        for name, col in self.cols.items():
+            new = np.zeros(cap, col.dtype)
+            new[: self._cap] = col
+            self.cols[name] = new
+        for attr in ("active", "last_trigger"):
+            old = getattr(self, attr)
+            new = np.zeros((cap, old.shape[1]), old.dtype)
+            new[: self._cap] = old
+            setattr(self, attr, new)
+        self._cap = cap
+
+    def row(self, home_id: HomeId) -> int:
+        """Row of a home, added with the default Config if new."""
+        r = self._row.get(home_id)
+        if r is None:
+            r = len(self.home_ids)
+            self._grow(r + 1)
+            self.home_ids.append(home_id)
+            self._row[home_id] = r
+            self.set_config(home_id, Config())
+        return r
+
+    # -----------------------------
+    # Inputs
+    # -----------------------------
+    def set_config(self, home_id: HomeId, cfg: Config) -> None:
+        r = self.row(home_id)
+        c = self.cols
+        c["armed"][r] = bool(cfg.armed)
+        c["temp_threshold"][r] = cfg.temp_threshold
+        c["pm10_threshold"][r] = cfg.pm10_threshold
+        c["intrusion_enabled"][r] = bool(cfg.rule_intrusion_enabled)
+        c["fire_enabled"][r] = bool(cfg.rule_fire_enabled)
+        c["gas_enabled"][r] = bool(cfg.rule_gas_enabled)
+        c["anomaly_enabled"][r] = bool(cfg.rule_meter_anomaly_enabled)
+        c["cooldown_seconds"][r] = cfg.cooldown_seconds
+
+    def set_armed(self, home_id: HomeId, armed: bool) -> None:
+        self.cols["armed"][self.row(home_id)] = bool(armed)
+
+    def set_open_count(self, home_id: HomeId, count: int) -> None:
+        self.cols["open_count"][self.row(home_id)] = count
+
+    def set_environment(self, home_id: HomeId, temp: Optional[float], pm10: Optional[float]) -> None:
+        r = self.row(home_id)
+        self._set_optional(r, "temp", temp)
+        self._set_optional(r, "pm10", pm10)
+
+    def set_meter_alerts(self, home_id: HomeId, spiking: MeterAlerts, anomalous: MeterAlerts) -> None:
+        """Spiking gas meters and anomalous meters of a home, as read from its StateStore."""
+        r = self.row(home_id)
+        self.cols["gas_spike"][r] = bool(spiking)
+        self.cols["meter_anomaly"][r] = bool(anomalous)
+        for alerts, flagged in ((self._spiking, spiking), (self._anomalous, anomalous)):
+            if flagged:
+                alerts[home_id] = flagged
+            else:
+                alerts.pop(home_id, None)
+
+    def _set_optional(self, r: int, name: str, value: Optional[float]) -> None:
+        ok = value is not None
+        self.cols[name][r] = float(value) if ok else 0.0
+        self.cols[name + "_ok"][r] = ok
+
+    def load_shard(self, shard: HomeShard) -> None:
+        """Copy the rule inputs and edge/cooldown state of one home from its shard."""
+        store, r = shard.store, self.row(shard.home_id)
+        self.set_config(shard.home_id, shard.cfg)
+        self.set_open_count(shard.home_id, store.open_contact_count())
+        env = store.environment_reading() or {}
+        self.set_environment(shard.home_id, env.get("temperature"), env.get("pm10"))
+        self.set_meter_alerts(shard.home_id, store.spiking_meters("gas_meter"), store.anomalous_meters())
+        flags = store.rule_flags(RULE_NAMES)
+        for i, name in enumerate(RULE_NAMES):
+            self.active[r, i] = flags[name]
+            self.last_trigger[r, i] = store.last_trigger_ts.get(name, 0.0)
+
+    def store_shard(self, shard: HomeShard) -> None:
+        """
+        Write edge/cooldown state of one home back to its shard (inverse of
+        load_shard); like evaluate_rules, only what changed is written.
+        """
+        store, r = shard.store, self._row[shard.home_id]
+        flags = {name: bool(self.active[r, i]) for i, name in enumerate(RULE_NAMES)}
+        if flags != store.rule_flags(RULE_NAMES) or "manager_rules" not in store.last_state:
+            store.set_rule_flags(flags)
+            store.update_state("manager_rules", {"rule_active": flags})
+        for i, name in enumerate(RULE_NAMES):
+            ts = float(self.last_trigger[r, i])
+            if ts != store.last_trigger_ts.get(name, 0.0):
+                store.mark_trigger(name, ts)
+
+    # -----------------------------
+    # Tick
+    # -----------------------------
+    def conditions(self) -> np.ndarray:
+        """(homes, rules) bool matrix of rule conditions, as evaluate_rules computes them."""
+        n, c = len(self.home_ids), {k: v[: len(self.home_ids)] for k, v in self.cols.items()}
+        cond = np.empty((n, len(RULE_NAMES)), np.bool_)
+        cond[:, _INTRUSION] = c["intrusion_enabled"] & c["armed"] & (c["open_count"] > 0)
+        cond[:, _FIRE] = (
+            c["fire_enabled"]
+            & c["temp_ok"] & c["pm10_ok"]
+            & (c["temp"] >= c["temp_threshold"])
+            & (c["pm10"] >= c["pm10_threshold"])
+        )
+        cond[:, _GAS] = c["gas_enabled"] & c["gas_spike"]
+        cond[:, _ANOMALY] = c["anomaly_enabled"] & c["meter_anomaly"]
+        return cond
+
+    def evaluate(self, now_s: float) -> Results:
+        """
+        Evaluate all rules for all homes at now_s. Returns commands/events of
+        the homes where at least one rule fired; edge and cooldown state is
+        updated for every home.
+        """
+        n = len(self.home_ids)
+        if n == 0:
+            return {}
+        cond = self.conditions()
+        active, last = self.active[:n], self.last_trigger[:n]
+        cooldown_ok = (now_s - last) >= self.cols["cooldown_seconds"][:n, None]
+        fire = cond & ~active & cooldown_ok
+
+        last[fire] = now_s
+        active[:] = cond
+
+        results: Results = {}
+        for r in np.flatnonzero(fire.any(axis=1)).tolist():
+            commands: List[Command] = []
+            events: List[Dict[str, Any]] = []
+            home_id = self.home_ids[r]
+            for i in np.flatnonzero(fire[r]).tolist():
+                meters = None
+                if i == _GAS:
+                    meters = self._spiking.get(home_id, {})
+                elif i == _ANOMALY:
+                    meters = self._anomalous.get(home_id, {})
+                fired = rule_commands(RULE_NAMES[i], meters)
+                commands += fired
+                events.append(rule_event(RULE_NAMES[i], now_s, fired, meters))
+            results[home_id] = (commands, events)
+        return results
+
+
+# (shard, commands, events) of a home where a rule fired; called under shard.lock
+EmitFn = Callable[[HomeShard, List[Command], List[Dict[str, Any]]], None]
+
+
+class BatchRuleScheduler:
+    """
+    Tick-based builtin rule evaluation over all homes (manager batch mode).
+    Message handling calls mark(home_id) instead of evaluating the builtin
+    rules; every tick_s the inputs of the marked homes are reloaded from
+    their shards, one BatchRuleEvaluator.evaluate() covers every home, and
+    emit() gets the commands/events of homes that fired. Unmarked homes
+    cannot fire (their conditions equal their edge flags), so the result
+    per home is what per-message evaluation would give, up to tick_s later.
+    """
+
+    def __init__(
+        self,
+        shards: HomeShards,
+        emit: EmitFn,
+        tick_s: float = 0.1,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.shards = shards
+        self.emit = emit
+        self.tick_s = tick_s
+        self.clock = clock
+        self.evaluator = BatchRuleEvaluator()
+        self._marked: Set[HomeId] = set()
+        self._lock = threading.Lock()  # guards _marked and the counters
+        self._tick_lock = threading.Lock()  # one tick at a time (thread and callers of tick())
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ticks = 0
+        self.homes_loaded = 0
+        self.homes_fired = 0
+        self.last_tick_s = 0.0
+        self.errors = 0
+
+    def mark(self, home_id: HomeId) -> None:
+        """Evaluate this home's builtin rules on the next tick."""
+        with self._lock:
+            self._marked.add(home_id)
+
+    def tick(self, now_s: Optional[float] = None) -> int:
+        """Evaluate once; returns the number of homes where a rule fired."""
+        with self._tick_lock:
+            t0 = metrics.clock()
+            with self._lock:
+                marked, self._marked = self._marked, set()
+            ev = self.evaluator
+            for home_id in marked:
+                shard = self.shards.get(home_id)
+                with shard.lock:
+                    ev.load_shard(shard)
+            results = ev.evaluate(self.clock() if now_s is None else now_s)
+            for home_id in marked | results.keys():
+                shard = self.shards.get(home_id)
+                with shard.lock:
+                    ev.store_shard(shard)
+                    if home_id in results:
+                        self.emit(shard, *results[home_id])
+            with self._lock:
+                self.ticks += 1
+                self.homes_loaded += len(marked)
+                self.homes_fired += len(results)
+                self.last_tick_s = metrics.clock() - t0
+            return len(results)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.tick_s):
+            try:
+                self.tick()
+            except Exception:  # keep ticking; the next tick reloads every known home
+                with self._lock:
+                    self.errors += 1
+                    self._marked.update(self.evaluator.home_ids)
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="batch-rules", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the ticker after one last tick (so marked homes are not left unevaluated)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.tick()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "homes": len(self.evaluator),
+                "pending": len(self._marked),
+                "ticks": self.ticks,
+                "homes_loaded": self.homes_loaded,
+                "homes_fired": self.homes_fired,
+                "last_tick_ms": round(self.last_tick_s * 1e3, 3),
+                "errors": self.errors,
+            }
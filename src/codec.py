@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple, TypedDict, Union
+
+from .models import Channel, DeviceId, HomeId
+from .wire import decode_envelope_bin, is_binary
+
+try:  # optional fast decoders, stdlib json is the fallback
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+MAX_PAYLOAD_BYTES = 16 * 1024
+TOPIC_CACHE_SIZE = 65536
+
+CHANNELS = ("telemetry", "state", "cmd")
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def parse_topic(topic: str) -> Optional[Tuple[HomeId, DeviceId, Channel]]:
+    """home/<home_id>/<device_id>/<channel> -> (home_id, device_id, channel), None if not ours."""
+    parts = topic.split("/")
+    if len(parts) != 4 or parts[0] != "home" or parts[3] not in CHANNELS:
+        return None
+    if not parts[1] or not parts[2]:
+        return None
+    return parts[1], parts[2], parts[3]  # type: ignore[return-value]
+
+
+class EnvelopeSchema(TypedDict, total=False):
+    """Typed view of make_envelope() output, used by schema-aware decoders."""
+    ts: Union[str, float, int]
+    home_id: str
+    device_id: str
+    device_type: str
+    data: Dict[str, Any]
+
+
+def _stdlib_loads(raw: bytes) -> Any:
+    # json.loads(bytes) runs a pure-Python encoding sniff first; an explicit decode is faster
+    return json.loads(raw.decode("utf-8"))
+
+
+def _select_backend() -> Tuple[str, Callable[[bytes], Any]]:
+    if msgspec is not None:
+        decoder = msgspec.json.Decoder(EnvelopeSchema)
+        return "msgspec", decoder.decode
+    if orjson is not None:
+        return "orjson", orjson.loads
+    return "json", _stdlib_loads
+
+
+BACKEND, _loads = _select_backend()
+
+_DECODE_ERRORS: Tuple[type, ...] = (ValueError, UnicodeDecodeError)
+if msgspec is not None:
+    _DECODE_ERRORS += (msgspec.DecodeError,)
+
+
+class EnvelopeDecoder:
+    """
+    Decodes telemetry/state envelopes (see models.make_envelope) straight
+    from the MQTT payload bytes, JSON or the binary format of src/wire.py
+    (detected by its magic byte).
+    - rejects oversized payloads before parsing
+    - rejects anything that is not an object with a string device_type and a dict data
+    - home_id/device_id are taken from the topic, never trusted from the payload
+    """
+
+    def __init__(self, max_bytes: int = MAX_PAYLOAD_BYTES, loads: Optional[Callable[[bytes], Any]] = None) -> None:
+        self.max_bytes = max_bytes
+        self._loads = loads or _loads
+        self._lock = threading.Lock()  # guards counters only
+        self.decoded = 0
+        self.rejected_size = 0
+        self.rejected_malformed = 0
+
+    def _reject(self, oversized: bool) -> None:
+        with self._lock:
+            if oversized:
+                self.rejected_size += 1
+            else:
+                self.rejected_malformed += 1
+
+    def decode(self, raw: bytes, home_id: HomeId, device_id: DeviceId) -> Optional[Dict[str, Any]]:
+        if len(raw) > self.max_bytes:
+            self._reject(True)
+            return None
+        if is_binary(raw):
+            try:
+                env = decode_envelope_bin(raw, home_id, device_id)
+            except ValueError:
+                self._reject(False)
+                return None
+            with self._lock:
+                self.decoded += 1
+            return env
+        # cheap pre-check: JSON object (allow leading whitespace)
+        if raw[:1] != b"{" and raw.lstrip()[:1] != b"{":
+            self._reject(False)
+            return None
+        try:
+            env = self._loads(raw)
+        except _DECODE_ERRORS:
+            self._reject(False)
+            return None
+
+        if not isinstance(env.get("device_type"), str) or not isinstance(env.get("data"), dict):
+            self._reject(False)
+            return None
+
+        env["home_id"] = home_id
+        env["device_id"] = device_id
+        with self._lock:
+            self.decoded += 1
+        return env
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": BACKEND,
+                "decoded": self.decoded,
+                "rejected_size": self.rejected_size,
+                "rejected_malformed": self.rejected_malformed,
+                "topic_cache": parse_topic.cache_info()._asdict(),
+            }
@@ -1,142 +1,148 @@
 from __future__ import annotations
 
 import argparse
-import json
 import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import paho.mqtt.client as mqtt
+from src.models import topic
+from src.wire import WIRE_FORMATS, WireFormat, pack_envelope, unpack_cmd
 
-from src.models import make_envelope, topic
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqtt
 
 
-def run_alarm_controller(home_id: str, device_id: str) -> None:
-    """
-    Alarm Controller (siren) actuator: ON/OFF.
-    """
-    is_on = False
-    client = mqtt.Client(client_id=f"{device_id}_act", clean_session=True)
+class OnOffActuator:
+    """ON/OFF actuator (siren, sprinkler): a "set" cmd with "on" is applied and reported as state."""
 
-    def on_message(_c, _u, msg: mqtt.MQTTMessage) -> None:
-        nonlocal is_on
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-        except Exception:
-            return
-        if payload.get("action") == "set":
-            params = payload.get("params", {})
-            if "on" in params:
-                is_on = bool(params["on"])
-                st = make_envelope(home_id, device_id, "alarm_controller", {"on": is_on})
-                client.publish(topic(home_id, device_id, "state"), json.dumps(st), qos=0, retain=False)
+    periodic = False
 
-    client.on_message = on_message
-    client.connect("127.0.0.1", 1883, keepalive=60)
-    client.subscribe(topic(home_id, device_id, "cmd"), qos=0)
-    client.loop_forever()
+    def __init__(self, device_type: str) -> None:
+        self.device_type = device_type
+        self.is_on = False
+
+    def tick(self) -> Optional[Dict[str, Any]]:
+        return None
+
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        if action != "set" or "on" not in params:
+            return []
+        self.is_on = bool(params["on"])
+        return [("state", {"on": self.is_on})]
 
 
-def run_alarm_switch(home_id: str, device_id: str) -> None:
+class AlarmSwitch:
     """
-    Alarm Switch actuator: arms/disarms the system.
-    Publish telemetry with {"armed": bool} so Manager can reflect it.
+    Arms/disarms the system. The armed flag is published as telemetry
+    (not state) so the manager reflects it in its config.
     """
-    armed = False
-    client = mqtt.Client(client_id=f"{device_id}_act", clean_session=True)
 
-    def on_message(_c, _u, msg: mqtt.MQTTMessage) -> None:
-        nonlocal armed
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-        except Exception:
-            return
-        if payload.get("action") == "set":
-            params = payload.get("params", {})
-            if "armed" in params:
-                armed = bool(params["armed"])
-                t = make_envelope(home_id, device_id, "alarm_switch", {"armed": armed})
-                client.publish(topic(home_id, device_id, "telemetry"), json.dumps(t), qos=0, retain=False)
+    device_type = "alarm_switch"
+    periodic = False
 
-    client.on_message = on_message
-    client.connect("127.0.0.1", 1883, keepalive=60)
-    client.subscribe(topic(home_id, device_id, "cmd"), qos=0)
-    client.loop_forever()
+    def __init__(self) -> None:
+        self.armed = False
+
+    def tick(self) -> Optional[Dict[str, Any]]:
+        return None
 
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        if action != "set" or "armed" not in params:
+            return []
+        self.armed = bool(params["armed"])
+        return [("telemetry", {"armed": self.armed})]
 
-def run_sprinkler(home_id: str, device_id: str) -> None:
+
+class MobileLight:
     """
-    Irrigation Controller used as sprinkler: ON/OFF.
+    Hybrid (actuator + energy consumption sensor).
+    - Actuation: ON/OFF + level
+    - Telemetry: energy consumption
     """
-    is_on = False
-    client = mqtt.Client(client_id=f"{device_id}_act", clean_session=True)
+
+    device_type = "mobile_light"
+    periodic = True
+
+    def __init__(self) -> None:
+        self.is_on = False
+        self.level = "LOW"
+        self.energy_kwh = 0.0
+
+    def tick(self) -> Dict[str, Any]:
+        # very rough energy simulation
+        if self.is_on:
+            if self.level == "HIGH":
+                self.energy_kwh += 0.05
+            elif self.level == "MEDIUM":
+                self.energy_kwh += 0.03
+            else:
+                self.energy_kwh += 0.01
+        return {"energy_kwh": round(self.energy_kwh, 4), "on": self.is_on, "level": self.level}
+
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        if action != "set":
+            return []
+        if "on" in params:
+            self.is_on = bool(params["on"])
+        if "level" in params:
+            self.level = str(params["level"]).upper()
+        return [("state", {"on": self.is_on, "level": self.level})]
+
+
+def _serve(home_id: str, device_id: str, device: Any, client_suffix: str, wire: WireFormat) -> mqtt.Client:
+    """Connect, subscribe to this device's cmd topic and publish the device's responses."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id=f"{device_id}_{client_suffix}", clean_session=True)
 
     def on_message(_c, _u, msg: mqtt.MQTTMessage) -> None:
-        nonlocal is_on
         try:
-            payload = json.loads(msg.payload.decode("utf-8"))
+            payload = unpack_cmd(msg.payload, home_id, device_id)
         except Exception:
             return
-        if payload.get("action") == "set":
-            params = payload.get("params", {})
-            if "on" in params:
-                is_on = bool(params["on"])
-                st = make_envelope(home_id, device_id, "sprinkler", {"on": is_on})
-                client.publish(topic(home_id, device_id, "state"), json.dumps(st), qos=0, retain=False)
+        for channel, data in device.on_cmd(payload.get("action"), payload.get("params", {})):
+            out = pack_envelope(home_id, device_id, device.device_type, data, wire)
+            client.publish(topic(home_id, device_id, channel), out, qos=0, retain=False)
 
     client.on_message = on_message
     client.connect("127.0.0.1", 1883, keepalive=60)
     client.subscribe(topic(home_id, device_id, "cmd"), qos=0)
-    client.loop_forever()
+    return client
 
 
-def run_mobile_light(home_id: str, device_id: str) -> None:
+def run_alarm_controller(home_id: str, device_id: str, wire: WireFormat = "json") -> None:
     """
-    Mobile Light is hybrid (actuator + energy consumption sensor).
-    - Actuation: ON/OFF + level
-    - Telemetry: energy consumption
+    Alarm Controller (siren) actuator: ON/OFF.
     """
-    is_on = False
-    level = "LOW"
-    energy_kwh = 0.0
+    _serve(home_id, device_id, OnOffActuator("alarm_controller"), "act", wire).loop_forever()
 
-    client = mqtt.Client(client_id=f"{device_id}_hybrid", clean_session=True)
 
-    def on_message(_c, _u, msg: mqtt.MQTTMessage) -> None:
-        nonlocal is_on, level
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-        except Exception:
-            return
-        if payload.get("action") == "set":
-            params = payload.get("params", {})
-            if "on" in params:
-                is_on = bool(params["on"])
-            if "level" in params:
-                level = str(params["level"]).upper()
+def run_alarm_switch(home_id: str, device_id: str, wire: WireFormat = "json") -> None:
+    """
+    Alarm Switch actuator: arms/disarms the system.
+    Publish telemetry with {"armed": bool} so Manager can reflect it.
+    """
+    _serve(home_id, device_id, AlarmSwitch(), "act", wire).loop_forever()
 
-            st = make_envelope(home_id, device_id, "mobile_light", {"on": is_on, "level": level})
-            client.publish(topic(home_id, device_id, "state"), json.dumps(st), qos=0, retain=False)
 
-    client.on_message = on_message
-    client.connect("127.0.0.1", 1883, keepalive=60)
-    client.subscribe(topic(home_id, device_id, "cmd"), qos=0)
+def run_sprinkler(home_id: str, device_id: str, wire: WireFormat = "json") -> None:
+    """
+    Irrigation Controller used as sprinkler: ON/OFF.
+    """
+    _serve(home_id, device_id, OnOffActuator("sprinkler"), "act", wire).loop_forever()
+
+
+def run_mobile_light(home_id: str, device_id: str, wire: WireFormat = "json") -> None:
+    """
+    Mobile Light is hybrid (actuator + energy consumption sensor).
+    """
+    light = MobileLight()
+    client = _serve(home_id, device_id, light, "hybrid", wire)
     client.loop_start()
 
     # Periodic telemetry loop
     while True:
-        # very rough energy simulation
-        if is_on:
-            if level == "HIGH":
-                energy_kwh += 0.05
-            elif level == "MEDIUM":
-                energy_kwh += 0.03
-            else:
-                energy_kwh += 0.01
-
-        tel = make_envelope(
-            home_id, device_id, "mobile_light",
-            {"energy_kwh": round(energy_kwh, 4), "on": is_on, "level": level}
-        )
-        client.publish(topic(home_id, device_id, "telemetry"), json.dumps(tel), qos=0, retain=False)
+        tel = pack_envelope(home_id, device_id, light.device_type, light.tick(), wire)
+        client.publish(topic(home_id, device_id, "telemetry"), tel, qos=0, retain=False)
         time.sleep(2.0)
 
 
@@ -145,16 +151,17 @@ def main() -> None:
     ap.add_argument("--home-id", default="home_1")
     ap.add_argument("--device", choices=["alarm_controller", "alarm_switch", "sprinkler", "mobile_light"], required=True)
     ap.add_argument("--device-id", required=True)
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json", help="Payload encoding (json or compact binary).")
     args = ap.parse_args()
 
     if args.device == "alarm_controller":
-        run_alarm_controller(args.home_id, args.device_id)
+        run_alarm_controller(args.home_id, args.device_id, args.wire)
     elif args.device == "alarm_switch":
-        run_alarm_switch(args.home_id, args.device_id)
+        run_alarm_switch(args.home_id, args.device_id, args.wire)
     elif args.device == "sprinkler":
-        run_sprinkler(args.home_id, args.device_id)
+        run_sprinkler(args.home_id, args.device_id, args.wire)
     else:
-        run_mobile_light(args.home_id, args.device_id)
+        run_mobile_light(args.home_id, args.device_id, args.wire)
 
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@ from __future__ import annotations
 import argparse
 import json
 import time
-import paho.mqtt.client as mqtt
 
 from src.models import make_envelope, topic
 
@@ -15,6 +14,8 @@ def main() -> None:
     2) Fire: temp & pm10 high -> siren + sprinkler
     3) Gas spike: high delta -> siren + gas supply off
     """
+    import paho.mqtt.client as mqtt
+
     ap = argparse.ArgumentParser()
     ap.add_argument("--home-id", default="home_1")
     args = ap.parse_args()
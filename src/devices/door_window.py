@@ -1,21 +1,44 @@
 from __future__ import annotations
 
 import argparse
-import json
 import random
 import time
-import paho.mqtt.client as mqtt
+from typing import Any, Dict, List, Optional, Tuple
 
-from src.models import make_envelope, topic
+from src.models import topic
+from src.wire import WIRE_FORMATS, pack_envelope
+
+
+class DoorWindowSensor:
+    """Door/window contact: flips open/closed with flip_prob per tick."""
+
+    device_type = "door_window"
+    periodic = True
+
+    def __init__(self, flip_prob: float = 0.2, rnd: Optional[random.Random] = None) -> None:
+        self.flip_prob = flip_prob
+        self.rnd = rnd or random.Random()
+        self.is_open = False
+
+    def tick(self) -> Dict[str, Any]:
+        if self.rnd.random() < self.flip_prob:
+            self.is_open = not self.is_open
+        return {"open": self.is_open}
+
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        return []
 
 
 def main() -> None:
     """Door/Window Sensor emulator."""
+    import paho.mqtt.client as mqtt
+
     ap = argparse.ArgumentParser()
     ap.add_argument("--home-id", default="home_1")
     ap.add_argument("--device-id", required=True)  # e.g., door_1 or window_1
     ap.add_argument("--period", type=float, default=2.0)
     ap.add_argument("--flip-prob", type=float, default=0.2, help="Probability to flip open/closed per tick.")
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json", help="Payload encoding (json or compact binary).")
     args = ap.parse_args()
 
     home_id = args.home_id
@@ -24,19 +47,17 @@ def main() -> None:
     client = mqtt.Client(client_id=f"{device_id}_sensor", clean_session=True)
     client.connect("127.0.0.1", 1883, keepalive=60)
 
-    is_open = False
+    sensor = DoorWindowSensor(args.flip_prob)
 
     while True:
-        if random.random() < args.flip_prob:
-            is_open = not is_open
-
-        payload = make_envelope(
+        payload = pack_envelope(
             home_id=home_id,
             device_id=device_id,
-            device_type="door_window",
-            payload={"open": is_open},
+            device_type=sensor.device_type,
+            payload=sensor.tick(),
+            wire=args.wire,
         )
-        client.publish(topic(home_id, device_id, "telemetry"), json.dumps(payload), qos=0, retain=False)
+        client.publish(topic(home_id, device_id, "telemetry"), payload, qos=0, retain=False)
         time.sleep(args.period)
 
 
@@ -1,42 +1,65 @@
 from __future__ import annotations
 
 import argparse
-import json
 import random
 import time
-import paho.mqtt.client as mqtt
+from typing import Any, Dict, List, Optional, Tuple
 
-from src.models import make_envelope, topic
+from src.models import topic
+from src.wire import WIRE_FORMATS, pack_envelope
+
+
+class EnvNode:
+    """Environmental node: noisy temperature/PM10 readings around a base value."""
+
+    device_type = "environment"
+    periodic = True
+
+    def __init__(self, base_temp: float = 22.0, base_pm10: float = 20.0, rnd: Optional[random.Random] = None) -> None:
+        self.base_temp = base_temp
+        self.base_pm10 = base_pm10
+        self.rnd = rnd or random.Random()
+
+    def tick(self) -> Dict[str, Any]:
+        # Simple noisy readings
+        temperature = self.base_temp + self.rnd.uniform(-0.5, 0.5)
+        pm10 = self.base_pm10 + self.rnd.uniform(-2.0, 2.0)
+        return {"temperature": round(temperature, 2), "pm10": round(pm10, 2)}
+
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        return []
 
 
 def main() -> None:
     """
     Environmental Monitoring emulator.
     """
+    import paho.mqtt.client as mqtt
+
     ap = argparse.ArgumentParser()
     ap.add_argument("--home-id", default="home_1")
     ap.add_argument("--device-id", default="env_1")
     ap.add_argument("--period", type=float, default=2.0)
     ap.add_argument("--base-temp", type=float, default=22.0)
     ap.add_argument("--base-pm10", type=float, default=20.0)
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json", help="Payload encoding (json or compact binary).")
     args = ap.parse_args()
 
     client = mqtt.Client(client_id=f"{args.device_id}_env", clean_session=True)
     client.connect("127.0.0.1", 1883, keepalive=60)
 
-    while True:
-        # Simple noisy readings
-        temperature = args.base_temp + random.uniform(-0.5, 0.5)
-        pm10 = args.base_pm10 + random.uniform(-2.0, 2.0)
+    node = EnvNode(args.base_temp, args.base_pm10)
 
-        payload = make_envelope(
+    while True:
+        payload = pack_envelope(
             home_id=args.home_id,
             device_id=args.device_id,
-            device_type="environment",
-            payload={"temperature": round(temperature, 2), "pm10": round(pm10, 2)},
+            device_type=node.device_type,
+            payload=node.tick(),
+            wire=args.wire,
         )
 
-        client.publish(topic(args.home_id, args.device_id, "telemetry"), json.dumps(payload), qos=0, retain=False)
+        client.publish(topic(args.home_id, args.device_id, "telemetry"), payload, qos=0, retain=False)
         time.sleep(args.period)
 
 
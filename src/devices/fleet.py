@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import heapq
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.codec import parse_topic
+from src.models import ALL_HOMES, topic, wildcard_cmd
+from src.wire import WIRE_FORMATS, WireFormat, pack_envelope, unpack_cmd
+from src.devices.actuators import AlarmSwitch, MobileLight, OnOffActuator
+from src.devices.door_window import DoorWindowSensor
+from src.devices.env_node import EnvNode
+from src.devices.utility_meter import UtilityMeter
+
+Publish = Callable[[str, bytes], None]
+
+# device_type -> behaviour factory (the same classes the single-device emulators run)
+DEVICE_FACTORIES: Dict[str, Callable[[random.Random], Any]] = {
+    "door_window": lambda rnd: DoorWindowSensor(rnd=rnd),
+    "environment": lambda rnd: EnvNode(rnd=rnd),
+    "gas_meter": lambda rnd: UtilityMeter("gas", rnd),
+    "electricity_meter": lambda rnd: UtilityMeter("electricity", rnd),
+    "water_meter": lambda rnd: UtilityMeter("water", rnd),
+    "alarm_controller": lambda rnd: OnOffActuator("alarm_controller"),
+    "alarm_switch": lambda rnd: AlarmSwitch(),
+    "sprinkler": lambda rnd: OnOffActuator("sprinkler"),
+    "mobile_light": lambda rnd: MobileLight(),
+}
+
+# devices per home, as in the demo home
+DEFAULT_MIX: Dict[str, int] = {
+    "door_window": 2,
+    "environment": 1,
+    "gas_meter": 1,
+    "electricity_meter": 1,
+    "water_meter": 1,
+    "alarm_controller": 1,
+    "alarm_switch": 1,
+    "sprinkler": 1,
+    "mobile_light": 1,
+}
+
+DEFAULT_PERIOD_S = 2.0
+
+# id prefix for numbered devices; other types use their device_type
+_ID_PREFIX = {"door_window": "door", "environment": "env"}
+
+
+def device_ids(device_type: str, count: int) -> List[str]:
+    """
+    door_1, door_2, env_1, ...; actuators and meters keep the plain id the
+    manager's rules send commands to (gas_meter, sprinkler, ...) for the
+    first device and get a suffix for further ones (gas_meter_2).
+    """
+    prefix = _ID_PREFIX.get(device_type)
+    if prefix is not None:
+        return [f"{prefix}_{i}" for i in range(1, count + 1)]
+    return [device_type if i == 1 else f"{device_type}_{i}" for i in range(1, count + 1)]
+
+
+@dataclass
+class VirtualDevice:
+    home_id: str
+    device_id: str
+    device: Any  # behaviour object: device_type, periodic, tick(), on_cmd()
+    period_s: float
+    conn: int  # index of the broker connection it publishes on
+
+
+class Fleet:
+    """
+    Many virtual devices in one asyncio task.
+
+    Periodic devices sit in a heap keyed by their next due time. run() pops
+    the due ones, publishes their tick() through the device's connection
+    and reschedules them one period (+/- jitter) later, so the aggregate
+    rate holds even when individual sends are late. Commands are routed to
+    the addressed device's on_cmd() and its responses are published at once.
+    """
+
+    def __init__(
+        self,
+        publishers: Sequence[Publish],
+        wire: WireFormat = "json",
+        jitter: float = 0.1,
+        seed: int = 0,
+    ) -> None:
+        if not publishers:
+            raise ValueError("at least one publisher is required")
+        self.publishers = list(publishers)
+        self.wire = wire
+        self.jitter = jitter
+        self.rnd = random.Random(seed)
+        self.devices: Dict[Tuple[str, str], VirtualDevice] = {}
+
+        self.sent = 0
+        self.sent_by_type: Dict[str, int] = {}
+        self.cmds = 0
+        self.max_lag_s = 0.0
+
+    def add(self, home_id: str, device_type: str, count: int, period_s: float = DEFAULT_PERIOD_S) -> None:
+        if device_type not in DEVICE_FACTORIES:
+            raise ValueError(f"unknown device type: {device_type}")
+        for device_id in device_ids(device_type, count):
+            conn = len(self.devices) % len(self.publishers)
+            dev = VirtualDevice(home_id, device_id, DEVICE_FACTORIES[device_type](self.rnd), period_s, conn)
+            self.devices[(home_id, device_id)] = dev
+
+    @property
+    def nominal_rate(self) -> float:
+        """Telemetry messages per second at the configured periods."""
+        return sum(1.0 / d.period_s for d in self.devices.values() if d.device.periodic)
+
+    def scale_to_rate(self, rate: float) -> None:
+        """Scale every period by the same factor so the fleet sends about `rate` msg/s."""
+        nominal = self.nominal_rate
+        if rate <= 0 or nominal <= 0:
+            return
+        factor = nominal / rate
+        for d in self.devices.values():
+            d.period_s *= factor
+
+    def _publish(self, dev: VirtualDevice, channel: str, data: Dict[str, Any]) -> None:
+        payload = pack_envelope(dev.home_id, dev.device_id, dev.device.device_type, data, self.wire)
+        self.publishers[dev.conn](topic(dev.home_id, dev.device_id, channel), payload)
+        self.sent += 1
+        dtype = dev.device.device_type
+        self.sent_by_type[dtype] = self.sent_by_type.get(dtype, 0) + 1
+
+    def handle_cmd(self, topic_name: str, raw: bytes) -> None:
+        """Apply a cmd to the addressed device (unknown devices and bad payloads are ignored)."""
+        parsed = parse_topic(topic_name)
+        if parsed is None or parsed[2] != "cmd":
+            return
+        dev = self.devices.get((parsed[0], parsed[1]))
+        if dev is None:
+            return
+        try:
+            cmd = unpack_cmd(raw, dev.home_id, dev.device_id)
+        except Exception:
+            return
+        self.cmds += 1
+        for channel, data in dev.device.on_cmd(cmd.get("action"), cmd.get("params", {})):
+            self._publish(dev, channel, data)
+
+    async def run(self, duration_s: Optional[float] = None, report_s: float = 0.0) -> None:
+        """Publish telemetry until duration_s elapses (forever if None)."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + duration_s if duration_s is not None else None
+        # random phase so devices do not all fire together
+        heap = [
+            (start + self.rnd.uniform(0.0, d.period_s), i, d)
+            for i, d in enumerate(self.devices.values())
+            if d.device.periodic
+        ]
+        heapq.heapify(heap)
+        next_report = start + report_s if report_s > 0 else None
+        reported = (start, 0)
+        burst = 0
+
+        if not heap:
+            # actuators only: just serve commands
+            await asyncio.sleep(duration_s if duration_s is not None else float("inf"))
+            return
+
+        while True:
+            now = loop.time()
+            if end is not None and now >= end:
+                break
+            if next_report is not None and now >= next_report:
+                reported = self._report(now - start, now, reported)
+                next_report += report_s
+            due, seq, dev = heap[0]
+            if due > now:
+                burst = 0
+                wake = due if end is None else min(due, end)
+                await asyncio.sleep(wake - now)
+                continue
+            self.max_lag_s = max(self.max_lag_s, now - due)
+            period = dev.period_s * (1.0 + self.rnd.uniform(-self.jitter, self.jitter))
+            heapq.heapreplace(heap, (due + period, seq, dev))
+            self._publish(dev, "telemetry", dev.device.tick())
+            burst += 1
+            if burst >= 256:
+                # behind schedule: still let cmd handling and the clients run
+                burst = 0
+                await asyncio.sleep(0)
+
+    def _report(self, elapsed: float, now: float, prev: Tuple[float, int]) -> Tuple[float, int]:
+        rate = (self.sent - prev[1]) / max(now - prev[0], 1e-9)
+        print(f"t={elapsed:6.1f}s sent={self.sent} ({rate:,.0f} msg/s) cmds={self.cmds} max_lag={self.max_lag_s:.3f}s", flush=True)
+        return now, self.sent
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """"door_window=4,environment=2" -> {"door_window": 4, "environment": 2}"""
+    mix: Dict[str, int] = {}
+    for item in spec.split(","):
+        name, _, count = item.strip().partition("=")
+        if name not in DEVICE_FACTORIES or not count.isdigit():
+            raise ValueError(f"bad device spec {item!r}; types: {', '.join(DEVICE_FACTORIES)}")
+        mix[name] = int(count)
+    return mix
+
+
+def parse_periods(items: List[str]) -> Dict[str, float]:
+    """["environment=5", "door_window=1"] -> seconds per device type"""
+    periods: Dict[str, float] = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if name not in DEVICE_FACTORIES or not value:
+            raise ValueError(f"bad --period {item!r}; expected TYPE=SECONDS")
+        periods[name] = float(value)
+    return periods
+
+
+def _connect(host: str, port: int, n: int, fleet_holder: List[Fleet], loop: asyncio.AbstractEventLoop) -> Tuple[List[Any], List[Publish]]:
+    """n paho clients; the first also receives every cmd and hands it to the event loop."""
+    import paho.mqtt.client as mqtt
+
+    clients = []
+    for i in range(n):
+        c = mqtt.Client(client_id=f"fleet_{i}", clean_session=True)
+        if i == 0:
+            c.on_message = lambda _c, _u, msg: loop.call_soon_threadsafe(fleet_holder[0].handle_cmd, msg.topic, msg.payload)
+        c.connect(host, port, keepalive=60)
+        if i == 0:
+            c.subscribe(wildcard_cmd(ALL_HOMES), qos=0)
+        c.loop_start()
+        clients.append(c)
+    publishers = [lambda t, p, c=c: c.publish(t, p, qos=0, retain=False) for c in clients]
+    return clients, publishers
+
+
+async def _amain(args: argparse.Namespace, mix: Dict[str, int], periods: Dict[str, float]) -> Fleet:
+    holder: List[Fleet] = []
+    clients, publishers = _connect(args.host, args.port, args.connections, holder, asyncio.get_running_loop())
+    fleet = Fleet(publishers, wire=args.wire, jitter=args.jitter, seed=args.seed)
+    holder.append(fleet)
+    for h in range(1, args.homes + 1):
+        for dtype, count in mix.items():
+            fleet.add(f"{args.home_prefix}{h}", dtype, count, periods.get(dtype, args.default_period))
+    if args.rate:
+        fleet.scale_to_rate(args.rate)
+    print(f"{len(fleet.devices)} devices in {args.homes} homes over {args.connections} connections, "
+          f"~{fleet.nominal_rate:,.0f} msg/s", flush=True)
+    try:
+        await fleet.run(args.duration, args.report)
+    finally:
+        for c in clients:
+            c.loop_stop()
+            c.disconnect()
+    return fleet
+
+
+def main() -> None:
+    """
+    Fleet emulator: N homes x a device mix in one asyncio process, over a
+    small pool of broker connections.
+
+        python -m src.devices.fleet --homes 500 --devices door_window=4,environment=2 --rate 5000
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--homes", type=int, default=10)
+    ap.add_argument("--home-prefix", default="home_", help="home ids are <prefix>1..<prefix>N")
+    ap.add_argument("--devices", default=None, metavar="TYPE=N,...",
+                    help="devices per home (default: the demo home, one of each plus two door/window sensors)")
+    ap.add_argument("--period", action="append", default=[], metavar="TYPE=SECONDS",
+                    help="telemetry period of a device type (repeatable)")
+    ap.add_argument("--default-period", type=float, default=DEFAULT_PERIOD_S)
+    ap.add_argument("--jitter", type=float, default=0.1, help="relative +/- jitter applied to every period")
+    ap.add_argument("--rate", type=float, default=0.0, help="target aggregate msg/s (rescales all periods)")
+    ap.add_argument("--connections", type=int, default=4)
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json", help="Payload encoding (json or compact binary).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--duration", type=float, default=None, help="seconds to run (default: forever)")
+    ap.add_argument("--report", type=float, default=10.0, help="seconds between progress lines (0 = off)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    try:
+        mix = parse_mix(args.devices) if args.devices else dict(DEFAULT_MIX)
+        periods = parse_periods(args.period)
+    except ValueError as e:
+        ap.error(str(e))
+    if args.connections < 1:
+        ap.error("--connections must be >= 1")
+
+    t0 = time.perf_counter()
+    try:
+        fleet = asyncio.run(_amain(args, mix, periods))
+    except KeyboardInterrupt:
+        return
+    wall = time.perf_counter() - t0
+    print(f"sent {fleet.sent} messages in {wall:.1f}s ({fleet.sent / wall:,.0f} msg/s), "
+          f"{fleet.cmds} cmds handled; by type: {dict(sorted(fleet.sent_by_type.items()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,58 @@
 from __future__ import annotations
 
 import argparse
-import json
 import random
 import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import paho.mqtt.client as mqtt
+from src.models import topic
+from src.wire import WIRE_FORMATS, pack_envelope, unpack_cmd
 
-from src.models import make_envelope, topic
+# --meter choice -> (device_type, unit)
+METERS: Dict[str, Tuple[str, str]] = {
+    "electricity": ("electricity_meter", "kWh"),
+    "gas": ("gas_meter", "kg"),
+    "water": ("water_meter", "L"),
+}
+
+
+class UtilityMeter:
+    """
+    Consumption sensor + supply switch (hybrid device).
+    tick() accumulates a small random consumption while the supply is on;
+    a "set" cmd with supply_on toggles the supply and reports it as state.
+    """
+
+    periodic = True
+
+    def __init__(self, meter: str, rnd: Optional[random.Random] = None) -> None:
+        self.device_type, self.unit = METERS[meter]
+        self.rnd = rnd or random.Random()
+        self.supply_on = True
+        self.total = 0.0
+
+    def tick(self) -> Dict[str, Any]:
+        prev_total = self.total
+
+        # When supply is OFF, consumption does not increase
+        if self.supply_on:
+            inc = self.rnd.uniform(0.02, 0.2)  # tiny increments for demo
+            self.total += inc
+
+        delta = self.total - prev_total
+        return {
+            "total": round(self.total, 4),
+            "delta": round(delta, 4),
+            "unit": self.unit,
+            "supply_on": self.supply_on,
+        }
+
+    def on_cmd(self, action: str, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        if action != "set" or "supply_on" not in params:
+            return []
+        self.supply_on = bool(params["supply_on"])
+        # publish state immediately
+        return [("state", {"supply_on": self.supply_on})]
 
 
 def main() -> None:
@@ -16,52 +61,30 @@ def main() -> None:
     Each meter has a consumption sensor + a supply switch ON/OFF.
     Emulate both (hybrid device): publishes telemetry and reacts to cmd to toggle supply.
     """
+    import paho.mqtt.client as mqtt
+
     ap = argparse.ArgumentParser()
     ap.add_argument("--home-id", default="home_1")
-    ap.add_argument("--meter", choices=["electricity", "gas", "water"], required=True)
+    ap.add_argument("--meter", choices=list(METERS), required=True)
     ap.add_argument("--device-id", required=True)  # e.g., gas_meter
     ap.add_argument("--period", type=float, default=2.0)
+    ap.add_argument("--wire", choices=WIRE_FORMATS, default="json", help="Payload encoding (json or compact binary).")
     args = ap.parse_args()
 
-    if args.meter == "electricity":
-        device_type = "electricity_meter"
-        unit = "kWh"
-    elif args.meter == "gas":
-        device_type = "gas_meter"
-        unit = "kg"
-    else:
-        device_type = "water_meter"
-        unit = "L"
-
     home_id = args.home_id
     device_id = args.device_id
-
-    supply_on = True
-    total = 0.0
-    prev_total = 0.0
+    meter = UtilityMeter(args.meter)
 
     client = mqtt.Client(client_id=f"{device_id}_meter", clean_session=True)
 
     def on_message(_c, _u, msg: mqtt.MQTTMessage) -> None:
-        nonlocal supply_on
         try:
-            payload = json.loads(msg.payload.decode("utf-8"))
+            payload = unpack_cmd(msg.payload, home_id, device_id)
         except Exception:
             return
-        if payload.get("action") != "set":
-            return
-        params = payload.get("params", {})
-        if "supply_on" in params:
-            supply_on = bool(params["supply_on"])
-
-            # publish state immediately
-            st = make_envelope(
-                home_id=home_id,
-                device_id=device_id,
-                device_type=device_type,
-                payload={"supply_on": supply_on},
-            )
-            client.publish(topic(home_id, device_id, "state"), json.dumps(st), qos=0, retain=False)
+        for channel, data in meter.on_cmd(payload.get("action"), payload.get("params", {})):
+            st = pack_envelope(home_id, device_id, meter.device_type, data, args.wire)
+            client.publish(topic(home_id, device_id, channel), st, qos=0, retain=False)
 
     client.on_message = on_message
     client.connect("127.0.0.1", 1883, keepalive=60)
@@ -69,27 +92,14 @@ def main() -> None:
     client.loop_start()
 
     while True:
-        prev_total = total
-
-        # When supply is OFF, consumption does not increase
-        if supply_on:
-            inc = random.uniform(0.02, 0.2)  # tiny increments for demo
-            total += inc
-
-        delta = total - prev_total
-
-        payload = make_envelope(
+        payload = pack_envelope(
             home_id=home_id,
             device_id=device_id,
-            device_type=device_type,
-            payload={
-                "total": round(total, 4),
-                "delta": round(delta, 4),
-                "unit": unit,
-                "supply_on": supply_on,
-            },
+            device_type=meter.device_type,
+            payload=meter.tick(),
+            wire=args.wire,
         )
-        client.publish(topic(home_id, device_id, "telemetry"), json.dumps(payload), qos=0, retain=False)
+        client.publish(topic(home_id, device_id, "telemetry"), payload, qos=0, retain=False)
         time.sleep(args.period)
 
 
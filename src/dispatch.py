@@ -0,0 +1,116 @@
+"""
+Command dispatch stage between rule evaluation and MQTT publish.
+
+For the commands of one evaluation:
+  - merge:    commands to the same target and action are folded into one
+              (params merged in order, later rules win on conflicts)
+  - suppress: a "set" whose params all equal the actuator's confirmed
+              state (last state, else last telemetry) is dropped. Only
+              reports received by this process within max_age_s count:
+              state restored after a restart, or an actuator silent for
+              longer, may no longer be true (e.g. a siren that reset).
+The manager then publishes what is left as one batch.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import Command, DeviceId
+from .state import StateStore
+
+_MISSING = object()
+
+
+def merge_commands(commands: List[Command]) -> List[Command]:
+    """One command per (target_id, action), in order of first appearance."""
+    if len(commands) < 2:
+        return list(commands)
+    merged: Dict[Tuple[DeviceId, str], Command] = {}
+    for c in commands:
+        key = (c.target_id, c.action)
+        prev = merged.get(key)
+        if prev is None:
+            merged[key] = Command(c.target_id, c.action, dict(c.params))
+        else:
+            prev.params.update(c.params)
+    return list(merged.values())
+
+
+def confirmed_value(
+    store: StateStore,
+    device_id: DeviceId,
+    key: str,
+    now_s: Optional[float] = None,
+    max_age_s: Optional[float] = None,
+) -> Any:
+    """
+    Value of `key` last reported by the device (state first, then telemetry);
+    _MISSING if never. Only reports this store received itself count (not
+    restored ones), and with max_age_s only those at most that old at now_s.
+    """
+    for kind, msgs in (("state", store.last_state), ("telemetry", store.last_telemetry)):
+        msg = msgs.get(device_id)
+        if msg is None:
+            continue
+        data = msg.get("data")
+        if not isinstance(data, dict) or key not in data:
+            continue
+        seen = store.reported_at(kind, device_id)
+        if seen is None or (max_age_s is not None and now_s is not None and now_s - seen > max_age_s):
+            continue
+        return data[key]
+    return _MISSING
+
+
+def is_confirmed(
+    store: StateStore,
+    cmd: Command,
+    now_s: Optional[float] = None,
+    max_age_s: Optional[float] = None,
+) -> bool:
+    """True if cmd is a "set" the device already reports as applied (see confirmed_value)."""
+    if cmd.action != "set" or not cmd.params:
+        return False
+    return all(confirmed_value(store, cmd.target_id, k, now_s, max_age_s) == v for k, v in cmd.params.items())
+
+
+class CommandDispatcher:
+    """Merges and suppresses commands per evaluation; counts what was saved."""
+
+    def __init__(self, suppress_confirmed: bool = True, max_age_s: Optional[float] = 300.0) -> None:
+        self.suppress_confirmed = suppress_confirmed
+        # reports older than this (or from before a restart) are not trusted; None = any report of this process
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()  # guards counters only
+        self.received = 0
+        self.merged = 0
+        self.suppressed = 0
+        self.sent = 0
+
+    def plan(self, commands: List[Command], store: StateStore) -> List[Command]:
+        """Commands to publish for one evaluation of one home."""
+        if not commands:
+            return []
+        merged = merge_commands(commands)
+        out = merged
+        if self.suppress_confirmed:
+            now = store.now()
+            out = [c for c in merged if not is_confirmed(store, c, now, self.max_age_s)]
+        with self._lock:
+            self.received += len(commands)
+            self.merged += len(commands) - len(merged)
+            self.suppressed += len(merged) - len(out)
+            self.sent += len(out)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "received": self.received,
+                "merged": self.merged,
+                "suppressed": self.suppressed,
+                "sent": self.sent,
+                "saved": self.merged + self.suppressed,
+            }
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import glob
+import gzip
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+# Lines per sparse-index block
+BLOCK_LINES = 256
+
+
+class _Segment:
+    """
+    Index of one JSONL segment (the active events.log or a rotated file).
+    - sparse timestamp index: per block of BLOCK_LINES lines, start offset + min/max ts
+    - per-rule and per-home indexes: (ts, offset) of every line carrying
+      that "rule" / "home_id", in log order, plus the running maximum of ts;
+      a range is found by bisecting the running maximum, widened by the
+      largest step back in time seen for the key (writer threads interleave)
+    Offsets are in the decompressed stream for .gz segments.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.gz = path.endswith(".gz")
+        self.file_id: Tuple[int, int] = (0, 0)
+        self.indexed_bytes = 0
+        self.min_ts = float("inf")
+        self.max_ts = float("-inf")
+
+        self.block_offsets = array("q")
+        self.block_min = array("d")
+        self.block_max = array("d")
+        self._block_lines = BLOCK_LINES  # lines in the last block (full => start a new one)
+
+        self.rules: Dict[str, Tuple[array, array, array]] = {}  # rule -> (ts, running max ts, offset)
+        self.homes: Dict[str, Tuple[array, array, array]] = {}  # home_id -> same
+        self._lag: Dict[Tuple[str, str], float] = {}  # (index name, key) -> largest (running max - ts)
+
+    def _open(self) -> IO[bytes]:
+        return gzip.open(self.path, "rb") if self.gz else open(self.path, "rb")
+
+    def refresh(self) -> None:
+        """Index complete lines appended since the last call."""
+        st = os.stat(self.path)
+        self.file_id = (st.st_dev, st.st_ino)
+        if not self.gz and st.st_size <= self.indexed_bytes:
+            return
+        if self.gz and self.indexed_bytes:
+            return  # closed segments never change
+
+        with self._open() as f:
+            f.seek(self.indexed_bytes)
+            offset = self.indexed_bytes
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial line still being written
+                self._index_line(offset, line)
+                offset += len(line)
+            self.indexed_bytes = offset
+
+    def _index_line(self, offset: int, line: bytes) -> None:
+        if self._block_lines >= BLOCK_LINES:
+            self.block_offsets.append(offset)
+            self.block_min.append(float("inf"))
+            self.block_max.append(float("-inf"))
+            self._block_lines = 0
+        self._block_lines += 1
+
+        try:
+            ev = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(ev, dict):
+            return
+        ts = ev.get("ts_unix")
+        if not isinstance(ts, (int, float)):
+            return
+        ts = float(ts)
+
+        b = len(self.block_offsets) - 1
+        if ts < self.block_min[b]:
+            self.block_min[b] = ts
+        if ts > self.block_max[b]:
+            self.block_max[b] = ts
+        self.min_ts = min(self.min_ts, ts)
+        self.max_ts = max(self.max_ts, ts)
+
+        rule = ev.get("rule")
+        if isinstance(rule, str):
+            self._add(self.rules, "rule", rule, ts, offset)
+        home_id = ev.get("home_id")
+        if isinstance(home_id, str):
+            self._add(self.homes, "home_id", home_id, ts, offset)
+
+    def _add(self, index: Dict[str, Tuple[array, array, array]], name: str, key: str, ts: float, offset: int) -> None:
+        entry = index.get(key)
+        if entry is None:
+            entry = index[key] = (array("d"), array("d"), array("q"))
+        top = ts
+        if entry[1] and entry[1][-1] > ts:
+            top = entry[1][-1]
+            if top - ts > self._lag.get((name, key), 0.0):
+                self._lag[(name, key)] = top - ts
+        entry[0].append(ts)
+        entry[1].append(top)
+        entry[2].append(offset)
+
+    def _offsets(self, name: str, key: str, since: float, until: float) -> Iterator[int]:
+        """Offsets of the lines of one index key with since <= ts < until, in log order."""
+        entry = (self.rules if name == "rule" else self.homes).get(key)
+        if entry is None:
+            return
+        ts, top, offsets = entry
+        # lines before i have ts <= top < since; from j on, ts >= top - lag >= until
+        i = bisect_left(top, since)
+        j = bisect_left(top, until + self._lag.get((name, key), 0.0))
+        for k in range(i, j):
+            if since <= ts[k] < until:
+                yield offsets[k]
+
+    def overlaps(self, since: float, until: float) -> bool:
+        return self.max_ts >= since and self.min_ts < until
+
+    def iter_lines(
+        self, since: float, until: float, rule: Optional[str], home_id: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """Yield raw JSONL lines with since <= ts_unix < until (and matching rule/home_id)."""
+        if not self.overlaps(since, until):
+            return
+        with self._open() as f:
+            if home_id is not None or rule is not None:
+                # seek via the home index when given (usually the shorter), checking the rule per line
+                name, key = ("home_id", home_id) if home_id is not None else ("rule", rule)
+                check_rule = home_id is not None and rule is not None
+                for off in self._offsets(name, key, since, until):
+                    f.seek(off)
+                    line = f.readline()
+                    if check_rule:
+                        try:
+                            if json.loads(line).get("rule") != rule:
+                                continue
+                        except (ValueError, AttributeError):
+                            continue
+                    yield line
+                return
+
+            n_blocks = len(self.block_offsets)
+            for b in range(n_blocks):
+                lo, hi = self.block_min[b], self.block_max[b]
+                if hi < since or lo >= until:
+                    continue
+                end = self.block_offsets[b + 1] if b + 1 < n_blocks else self.indexed_bytes
+                inside = lo >= since and hi < until
+                f.seek(self.block_offsets[b])
+                pos = self.block_offsets[b]
+                while pos < end:
+                    line = f.readline()
+                    pos += len(line)
+                    if inside:
+                        yield line
+                        continue
+                    try:
+                        ts = json.loads(line).get("ts_unix")
+                    except (ValueError, AttributeError):
+                        continue
+                    if isinstance(ts, (int, float)) and since <= ts < until:
+                        yield line
+
+
+class EventStore:
+    """
+    Read side of EventLogger: indexes the active log plus its rotated
+    segments (including .gz) and answers time/rule/home range queries by seeking
+    to matching segments and blocks instead of scanning every line.
+    Indexes are built lazily and extended incrementally as the log grows.
+    """
+
+    def __init__(self, log_path: str) -> None:
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._segments: Dict[str, _Segment] = {}
+
+    def _segment_paths(self) -> List[str]:
+        found = set(glob.glob(glob.escape(self.log_path) + ".*"))
+        # skip temp files and a .gz whose plain twin still exists (compression in progress)
+        rotated = [p for p in found if not p.endswith(".tmp") and not (p.endswith(".gz") and p[:-3] in found)]
+        rotated.sort(key=lambda p: p[:-3] if p.endswith(".gz") else p)
+        if os.path.exists(self.log_path):
+            rotated.append(self.log_path)
+        return rotated
+
+    def refresh(self) -> List[_Segment]:
+        """Pick up new/rotated segments and index appended lines; return segments oldest first."""
+        with self._lock:
+            paths = self._segment_paths()
+            old = self._segments
+            by_file = {seg.file_id: seg for p, seg in old.items() if p not in paths or p == self.log_path}
+            current: Dict[str, _Segment] = {}
+            for p in paths:
+                seg = old.get(p)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                fid = (st.st_dev, st.st_ino)
+                if seg is None or seg.file_id != fid or (not seg.gz and st.st_size < seg.indexed_bytes):
+                    # renamed on rotation: keep the index built under the old name
+                    seg = by_file.get(fid) if not p.endswith(".gz") else None
+                    if seg is None or st.st_size < seg.indexed_bytes:
+                        seg = _Segment(p)
+                    seg.path = p
+                seg.refresh()
+                current[p] = seg
+            self._segments = current
+            return list(current.values())
+
+    def iter_lines(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        rule: Optional[str] = None,
+        limit: Optional[int] = None,
+        home_id: Optional[str] = None,
+    ) -> Iterator[bytes]:
+        """Yield raw JSONL lines, oldest segment first."""
+        lo = float("-inf") if since is None else since
+        hi = float("inf") if until is None else until
+        n = 0
+        for seg in self.refresh():
+            for line in seg.iter_lines(lo, hi, rule, home_id):
+                yield line if line.endswith(b"\n") else line + b"\n"
+                n += 1
+                if limit is not None and n >= limit:
+                    return
+
+    def query(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        rule: Optional[str] = None,
+        limit: Optional[int] = None,
+        home_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        return [json.loads(line) for line in self.iter_lines(since, until, rule, limit, home_id)]
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Literal, Optional
+
+Backpressure = Literal["block", "drop_oldest", "reject"]
+
+_STOP = object()
+
+
+class _Partition:
+    """
+    Bounded FIFO served by exactly one worker thread.
+    Each queued slot is [enqueued_at, item, coalesce_key, key]; `latest` maps
+    a coalesce key to its still-queued slot so a newer sample can replace it,
+    and `tail` maps a key to its last queued slot.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.items: Deque[List[Any]] = deque()
+        self.latest: Dict[Hashable, List[Any]] = {}
+        self.tail: Dict[str, List[Any]] = {}
+        self.cond = threading.Condition()
+
+    def append(self, slot: List[Any]) -> None:
+        self.items.append(slot)
+        self.tail[slot[3]] = slot
+        if slot[2] is not None:
+            self.latest[slot[2]] = slot
+
+    def popleft(self) -> List[Any]:
+        slot = self.items.popleft()
+        if slot[2] is not None and self.latest.get(slot[2]) is slot:
+            del self.latest[slot[2]]
+        if self.tail.get(slot[3]) is slot:
+            del self.tail[slot[3]]
+        return slot
+
+
+class IngestPipeline:
+    """
+    Decouples the MQTT network thread from message processing.
+
+    submit() only appends to a bounded per-partition queue; a pool of worker
+    threads calls `handler(*item)`. Items with the same key (device_id) always
+    land on the same worker, so per-device ordering is preserved.
+
+    Backpressure when a partition is full:
+      - block:       wait until the worker makes room
+      - drop_oldest: discard the oldest queued item of that partition
+      - reject:      discard the new item
+
+    Coalescing: items submitted with a coalesce_key replace an item with the
+    same coalesce_key that is still waiting in the queue (latest value wins),
+    keeping its queue position, as long as it is the last queued item of its
+    key; after another item of that key (e.g. a state message) the new item
+    is queued behind it instead, so per-key ordering holds. Without a
+    backlog nothing is ever coalesced.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., None],
+        workers: int = 4,
+        max_queue: int = 10000,
+        policy: Backpressure = "block",
+    ) -> None:
+        if policy not in ("block", "drop_oldest", "reject"):
+            raise ValueError(f"unknown backpressure policy: {policy}")
+        self.handler = handler
+        self.policy = policy
+        per_partition = max(1, max_queue // max(1, workers))
+        self._partitions = [_Partition(per_partition) for _ in range(max(1, workers))]
+        self._threads: List[threading.Thread] = []
+
+        self._lock = threading.Lock()  # guards counters only
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.queued_s_total = 0.0
+        self.queued_s_max = 0.0
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i, part in enumerate(self._partitions):
+            t = threading.Thread(target=self._run, args=(part,), name=f"ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Process what is already queued, then stop the workers."""
+        for part in self._partitions:
+            with part.cond:
+                part.items.append([0.0, (_STOP,), None, None])
+                part.cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    # -----------------------------
+    # Producer side (MQTT thread)
+    # -----------------------------
+    def _partition(self, key: str) -> _Partition:
+        return self._partitions[zlib.crc32(key.encode("utf-8")) % len(self._partitions)]
+
+    def submit(self, key: str, *item: Any, coalesce_key: Optional[Hashable] = None) -> bool:
+        """Queue item for the worker owning key. Returns False if the item was not queued."""
+        part = self._partition(key)
+        with part.cond:
+            if coalesce_key is not None:
+                slot = part.latest.get(coalesce_key)
+                if slot is not None and part.tail.get(key) is slot:
+                    slot[1] = item
+                    with self._lock:
+                        self.coalesced += 1
+                    return True
+
+            if len(part.items) >= part.max_size:
+                if self.policy == "reject":
+                    with self._lock:
+                        self.rejected += 1
+                    return False
+                if self.policy == "drop_oldest":
+                    part.popleft()
+                    with self._lock:
+                        self.dropped += 1
+                else:
+                    while len(part.items) >= part.max_size:
+                        part.cond.wait()
+            part.append([time.monotonic(), item, coalesce_key, key])
+            part.cond.notify_all()
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    # -----------------------------
+    # Consumer side (workers)
+    # -----------------------------
+    def _run(self, part: _Partition) -> None:
+        while True:
+            with part.cond:
+                while not part.items:
+                    part.cond.wait()
+                enqueued_at, item, _, _ = part.popleft()
+                part.cond.notify_all()  # wake a blocked producer
+            if item and item[0] is _STOP:
+                return
+
+            waited = time.monotonic() - enqueued_at
+            try:
+                self.handler(*item)
+                failed = False
+            except Exception:
+                failed = True
+
+            with self._lock:
+                self.processed += 1
+                self.errors += failed
+                self.queued_s_total += waited
+                if waited > self.queued_s_max:
+                    self.queued_s_max = waited
+
+    def queue_depth(self) -> int:
+        return sum(len(p.items) for p in self._partitions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            processed = self.processed
+            return {
+                "policy": self.policy,
+                "workers": len(self._partitions),
+                "queue_depth": self.queue_depth(),
+                "enqueued": self.enqueued,
+                "processed": processed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "queued_ms_avg": (self.queued_s_total / processed * 1000.0) if processed else 0.0,
+                "queued_ms_max": self.queued_s_max * 1000.0,
+            }
@@ -1,39 +1,180 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
 import json
+import os
+import threading
 import time
-from typing import Any, Dict, Optional
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import islice
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple, get_args
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 import paho.mqtt.client as mqtt
 
-from .models import DeviceInfo, topic, wildcard_state, wildcard_telemetry
-from .rules import evaluate_rules
-from .state import Config, DeviceRegistry, EventLogger, StateStore
+from . import metrics
+from .anomaly import detector_configs
+from .codec import EnvelopeDecoder, parse_topic
+from .dispatch import CommandDispatcher
+from .events import EventStore
+from .ingest import IngestPipeline
+from .models import ALL_HOMES, Command, DeviceInfo, Kind, parse_time, topic, wildcard_state, wildcard_telemetry
+from .persist import StatePersistence
+from .rollup import parse_step
+from .rule_engine import RuleEngine, load_rule_specs
+from .rules import RULE_NAMES, process_message, rules_for_home_config
+from .state import EventLogger, HomeShard, HomeShards, StoreSnapshot
+from .stream import StreamFilter, StreamHub
+from .wire import DEVICE_TYPES, is_binary, pack_cmd
+
+if TYPE_CHECKING:
+    from .batch import BatchRuleScheduler
 
 
 # -----------------------------
 # Runtime defaults 
 # -----------------------------
-HOME_ID = "home_1"
+HOME_ID = "home_1"  # default home served by the un-prefixed REST routes
 BROKER_HOST = "127.0.0.1"
 BROKER_PORT = 1883
 
+# Ingest stage: MQTT thread only enqueues, workers (partitioned by device_id) process
+INGEST_WORKERS = 4
+INGEST_QUEUE_SIZE = 10000
+INGEST_BACKPRESSURE = "block"  # block | drop_oldest | reject
+
+# Telemetry coalescing per device_type: True = only the newest queued sample of a
+# device is processed under backlog. Edge-triggered types (door_window open/close,
+# alarm_switch arm/disarm) and all meters keep every message: each meter delta feeds
+# its anomaly detector and consumption rollups, so a dropped one would skew both.
+# Unknown device types and state messages are never coalesced.
+COALESCE_TELEMETRY: Dict[str, bool] = {
+    "environment": True,
+    "mobile_light": True,
+    "door_window": False,
+    "alarm_switch": False,
+    "gas_meter": False,
+    "electricity_meter": False,
+    "water_meter": False,
+}
+
+# Builtin rule evaluation: "message" evaluates the rules a message affects right
+# away; "batch" only marks the home and evaluates all marked homes together every
+# BATCH_TICK_S in columnar NumPy arrays (src/batch.py; needs numpy, falls back to
+# "message" without it). Batch trades up to BATCH_TICK_S of latency for much less
+# CPU per message in large fleets. Custom rules are always evaluated per message.
+RULE_EVAL_MODE = "message"  # message | batch
+BATCH_TICK_S = 0.1
+
+# Optional site-specific rules for the default home (.json or .yaml)
+RULES_PATH = "config/rules.json"
+
 LOG_PATH = "outputs/events.log"
+LOG_MAX_BYTES = 64 * 1024 * 1024  # rotate events.log at this size
+LOG_GZIP_ROTATED = True
+
+# Command dispatch: drop a "set" when the actuator already reports the requested
+# state (commands to the same target within one evaluation are always merged).
+# Only reports received since startup and at most CONFIRMED_STATE_MAX_AGE_S old
+# count as confirmed (None = any report since startup)
+SUPPRESS_CONFIRMED_COMMANDS = True
+CONFIRMED_STATE_MAX_AGE_S: Optional[float] = 300.0
+
+# Device listing/onboarding: GET /devices page size (default, max); POST
+# /devices/bulk registers this many devices per registry lock and reports at
+# most BULK_MAX_ERRORS rejected items individually
+DEVICES_PAGE_LIMIT = 1000
+DEVICES_MAX_LIMIT = 10000
+BULK_BATCH = 1000
+BULK_MAX_ERRORS = 100
+
+# /status?format=ndjson: device lines serialized per chunk sent
+STATUS_NDJSON_CHUNK = 256
+# full /status bodies kept for pollers, one per home for the most recently polled homes
+STATUS_CACHE_HOMES = 256
+
+# Windowed series (/devices/{id}/series, "stat" rule leaves) are recorded only for
+# fields something reads: the stat leaves of custom rules, SERIES_FIELDS
+# (device_type -> series names, e.g. {"environment": ("temperature",)}) and, with
+# SERIES_ON_REQUEST, each field of a device type once it is asked for over REST
+SERIES_FIELDS: Dict[str, Tuple[str, ...]] = {}
+SERIES_ON_REQUEST = True
+
+# /meters/{id}/consumption: buckets returned without `from`, and at most per query
+CONSUMPTION_DEFAULT_POINTS = 24
+CONSUMPTION_MAX_POINTS = 10000
+
+# Durable state for warm restarts: last values, rule state, registry and config
+# are journaled to a WAL under STATE_DIR and checkpointed every
+# CHECKPOINT_INTERVAL_S or once the WAL reaches CHECKPOINT_WAL_BYTES (which
+# bounds recovery time). WAL_FSYNC=True fsyncs each written batch.
+PERSIST_STATE = True
+STATE_DIR = "outputs/state"
+CHECKPOINT_INTERVAL_S = 60.0
+CHECKPOINT_WAL_BYTES = 64 * 1024 * 1024
+WAL_FSYNC = False
+
+# Live /stream fan-out: updates buffered per observer (oldest dropped beyond this)
+# and seconds between keep-alive checks on an idle stream
+STREAM_BUFFER = 256
+STREAM_KEEPALIVE_S = 15.0
+
+# Counters/histograms/lock-wait timing behind GET /metrics. False turns all
+# instrumentation off (locks are then plain threading.Locks).
+METRICS_ENABLED = True
+metrics.set_enabled(METRICS_ENABLED)
 
 
 app = FastAPI(title="Smart Home Safety Manager (MQTT + Minimal REST)")
 
-cfg = Config()
-registry = DeviceRegistry()
-store = StateStore()
-logger = EventLogger(LOG_PATH)
+# One shard (Config + DeviceRegistry + StateStore) per home, created on first message
+shards = HomeShards(series_fields=SERIES_FIELDS)
+
+# Default home objects, kept for single-home callers
+_default = shards.get(HOME_ID)
+cfg = _default.cfg
+registry = _default.registry
+store = _default.store
+
+logger = EventLogger(LOG_PATH, max_bytes=LOG_MAX_BYTES, gzip_rotated=LOG_GZIP_ROTATED)
+event_store = EventStore(LOG_PATH)
+stream_hub = StreamHub(buffer_size=STREAM_BUFFER)
+dispatcher = CommandDispatcher(suppress_confirmed=SUPPRESS_CONFIRMED_COMMANDS, max_age_s=CONFIRMED_STATE_MAX_AGE_S)
+persistence: Optional[StatePersistence] = None
+batch_rules: Optional["BatchRuleScheduler"] = None  # set on startup in batch mode
 
 mqtt_client: Optional[mqtt.Client] = None
 
 
+def _invalidate_rules(shard: HomeShard, changed_fields: Set[str]) -> None:
+    """Queue rules reading these config fields for the next message of this home (or the next batch tick)."""
+    with shard.lock:
+        rules = rules_for_home_config(shard, changed_fields)
+        shard.pending_rules.update(rules)
+    if batch_rules is not None and not rules.isdisjoint(RULE_NAMES):
+        batch_rules.mark(shard.home_id)
+
+
+def _load_rules(shard: HomeShard, specs: List[Dict[str, Any]]) -> RuleEngine:
+    """Compile custom rules for a home (ValueError on bad specs) and swap them in."""
+    engine = RuleEngine(specs)
+    with shard.lock:
+        shard.store.set_series_fields("rules", engine.series_fields)
+        engine.seed(shard.store)
+        shard.engine = engine if engine.rules else None
+        shard.cfg.custom_rules = specs
+        shard.pending_rules.update(engine.rules)
+    shard.store.touch("config")
+    return engine
+
+
 # -----------------------------
 # REST Schemas (minimal CRUD)
 # -----------------------------
@@ -53,90 +194,170 @@ class ConfigIn(BaseModel):
     rule_intrusion_enabled: Optional[bool] = None
     rule_fire_enabled: Optional[bool] = None
     rule_gas_enabled: Optional[bool] = None
+    rule_meter_anomaly_enabled: Optional[bool] = None
+
+    # per meter type overrides of anomaly.METER_DETECTORS (replaces the previous overrides)
+    meter_detectors: Optional[Dict[str, Dict[str, Any]]] = None
 
 
 # -----------------------------
 # MQTT helpers
 # -----------------------------
-def _publish_cmd(cmd_target: str, action: str, params: Dict[str, Any]) -> None:
-    global mqtt_client
-    if mqtt_client is None:
+_PUBLISH_SECONDS = metrics.PUBLISH_SECONDS.labels()
+
+
+def _publish_cmds(commands: List[Command], home_id: str = HOME_ID) -> None:
+    """Publish one evaluation's (already merged/suppressed) commands as a batch."""
+    client = mqtt_client
+    if client is None or not commands:
         return
 
-    payload = {
-        "ts_unix": time.time(),
-        "home_id": HOME_ID,
-        "target_id": cmd_target,
-        "action": action,
-        "params": params,
-    }
-    mqtt_client.publish(topic(HOME_ID, cmd_target, "cmd"), json.dumps(payload), qos=0, retain=False)
+    t0 = metrics.clock()
+    # Reply in the wire format the target device uses
+    bin_devs = shards.get(home_id).binary_devices
+    for c in commands:
+        wire = "bin" if c.target_id in bin_devs else "json"
+        payload = pack_cmd(home_id, c.target_id, c.action, c.params, wire)
+        client.publish(topic(home_id, c.target_id, "cmd"), payload, qos=0, retain=False)
+    _PUBLISH_SECONDS.observe_since(t0)
 
 
-def _handle_incoming_message(channel: str, data: Dict[str, Any]) -> None:
+def _handle_incoming_message(channel: str, data: Dict[str, Any], home_id: str = HOME_ID) -> None:
     """
     Update last-state + evaluate rules + dispatch commands.
-    This is the "Data Collector & Manager" core.
+    This is the "Data Collector & Manager" core (see rules.process_message).
     """
-    device_id = data.get("device_id")
-    if not device_id:
-        return
+    shard = shards.get(home_id)
+    batch = batch_rules
+    deferred: Optional[Set[str]] = set() if batch is not None else None
+    with shard.lock:
+        commands, events = process_message(shard, channel, data, deferred=deferred)
+        if stream_hub.active:
+            stream_hub.publish(channel, home_id, data.get("device_id"), data.get("device_type"), data)
+        _emit(shard, commands, events)
+    if deferred:
+        batch.mark(home_id)
 
-    if channel == "telemetry":
-        store.update_telemetry(device_id, data)
-    elif channel == "state":
-        store.update_state(device_id, data)
 
-    # Allow Alarm Switch device to arm/disarm by publishing state/telemetry
-    if data.get("device_type") == "alarm_switch":
-        d = data.get("data", {})
-        if isinstance(d, dict) and "armed" in d:
-            cfg.armed = bool(d["armed"])
+def _emit(shard: HomeShard, commands: List[Command], events: List[Dict[str, Any]]) -> None:
+    """Log/stream the rule events of one evaluation and dispatch its commands. Caller holds shard.lock."""
+    home_id = shard.home_id
+    streaming = stream_hub.active
+    for e in events:
+        logged = {"home_id": home_id, **e}
+        logger.log(logged)
+        if streaming:
+            stream_hub.publish("event", home_id, None, None, logged)
 
-    commands, events = evaluate_rules(store, cfg)
+    _publish_cmds(dispatcher.plan(commands, shard.store), home_id)
 
-    for e in events:
-        logger.log(e)
 
-    for c in commands:
-        _publish_cmd(c.target_id, c.action, c.params)
+decoder = EnvelopeDecoder()
 
 
-def _on_message(_client, _userdata, msg: mqtt.MQTTMessage) -> None:
-    try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-    except Exception:
+_KNOWN_TYPES = frozenset(DEVICE_TYPES)  # bounds the device_type label of the message counter
+_DECODE_JSON_SECONDS = metrics.DECODE_SECONDS.labels("json")
+_DECODE_BIN_SECONDS = metrics.DECODE_SECONDS.labels("bin")
+
+
+def _process_message(channel: str, home_id: str, device_id: str, raw: bytes) -> None:
+    """Worker side: decode + store update + rules + dispatch."""
+    binary = is_binary(raw)
+    t0 = metrics.clock()
+    payload = decoder.decode(raw, home_id, device_id)
+    (_DECODE_BIN_SECONDS if binary else _DECODE_JSON_SECONDS).observe_since(t0)
+    if payload is None:
+        metrics.DECODE_FAILURES.inc(channel)
         return
+    dtype = payload["device_type"]
+    metrics.MESSAGES.inc(channel, dtype if dtype in _KNOWN_TYPES else "other")
+
+    bin_devs = shards.get(home_id).binary_devices
+    if binary != (device_id in bin_devs):
+        if binary:
+            bin_devs.add(device_id)
+        else:
+            bin_devs.discard(device_id)
+
+    _handle_incoming_message(channel, payload, home_id)
+
+
+ingest = IngestPipeline(
+    _process_message,
+    workers=INGEST_WORKERS,
+    max_queue=INGEST_QUEUE_SIZE,
+    policy=INGEST_BACKPRESSURE,
+)
+
 
+def _on_message(_client, _userdata, msg: mqtt.MQTTMessage) -> None:
+    """paho network thread: parse the topic (cached) and enqueue, nothing else."""
     # Topic format: home/<home_id>/<device_id>/<channel>
-    parts = msg.topic.split("/")
-    if len(parts) < 4:
+    parsed = parse_topic(msg.topic)
+    if parsed is None:
         return
-    channel = parts[-1]
-    if channel not in ("telemetry", "state"):
+    home_id, device_id, channel = parsed
+    if channel == "cmd":
         return
+    key = f"{home_id}/{device_id}"
+
+    coalesce_key = None
+    if channel == "telemetry":
+        shard = shards.peek(home_id)
+        dtype = shard.store.device_type(device_id) if shard is not None else None
+        if dtype is not None and COALESCE_TELEMETRY.get(dtype, False):
+            coalesce_key = (key, channel)
 
-    _handle_incoming_message(channel, payload)
+    ingest.submit(key, channel, home_id, device_id, msg.payload, coalesce_key=coalesce_key)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     """
-    Connect to MQTT broker and subscribe to:
+    Connect to MQTT broker and subscribe to (for every home):
       - all telemetry
       - all actuator states
     """
-    global mqtt_client
+    global mqtt_client, persistence
+    recovered = None
+    if PERSIST_STATE:
+        persistence = StatePersistence(
+            STATE_DIR,
+            checkpoint_interval_s=CHECKPOINT_INTERVAL_S,
+            max_wal_bytes=CHECKPOINT_WAL_BYTES,
+            fsync=WAL_FSYNC,
+        )
+        recovered = persistence.recover(shards)
+        if recovered is not None:
+            _recompile_rules()
+        persistence.start(shards)
+
+    if recovered is None:
+        _bootstrap_default_home()
+
+    if RULE_EVAL_MODE == "batch":
+        _start_batch_rules()
+    ingest.start()
+
     mqtt_client = mqtt.Client(client_id="manager", clean_session=True)
     mqtt_client.on_message = _on_message
     mqtt_client.connect(BROKER_HOST, BROKER_PORT, keepalive=60)
 
-    mqtt_client.subscribe(wildcard_telemetry(HOME_ID), qos=0)
-    mqtt_client.subscribe(wildcard_state(HOME_ID), qos=0)
+    mqtt_client.subscribe(wildcard_telemetry(ALL_HOMES), qos=0)
+    mqtt_client.subscribe(wildcard_state(ALL_HOMES), qos=0)
 
     mqtt_client.loop_start()
 
-    # Minimal bootstrap registry (helpful for /status)
+    logger.log({
+        "event": "startup",
+        "ts_unix": time.time(),
+        "msg": "Manager started",
+        "recovered": dict(recovered.__dict__) if recovered is not None else None,
+    })
+
+
+def _bootstrap_default_home() -> None:
+    """Minimal registry (helpful for /status) and RULES_PATH for a fresh start."""
     registry.add(DeviceInfo("door_1", "door_window", "sensor"))
     registry.add(DeviceInfo("window_1", "door_window", "sensor"))
     registry.add(DeviceInfo("env_1", "environment", "sensor"))
@@ -150,56 +371,437 @@ def on_startup() -> None:
     registry.add(DeviceInfo("electricity_meter", "electricity_meter", "hybrid"))
     registry.add(DeviceInfo("water_meter", "water_meter", "hybrid"))
 
-    logger.log({"event": "startup", "ts_unix": time.time(), "msg": "Manager started"})
+    if os.path.exists(RULES_PATH):
+        _load_rules(_default, load_rule_specs(RULES_PATH))
+
+
+def _start_batch_rules() -> None:
+    global batch_rules
+    try:
+        from .batch import BatchRuleScheduler
+    except ImportError as e:  # numpy is optional
+        logger.log({"event": "batch_rules_unavailable", "ts_unix": time.time(), "msg": str(e)})
+        return
+    scheduler = BatchRuleScheduler(shards, _emit, tick_s=BATCH_TICK_S)
+    for home_id in shards.home_ids():  # recovered/bootstrapped homes start with a full evaluation
+        scheduler.mark(home_id)
+    scheduler.start()
+    batch_rules = scheduler
+
+
+def _recompile_rules() -> None:
+    """Compile the custom rules restored with each home's config."""
+    for home_id in shards.home_ids():
+        shard = shards.get(home_id)
+        if not shard.cfg.custom_rules:
+            continue
+        try:
+            _load_rules(shard, shard.cfg.custom_rules)
+        except ValueError as e:
+            logger.log({"event": "rules_error", "ts_unix": time.time(), "home_id": home_id, "msg": str(e)})
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    """Stop MQTT, write a final state checkpoint and flush the event log."""
+    if mqtt_client is not None:
+        mqtt_client.loop_stop()
+        mqtt_client.disconnect()
+    ingest.stop()
+    if batch_rules is not None:
+        batch_rules.stop()
+    stream_hub.stop()
+    if persistence is not None:
+        persistence.close()
+    logger.log({"event": "shutdown", "ts_unix": time.time(), "msg": "Manager stopped"})
+    logger.close()
 
 
 # -----------------------------
 # REST endpoints
 # -----------------------------
-@app.get("/status")
-def get_status() -> Dict[str, Any]:
+def _shard_or_404(home_id: str) -> HomeShard:
+    shard = shards.peek(home_id)
+    if shard is None:
+        raise HTTPException(status_code=404, detail=f"unknown home: {home_id}")
+    return shard
+
+
+@dataclass(frozen=True)
+class StatusView:
     """
-    Aggregated status view.
+    What a /status request asks for beyond the default full body: envelope
+    fields to keep (None = whole envelopes), one device_type, a page
+    (devices after `cursor` in device_id order, at most `limit`) and NDJSON.
     """
-    devs = {k: v.__dict__ for k, v in registry.list_all().items()}
-    snap = store.snapshot()
-    return {
-        "home_id": HOME_ID,
-        "config": cfg.__dict__,
+    fields: Optional[Tuple[str, ...]] = None
+    device_type: Optional[str] = None
+    cursor: Optional[str] = None
+    limit: Optional[int] = None
+    ndjson: bool = False
+
+    @classmethod
+    def parse(
+        cls,
+        fields: Optional[str] = None,
+        device_type: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        fmt: Optional[str] = None,
+    ) -> "StatusView":
+        """From query values; HTTPException(400) on bad ones."""
+        if limit is not None and not 1 <= limit <= DEVICES_MAX_LIMIT:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {DEVICES_MAX_LIMIT}")
+        if fmt not in (None, "", "json", "ndjson"):
+            raise HTTPException(status_code=400, detail="format must be json or ndjson")
+        field_list = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else ()
+        return cls(field_list or None, device_type or None, cursor or None, limit, fmt == "ndjson")
+
+    @property
+    def is_default(self) -> bool:
+        return self == _DEFAULT_VIEW
+
+    @property
+    def paged(self) -> bool:
+        return self.cursor is not None or self.limit is not None or self.ndjson
+
+    def project(self, envelope: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if envelope is None or self.fields is None:
+            return envelope
+        return {k: envelope[k] for k in self.fields if k in envelope}
+
+    def key(self) -> str:
+        """Short tag of the view for ETags."""
+        return format(zlib.crc32(repr(self).encode("utf-8")), "08x")
+
+
+_DEFAULT_VIEW = StatusView()
+
+
+def _has_type(shard: HomeShard, snap: StoreSnapshot, device_id: str, device_type: str) -> bool:
+    """Same rule as _status_ids: registered as, or reporting envelopes of, device_type."""
+    info = shard.registry.get(device_id)
+    if info is not None and info.device_type == device_type:
+        return True
+    return any(
+        msg is not None and msg.get("device_type") == device_type
+        for msg in (snap.telemetry.get(device_id), snap.state.get(device_id))
+    )
+
+
+def _status(shard: HomeShard, snap: Optional[StoreSnapshot] = None, view: StatusView = _DEFAULT_VIEW) -> Dict[str, Any]:
+    if snap is None:
+        snap = shard.store.snapshot()
+    if view.is_default:
+        return {
+            "home_id": shard.home_id,
+            "config": shard.cfg.__dict__,
+            "devices": {k: v.__dict__ for k, v in shard.registry.list_all().items()},
+            "version": snap.version,
+            "last_telemetry": snap.telemetry.to_dict(),
+            "last_state": snap.state.to_dict(),
+        }
+
+    devs: Dict[str, Any] = {}
+    telemetry: Dict[str, Any] = {}
+    state: Dict[str, Any] = {}
+    n = 0
+    last = next_cursor = None
+    for device_id in _status_ids(shard, snap, view):
+        if view.limit is not None and n >= view.limit:
+            next_cursor = last
+            break
+        info = shard.registry.get(device_id)
+        if info is not None:
+            devs[device_id] = info.__dict__
+        tel, st = snap.telemetry.get(device_id), snap.state.get(device_id)
+        if tel is not None:
+            telemetry[device_id] = view.project(tel)
+        if st is not None:
+            state[device_id] = view.project(st)
+        last = device_id
+        n += 1
+    body = {
+        "home_id": shard.home_id,
+        "config": shard.cfg.__dict__,
         "devices": devs,
-        "last_telemetry": snap["telemetry"],
-        "last_state": snap["state"],
+        "version": snap.version,
+        "last_telemetry": telemetry,
+        "last_state": state,
     }
+    if view.paged:
+        body["next_cursor"] = next_cursor
+    return body
 
 
-@app.get("/devices")
-def list_devices() -> Dict[str, Any]:
-    devs = {k: v.__dict__ for k, v in registry.list_all().items()}
-    return {"devices": devs}
+def _status_ids(shard: HomeShard, snap: StoreSnapshot, view: StatusView) -> Iterator[str]:
+    """Registry and store device ids (of view.device_type) after view.cursor, merged in order."""
+    sources = [shard.registry.ids(view.device_type), shard.store.device_ids(snap, view.device_type)]
+    if view.cursor is not None:
+        sources = [islice(ids, bisect_right(ids, view.cursor), None) for ids in sources]
+    prev = None
+    for device_id in heapq.merge(*sources):
+        if device_id != prev:
+            yield device_id
+            prev = device_id
 
 
-@app.post("/devices")
-def add_device(d: DeviceIn) -> Dict[str, Any]:
-    if not d.device_id or not d.device_type:
-        raise HTTPException(status_code=400, detail="device_id and device_type are required")
-    registry.add(DeviceInfo(d.device_id, d.device_type, d.kind))
-    return {"ok": True, "device": registry.get(d.device_id).__dict__}
+def _status_lines(shard: HomeShard, snap: StoreSnapshot, view: StatusView) -> Iterator[bytes]:
+    """
+    NDJSON /status: a header line (home_id, version, config), one line per
+    device, and a final {"next_cursor": ...} line when the view is limited.
+    Serialized device by device from the immutable snapshot and sent in
+    chunks of STATUS_NDJSON_CHUNK lines, so memory stays flat.
+    """
+    encode = json.JSONEncoder(separators=(",", ":")).encode
+    chunk: List[str] = [encode({"home_id": shard.home_id, "version": snap.version, "config": shard.cfg.__dict__})]
+    n = 0
+    last = None
+    for device_id in _status_ids(shard, snap, view):
+        if view.limit is not None and n >= view.limit:
+            break
+        info = shard.registry.get(device_id)
+        chunk.append(encode({
+            "device_id": device_id,
+            "device": info.__dict__ if info is not None else None,
+            "last_telemetry": view.project(snap.telemetry.get(device_id)),
+            "last_state": view.project(snap.state.get(device_id)),
+        }))
+        last = device_id
+        n += 1
+        if len(chunk) >= STATUS_NDJSON_CHUNK:
+            yield ("\n".join(chunk) + "\n").encode("utf-8")
+            chunk = []
+    else:
+        last = None  # ran out of devices: no next page
+    if view.limit is not None:
+        chunk.append(encode({"next_cursor": last}))
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode("utf-8")
 
 
-@app.delete("/devices/{device_id}")
-def delete_device(device_id: str) -> Dict[str, Any]:
-    registry.remove(device_id)
-    return {"ok": True}
+def _status_delta(
+    shard: HomeShard,
+    snap: StoreSnapshot,
+    since: int,
+    view: StatusView = _DEFAULT_VIEW,
+) -> Optional[Dict[str, Any]]:
+    """
+    Only what changed after version `since`: changed telemetry/state
+    envelopes, changed registry entries (None = removed) and the config if
+    it changed. None when the changelog no longer reaches back to `since`.
+    """
+    changed = snap.changed_since(since)
+    if changed is None:
+        return None
+    wanted = view.device_type
 
+    def keep(device_id: str) -> bool:
+        return wanted is None or _has_type(shard, snap, device_id, wanted)
 
-@app.get("/config")
-def get_config() -> Dict[str, Any]:
-    return {"config": cfg.__dict__}
+    devs: Dict[str, Any] = {}
+    for device_id in changed.get("devices", ()):
+        info = shard.registry.get(device_id)
+        if info is None:
+            devs[device_id] = None
+        elif keep(device_id):
+            devs[device_id] = info.__dict__
+    body: Dict[str, Any] = {"home_id": shard.home_id, "version": snap.version, "since": since, "full": False}
+    if "config" in changed:
+        body["config"] = shard.cfg.__dict__
+    body["devices"] = devs
+    body["last_telemetry"] = {d: view.project(snap.telemetry[d]) for d in changed.get("telemetry", ()) if keep(d)}
+    body["last_state"] = {d: view.project(snap.state[d]) for d in changed.get("state", ()) if keep(d)}
+    return body
 
 
-@app.put("/config")
-def update_config(c: ConfigIn) -> Dict[str, Any]:
+# ETags are "<epoch>-<home>-<version>"; the epoch keeps tags from a previous process from matching
+_STATUS_EPOCH = os.urandom(4).hex()
+
+# home_id -> (etag, body) of the last rendered full /status, shared by all pollers at
+# that version; least recently polled homes beyond STATUS_CACHE_HOMES are evicted
+_status_cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+_status_cache_lock = threading.Lock()
+
+
+def _status_body(shard: HomeShard, snap: StoreSnapshot, etag: str) -> bytes:
+    """Full /status body at snap, serialized once per version (LRU over homes)."""
+    home_id = shard.home_id
+    with _status_cache_lock:
+        cached = _status_cache.get(home_id)
+        if cached is not None and cached[0] == etag:
+            _status_cache.move_to_end(home_id)
+            return cached[1]
+    body = json.dumps(_status(shard, snap), separators=(",", ":")).encode("utf-8")
+    with _status_cache_lock:
+        _status_cache[home_id] = (etag, body)
+        _status_cache.move_to_end(home_id)
+        while len(_status_cache) > STATUS_CACHE_HOMES:
+            _status_cache.popitem(last=False)
+    return body
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _json_response(body: Dict[str, Any], etag: str) -> Response:
+    content = json.dumps(body, separators=(",", ":")).encode("utf-8")
+    return Response(content, media_type="application/json", headers={"ETag": etag})
+
+
+def _status_response(
+    shard: HomeShard,
+    since: Optional[int],
+    if_none_match: Optional[str],
+    view: StatusView = _DEFAULT_VIEW,
+) -> Response:
+    """
+    /status with ETag/If-None-Match (304 when the home's version did not
+    move) and ?since=<version> deltas. Nothing is serialized for a 304, and
+    the default full body is serialized once per version. Projected,
+    filtered or paged views are rendered per request; NDJSON is streamed.
+    """
+    snap = shard.store.snapshot()
+    base = f"{_STATUS_EPOCH}-{shard.home_id}"
+    if not view.is_default:
+        base = f"{base}-{view.key()}"
+    if since is not None:
+        if view.paged:
+            raise HTTPException(status_code=400, detail="since cannot be combined with cursor, limit or format=ndjson")
+        etag = f'"{base}-{since}-{snap.version}"'
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        delta = _status_delta(shard, snap, since, view)
+        if delta is not None:
+            return _json_response(delta, etag)
+        # too old (or from before a restart): full view, flagged so the client resyncs
+        body = _status(shard, snap, view)
+        body["full"] = True
+        return _json_response(body, etag)
+
+    etag = f'"{base}-{snap.version}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if view.ndjson:
+        return StreamingResponse(_status_lines(shard, snap, view), media_type="application/x-ndjson", headers={"ETag": etag})
+    if not view.is_default:
+        return _json_response(_status(shard, snap, view), etag)
+    return Response(_status_body(shard, snap, etag), media_type="application/json", headers={"ETag": etag})
+
+
+_KINDS = frozenset(get_args(Kind))
+
+
+def _list_devices(
+    shard: HomeShard,
+    device_type: Optional[str],
+    kind: Optional[str],
+    cursor: Optional[str],
+    limit: int,
+) -> Dict[str, Any]:
+    """One page of devices in device_id order; pass next_cursor back as ?cursor= for the next."""
+    if not 1 <= limit <= DEVICES_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {DEVICES_MAX_LIMIT}")
+    page, next_cursor = shard.registry.page(device_type or None, kind or None, cursor or None, limit)
+    return {
+        "devices": {d.device_id: d.__dict__ for d in page},
+        "total": shard.registry.count(device_type or None, kind or None),
+        "next_cursor": next_cursor,
+    }
+
+
+def _device_info(item: Any) -> DeviceInfo:
+    """DeviceInfo from one bulk item; ValueError if it is not a valid device."""
+    if not isinstance(item, dict):
+        raise ValueError("expected an object")
+    device_id, device_type, kind = item.get("device_id"), item.get("device_type"), item.get("kind")
+    if not isinstance(device_id, str) or not device_id or not isinstance(device_type, str) or not device_type:
+        raise ValueError("device_id and device_type are required")
+    if kind not in _KINDS:
+        raise ValueError(f"kind must be one of {', '.join(sorted(_KINDS))}")
+    return DeviceInfo(device_id, device_type, kind)
+
+
+async def _bulk_items(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    (item number, parsed item) from a JSON array body, or from an NDJSON
+    stream (one device per line) read incrementally. Unparseable NDJSON
+    lines are yielded as ValueError; a malformed JSON array is a 400.
+    """
+    ctype = request.headers.get("content-type", "")
+    if "ndjson" not in ctype and "jsonlines" not in ctype:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="body must be a JSON array (or NDJSON with Content-Type: application/x-ndjson)")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="body must be a JSON array")
+        for n, item in enumerate(items):
+            yield n, item
+        return
+
+    n = 0
+    tail = b""
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                try:
+                    yield n, json.loads(line)
+                except ValueError as e:
+                    yield n, e
+                n += 1
+    if tail.strip():
+        try:
+            yield n, json.loads(tail)
+        except ValueError as e:
+            yield n, e
+
+
+async def _add_devices_bulk(shard: HomeShard, request: Request) -> Dict[str, Any]:
+    """Register every valid device of the body in batches; invalid items are skipped and reported."""
+    added = rejected = 0
+    errors: List[Dict[str, Any]] = []
+    batch: List[DeviceInfo] = []
+    async for n, item in _bulk_items(request):
+        try:
+            if isinstance(item, ValueError):
+                raise ValueError(f"invalid JSON: {item}")
+            batch.append(_device_info(item))
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < BULK_MAX_ERRORS:
+                errors.append({"item": n, "error": str(e)})
+            continue
+        if len(batch) >= BULK_BATCH:
+            added += shard.registry.add_many(batch)
+            batch = []
+    if batch:
+        added += shard.registry.add_many(batch)
+    return {"ok": not rejected, "added": added, "rejected": rejected, "errors": errors}
+
+
+def _add_device(shard: HomeShard, d: DeviceIn) -> Dict[str, Any]:
+    if not d.device_id or not d.device_type:
+        raise HTTPException(status_code=400, detail="device_id and device_type are required")
+    shard.registry.add(DeviceInfo(d.device_id, d.device_type, d.kind))
+    return {"ok": True, "device": shard.registry.get(d.device_id).__dict__}
+
+
+def _update_config(shard: HomeShard, c: ConfigIn) -> Dict[str, Any]:
     # Arm/disarm + thresholds + rule toggles.
+    cfg = shard.cfg
+    if c.meter_detectors is not None:
+        try:
+            detector_configs(c.meter_detectors)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"meter_detectors: {e}")
+    before = dict(cfg.__dict__)
     if c.armed is not None:
         cfg.armed = c.armed
     if c.temp_threshold is not None:
@@ -217,11 +819,434 @@ def update_config(c: ConfigIn) -> Dict[str, Any]:
         cfg.rule_fire_enabled = c.rule_fire_enabled
     if c.rule_gas_enabled is not None:
         cfg.rule_gas_enabled = c.rule_gas_enabled
+    if c.rule_meter_anomaly_enabled is not None:
+        cfg.rule_meter_anomaly_enabled = c.rule_meter_anomaly_enabled
+    if c.meter_detectors is not None:
+        cfg.meter_detectors = c.meter_detectors
 
-    logger.log({"event": "config_update", "ts_unix": time.time(), "config": cfg.__dict__})
+    changed = {k for k, v in cfg.__dict__.items() if before.get(k) != v}
+    if changed & {"gas_spike_ratio", "gas_min_delta", "meter_detectors"}:
+        shard.configure_meters()
+    if changed:
+        shard.store.touch("config")
+    _invalidate_rules(shard, changed)
+    logger.log({"event": "config_update", "ts_unix": time.time(), "home_id": shard.home_id, "config": dict(cfg.__dict__)})
     return {"ok": True, "config": cfg.__dict__}
 
 
+@app.get("/status")
+def get_status(
+    since: Optional[int] = None,
+    fields: Optional[str] = None,
+    type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """
+    Aggregated status view (default home).
+    ?since=<version> returns only what changed after that version.
+    ?fields=data,ts keeps only those envelope fields, ?type= one device type,
+    ?cursor=&limit= pages devices in device_id order, ?format=ndjson streams
+    one device per line.
+    """
+    view = StatusView.parse(fields, type, cursor, limit, format)
+    return _status_response(_default, since, if_none_match, view)
+
+
+@app.get("/devices")
+def list_devices(
+    type: Optional[str] = None,
+    kind: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEVICES_PAGE_LIMIT,
+) -> Dict[str, Any]:
+    """Devices of the default home, filtered by device type and/or kind, paginated by cursor."""
+    return _list_devices(_default, type, kind, cursor, limit)
+
+
+@app.post("/devices")
+def add_device(d: DeviceIn) -> Dict[str, Any]:
+    return _add_device(_default, d)
+
+
+@app.post("/devices/bulk")
+async def add_devices_bulk(request: Request) -> Dict[str, Any]:
+    """Register many devices of the default home: a JSON array or an NDJSON stream."""
+    return await _add_devices_bulk(_default, request)
+
+
+@app.delete("/devices/{device_id}")
+def delete_device(device_id: str) -> Dict[str, Any]:
+    registry.remove(device_id)
+    return {"ok": True}
+
+
+def _series(shard: HomeShard, device_id: str, field: Optional[str], points: bool) -> Dict[str, Any]:
+    if field is None:
+        return {"device_id": device_id, "series": shard.store.series_stats(device_id)}
+    stats = shard.store.series_stats(device_id).get(field)
+    if stats is None:
+        last = shard.store.last_telemetry.get(device_id) or {}
+        data, device_type = last.get("data"), last.get("device_type")
+        if SERIES_ON_REQUEST and device_type is not None and isinstance(data, dict) and field.split(":", 1)[0] in data:
+            # first read of this field: record it for this device type from now on
+            shard.store.want_series("rest", device_type, field)
+            raise HTTPException(status_code=404, detail=f"no samples for {device_id}/{field} yet; recording started")
+        raise HTTPException(status_code=404, detail=f"no samples for {device_id}/{field}")
+    out = {"device_id": device_id, "field": field, **stats}
+    if points:
+        out["points"] = shard.store.series_points(device_id, field)
+    return out
+
+
+@app.get("/devices/{device_id}/series")
+def get_device_series(device_id: str) -> Dict[str, Any]:
+    """Windowed aggregates of every numeric/bool field of a device."""
+    return _series(_default, device_id, None, False)
+
+
+@app.get("/devices/{device_id}/series/{field}")
+def get_device_field_series(device_id: str, field: str, points: bool = False) -> Dict[str, Any]:
+    """Windowed aggregates of one field; points=true adds the raw (ts, value) samples."""
+    return _series(_default, device_id, field, points)
+
+
+def _meter_anomaly(shard: HomeShard, device_id: str) -> Dict[str, Any]:
+    info = shard.store.meter_detector(device_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"no meter samples for {device_id}")
+    return {"device_id": device_id, **info}
+
+
+@app.get("/meters/{device_id}/anomaly")
+def get_meter_anomaly(device_id: str) -> Dict[str, Any]:
+    """Detector state of one meter: EWMA mean/std, last z-score, CUSUM and current flags."""
+    return _meter_anomaly(_default, device_id)
+
+
+def _consumption(shard: HomeShard, device_id: str, start: Optional[str], end: Optional[str], step: str) -> Dict[str, Any]:
+    try:
+        step_s = parse_step(step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        t0, t1 = parse_time(start), parse_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be unix seconds or ISO-8601")
+    if t1 is None:
+        t1 = shard.store.now()
+    if t0 is None:
+        t0 = t1 - CONSUMPTION_DEFAULT_POINTS * step_s
+    if t0 >= t1:
+        raise HTTPException(status_code=400, detail="from must be before to")
+    if (t1 - t0) / step_s > CONSUMPTION_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"at most {CONSUMPTION_MAX_POINTS} buckets per query")
+
+    result = shard.store.consumption(device_id, t0, t1, step_s)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"no meter samples for {device_id}")
+    last = shard.store.last_telemetry.get(device_id) or {}  # lock-free read of the published map
+    data = last.get("data")
+    return {
+        "device_id": device_id,
+        "device_type": last.get("device_type"),
+        "unit": data.get("unit") if isinstance(data, dict) else None,
+        **result,
+    }
+
+
+@app.get("/meters/{device_id}/consumption")
+def get_meter_consumption(
+    device_id: str,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    step: str = "hour",
+) -> Dict[str, Any]:
+    """
+    Consumption (sum of telemetry deltas) of one meter per step over
+    [from, to). from/to: unix seconds or ISO-8601 (default: the last 24
+    steps). step: minute|hour|day, seconds, or e.g. 15m/6h/1w (a multiple
+    of 60 s). Read from the coarsest minute/hour/day rollup dividing step.
+    """
+    return _consumption(_default, device_id, start, end, step)
+
+
+@app.get("/config")
+def get_config() -> Dict[str, Any]:
+    return {"config": cfg.__dict__}
+
+
+@app.put("/config")
+def update_config(c: ConfigIn) -> Dict[str, Any]:
+    return _update_config(_default, c)
+
+
+def _put_rules(shard: HomeShard, specs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    try:
+        engine = _load_rules(shard, specs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.log({"event": "rules_update", "ts_unix": time.time(), "home_id": shard.home_id, "rules": sorted(engine.rules)})
+    return {"ok": True, "rules": specs}
+
+
+@app.get("/rules")
+def get_rules() -> Dict[str, Any]:
+    """Custom declarative rules of the default home."""
+    return {"rules": cfg.custom_rules}
+
+
+@app.put("/rules")
+def put_rules(specs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Replace the custom rules of the default home (compiled once here)."""
+    return _put_rules(_default, specs)
+
+
+@app.get("/stats")
+def get_stats() -> Dict[str, Any]:
+    """Ingest queue, decoder, event logger, command dispatch, stream and persistence counters."""
+    return {
+        "ingest": ingest.stats(),
+        "decoder": decoder.stats(),
+        "logger": logger.stats(),
+        "commands": dispatcher.stats(),
+        "stream": stream_hub.stats(),
+        "persistence": persistence.stats() if persistence is not None else None,
+        "batch_rules": batch_rules.stats() if batch_rules is not None else None,
+    }
+
+
+def _collect_stats() -> List[str]:
+    """Queue/counter gauges read from the components' stats() at scrape time."""
+    lines: List[str] = []
+    ing = ingest.stats()
+    for key in ("queue_depth", "enqueued", "processed", "dropped", "rejected", "coalesced", "errors"):
+        lines += metrics.gauge_lines(f"smarthome_ingest_{key}", f"IngestPipeline {key}", ing[key])
+    log_stats = logger.stats()
+    for key in ("queue_depth", "dropped", "written", "errors"):
+        lines += metrics.gauge_lines(f"smarthome_event_log_{key}", f"EventLogger {key}", log_stats[key])
+    lines += metrics.gauge_lines("smarthome_homes", "Homes with a shard", len(shards.home_ids()))
+    cmd_stats = dispatcher.stats()
+    for key in ("received", "merged", "suppressed", "sent"):
+        lines += metrics.gauge_lines(f"smarthome_commands_{key}", f"CommandDispatcher {key}", cmd_stats[key])
+    stream_stats = stream_hub.stats()
+    for key in ("subscribers", "pending", "published", "delivered", "dropped_pending", "dropped_slow"):
+        lines += metrics.gauge_lines(f"smarthome_stream_{key}", f"StreamHub {key}", stream_stats[key])
+    if persistence is not None:
+        persist_stats = persistence.stats()
+        for key in ("wal_records", "wal_bytes", "wal_bytes_since_checkpoint", "pending", "checkpoints"):
+            lines += metrics.gauge_lines(f"smarthome_state_{key}", f"StatePersistence {key}", persist_stats[key])
+    if batch_rules is not None:
+        batch_stats = batch_rules.stats()
+        for key in ("pending", "ticks", "homes_fired", "last_tick_ms", "errors"):
+            lines += metrics.gauge_lines(f"smarthome_batch_rules_{key}", f"BatchRuleScheduler {key}", batch_stats[key])
+    return lines
+
+
+metrics.REGISTRY.add_collector(_collect_stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """Prometheus text format (404 when METRICS_ENABLED is False)."""
+    if not metrics.enabled():
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/events")
+def get_events(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    rule: Optional[str] = None,
+    home_id: Optional[str] = None,
+    limit: int = 1000,
+) -> StreamingResponse:
+    """
+    Logged events with since <= ts_unix < until, optionally for one rule
+    (intrusion|fire|gas_spike|meter_anomaly or a custom rule name) and/or
+    one home. since/until: unix seconds or ISO-8601. Streamed as NDJSON,
+    oldest first.
+    """
+    try:
+        t0, t1 = parse_time(since), parse_time(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be unix seconds or ISO-8601")
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return StreamingResponse(event_store.iter_lines(t0, t1, rule, limit, home_id), media_type="application/x-ndjson")
+
+
+def _stream_filter(home_id: Optional[str], device_type: Optional[str], device_id: Optional[str], kinds: Optional[str]) -> StreamFilter:
+    try:
+        return StreamFilter.parse(home_id, device_type, device_id, kinds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/stream")
+async def stream_sse(
+    request: Request,
+    home_id: Optional[str] = None,
+    device_type: Optional[str] = None,
+    device_id: Optional[str] = None,
+    kinds: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Server-Sent Events of applied telemetry/state updates and rule events.
+    Filters are comma-separated lists (all homes/devices/kinds when omitted).
+    """
+    filt = _stream_filter(home_id, device_type, device_id, kinds)
+
+    async def frames():
+        sub = stream_hub.subscribe(filt)
+        try:
+            while True:
+                items = await sub.get(STREAM_KEEPALIVE_S)
+                if items:
+                    yield b"".join(i.sse for i in items)
+                elif await request.is_disconnected():
+                    break
+                else:
+                    yield b": keep-alive\n\n"
+        finally:
+            stream_hub.unsubscribe(sub)
+
+    return StreamingResponse(frames(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket("/stream")
+async def stream_ws(
+    websocket: WebSocket,
+    home_id: Optional[str] = None,
+    device_type: Optional[str] = None,
+    device_id: Optional[str] = None,
+    kinds: Optional[str] = None,
+) -> None:
+    """Same updates and filters as GET /stream, one JSON text message per update."""
+    try:
+        filt = StreamFilter.parse(home_id, device_type, device_id, kinds)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    async def wait_closed() -> None:
+        # observers send nothing; reading only notices an idle client going away
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    closed = asyncio.ensure_future(wait_closed())
+    sub = stream_hub.subscribe(filt)
+    try:
+        while not closed.done():
+            for item in await sub.get(STREAM_KEEPALIVE_S):
+                await websocket.send_text(item.json)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        closed.cancel()
+        stream_hub.unsubscribe(sub)
+
+
+# -----------------------------
+# Per-home REST endpoints (each reads only its own shard)
+# -----------------------------
+@app.get("/homes")
+def list_homes() -> Dict[str, Any]:
+    return {"homes": shards.home_ids()}
+
+
+@app.get("/homes/{home_id}/status")
+def get_home_status(
+    home_id: str,
+    since: Optional[int] = None,
+    fields: Optional[str] = None,
+    type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    view = StatusView.parse(fields, type, cursor, limit, format)
+    return _status_response(_shard_or_404(home_id), since, if_none_match, view)
+
+
+@app.get("/homes/{home_id}/devices")
+def list_home_devices(
+    home_id: str,
+    type: Optional[str] = None,
+    kind: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEVICES_PAGE_LIMIT,
+) -> Dict[str, Any]:
+    return _list_devices(_shard_or_404(home_id), type, kind, cursor, limit)
+
+
+@app.post("/homes/{home_id}/devices")
+def add_home_device(home_id: str, d: DeviceIn) -> Dict[str, Any]:
+    return _add_device(shards.get(home_id), d)
+
+
+@app.post("/homes/{home_id}/devices/bulk")
+async def add_home_devices_bulk(home_id: str, request: Request) -> Dict[str, Any]:
+    return await _add_devices_bulk(shards.get(home_id), request)
+
+
+@app.delete("/homes/{home_id}/devices/{device_id}")
+def delete_home_device(home_id: str, device_id: str) -> Dict[str, Any]:
+    _shard_or_404(home_id).registry.remove(device_id)
+    return {"ok": True}
+
+
+@app.get("/homes/{home_id}/devices/{device_id}/series")
+def get_home_device_series(home_id: str, device_id: str) -> Dict[str, Any]:
+    return _series(_shard_or_404(home_id), device_id, None, False)
+
+
+@app.get("/homes/{home_id}/devices/{device_id}/series/{field}")
+def get_home_device_field_series(home_id: str, device_id: str, field: str, points: bool = False) -> Dict[str, Any]:
+    return _series(_shard_or_404(home_id), device_id, field, points)
+
+
+@app.get("/homes/{home_id}/meters/{device_id}/anomaly")
+def get_home_meter_anomaly(home_id: str, device_id: str) -> Dict[str, Any]:
+    return _meter_anomaly(_shard_or_404(home_id), device_id)
+
+
+@app.get("/homes/{home_id}/meters/{device_id}/consumption")
+def get_home_meter_consumption(
+    home_id: str,
+    device_id: str,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    step: str = "hour",
+) -> Dict[str, Any]:
+    return _consumption(_shard_or_404(home_id), device_id, start, end, step)
+
+
+@app.get("/homes/{home_id}/config")
+def get_home_config(home_id: str) -> Dict[str, Any]:
+    return {"config": _shard_or_404(home_id).cfg.__dict__}
+
+
+@app.put("/homes/{home_id}/config")
+def update_home_config(home_id: str, c: ConfigIn) -> Dict[str, Any]:
+    return _update_config(shards.get(home_id), c)
+
+
+@app.get("/homes/{home_id}/rules")
+def get_home_rules(home_id: str) -> Dict[str, Any]:
+    return {"rules": _shard_or_404(home_id).cfg.custom_rules}
+
+
+@app.put("/homes/{home_id}/rules")
+def put_home_rules(home_id: str, specs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return _put_rules(shards.get(home_id), specs)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,287 @@
+"""
+Low-overhead counters, histograms and lock-wait instrumentation, rendered
+in the Prometheus text exposition format (GET /metrics).
+
+Instrumentation is global and can be switched off entirely with
+set_enabled(False): counters/histograms then return immediately and locks
+created afterwards by new_lock() are plain threading.Locks.
+
+Hot paths keep a reference to a labelled child (`X.labels(...)`) and time
+with `t0 = metrics.clock()` ... `child.observe_since(t0)`.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+_enabled = True
+
+# timestamps for observe_since(); a plain reference keeps the hot path to one C call
+clock = time.perf_counter
+
+# seconds; spans sub-microsecond dict updates up to multi-second stalls
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    1e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+def set_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1) -> None:
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += n
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children: Dict[Labels, _CounterChild] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> _CounterChild:
+        """Child for one label combination; hot paths keep a reference to it."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, _CounterChild())
+        return child
+
+    def inc(self, *labels: str, n: float = 1) -> None:
+        if _enabled:
+            self.labels(*labels).inc(n)
+
+    def value(self, *labels: str) -> float:
+        child = self._children.get(labels)
+        return child.value if child else 0.0
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._children.items())
+        for labels, child in items:
+            out.append(f"{self.name}{_label_str(self.label_names, labels)} {_fmt(child.value)}")
+        return out
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # +Inf last
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if not _enabled:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_since(self, t0: float) -> None:
+        """Observe clock() - t0 (t0 taken with metrics.clock()); observe() inlined for the hot path."""
+        if not _enabled:
+            return
+        value = clock() - t0
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Labels, _HistogramChild] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> _HistogramChild:
+        """Child for one label combination; hot paths keep a reference to it."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float, *labels: str) -> None:
+        if _enabled:
+            self.labels(*labels).observe(value)
+
+    def count(self, *labels: str) -> int:
+        child = self._children.get(labels)
+        return child.count if child else 0
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._children.items())
+        for labels, child in items:
+            with child._lock:
+                counts, total, n = list(child.counts), child.sum, child.count
+            cum = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le_label = 'le="%s"' % _fmt(le)
+                out.append(f"{self.name}_bucket{_label_str(self.label_names, labels, le_label)} {cum}")
+            out.append(f"{self.name}_sum{_label_str(self.label_names, labels)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_label_str(self.label_names, labels)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, fn: Callable[[], List[str]]) -> None:
+        """fn returns ready-made exposition lines (e.g. gauges read from stats() at scrape time)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines += m.render()
+        for fn in self._collectors:
+            lines += fn()
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, help_text: str, value: float, labels: Optional[Dict[str, str]] = None) -> List[str]:
+    lbl = _label_str(list(labels), list(labels.values())) if labels else ""
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name}{lbl} {_fmt(value)}"]
+
+
+REGISTRY = Registry()
+
+# -----------------------------
+# Pipeline metrics
+# -----------------------------
+MESSAGES = REGISTRY.counter(
+    "smarthome_messages_total", "Decoded telemetry/state messages", ("channel", "device_type"))
+DECODE_FAILURES = REGISTRY.counter(
+    "smarthome_decode_failures_total", "Payloads rejected by the decoder", ("channel",))
+DECODE_SECONDS = REGISTRY.histogram(
+    "smarthome_decode_seconds", "Time decoding one payload", ("format",))
+STORE_UPDATE_SECONDS = REGISTRY.histogram(
+    "smarthome_store_update_seconds", "Time in StateStore.update_telemetry/update_state", ("channel",))
+EVALUATE_SECONDS = REGISTRY.histogram(
+    "smarthome_evaluate_rules_seconds", "Time evaluating builtin (evaluate_rules) or custom rules", ("rules",))
+LOG_SECONDS = REGISTRY.histogram(
+    "smarthome_event_log_seconds", "Time in EventLogger.log (enqueue only)")
+PUBLISH_SECONDS = REGISTRY.histogram(
+    "smarthome_publish_cmd_seconds", "Time in _publish_cmds (encode + MQTT publish of one evaluation's commands)")
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "smarthome_lock_wait_seconds", "Wait time of contended lock acquisitions (_count = contentions)", ("lock",))
+
+
+def new_lock(name: str) -> Any:
+    """InstrumentedLock while metrics are enabled, a plain threading.Lock otherwise."""
+    return InstrumentedLock(name) if _enabled else threading.Lock()
+
+
+class InstrumentedLock:
+    """
+    threading.Lock that records how long contended acquisitions waited.
+    An uncontended acquisition is a single non-blocking try.
+    """
+
+    __slots__ = ("name", "_lock")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        t0 = clock()
+        ok = self._lock.acquire(True, timeout)
+        if ok:
+            LOCK_WAIT_SECONDS.observe(clock() - t0, self.name)
+        return ok
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        if not self._lock.acquire(False):
+            self._wait()
+        return True
+
+    def _wait(self) -> None:
+        t0 = clock()
+        self._lock.acquire()
+        LOCK_WAIT_SECONDS.observe(clock() - t0, self.name)
+
+    def __exit__(self, *exc: Any) -> None:
+        self._lock.release()
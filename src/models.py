@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import math
 from dataclasses import dataclass
-from typing import Any, Dict, Literal
+from typing import Any, Dict, Literal, Optional
 from datetime import datetime, timezone
 
 
@@ -29,11 +30,49 @@ def utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Accept unix seconds ("1770220604.6") or ISO-8601 ("2026-02-04T16:00:00Z")."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+# numeric envelope timestamps above this are epoch milliseconds (binary wire format)
+_EPOCH_MS_MIN = 1e11
+
+
+def envelope_ts(env: Dict[str, Any]) -> Optional[float]:
+    """Envelope "ts" (ISO-8601, unix seconds or epoch ms) -> unix seconds, None if missing/unparseable."""
+    ts = env.get("ts")
+    if isinstance(ts, bool):
+        return None
+    if isinstance(ts, (int, float)):
+        if not math.isfinite(ts):
+            return None
+        return ts / 1000.0 if ts >= _EPOCH_MS_MIN else float(ts)
+    if isinstance(ts, str):
+        try:
+            return parse_time(ts)
+        except ValueError:
+            return None
+    return None
+
+
 def topic(home_id: HomeId, device_id: DeviceId, channel: Channel) -> str:
     """Standard topic schema for this project."""
     return f"home/{home_id}/{device_id}/{channel}"
 
 
+ALL_HOMES = "+"  # MQTT single-level wildcard in the home_id position
+
+
 def wildcard_telemetry(home_id: HomeId) -> str:
     """Subscribe to telemetry of all devices inside a home."""
     return f"home/{home_id}/+/telemetry"
@@ -44,6 +83,11 @@ def wildcard_state(home_id: HomeId) -> str:
     return f"home/{home_id}/+/state"
 
 
+def wildcard_cmd(home_id: HomeId) -> str:
+    """Subscribe to commands for all devices inside a home."""
+    return f"home/{home_id}/+/cmd"
+
+
 @dataclass
 class DeviceInfo:
     """Registry entry."""
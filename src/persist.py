@@ -0,0 +1,457 @@
+"""
+Durable per-home state: periodic checkpoints plus a write-ahead log (WAL),
+so a restarted manager resumes with its last telemetry/state, rule edge
+flags, cooldown timestamps, registry, config and consumption rollups.
+
+Journaling: StateStore calls journal(kind, key, value) for every durable
+change (see attach()). The hot path only enqueues a tuple; a writer thread
+frames records as <u32 length><u32 crc32><JSON [home, kind, key, value]>
+and appends them to wal-<seq>.log in batches.
+
+Checkpoints: the writer first switches to a new WAL segment S and then
+writes every home to checkpoint-<S>.ckpt. Records are last-writer-wins, so
+replaying segments >= S over that checkpoint is correct even for changes
+the checkpoint already contains. The exception is rollup "sample" records
+(one per meter delta), which add up: each carries a per-store sequence
+number, the checkpoint stores the last one it covers, and recovery only
+adds the samples after it. A checkpoint is taken every
+checkpoint_interval_s, or earlier once the WAL since the last one exceeds
+max_wal_bytes; that bounds recovery time. Older segments and checkpoints
+are deleted afterwards.
+
+Recovery mmaps the newest complete checkpoint and the WAL segments after
+it, folds everything into plain dicts and builds each StateStore once
+(with the cyclic GC paused). A torn or corrupt record (crash mid-write)
+ends its segment.
+"""
+
+from __future__ import annotations
+
+import gc
+import glob
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .models import DeviceId, DeviceInfo, HomeId
+from .state import HomeShard, HomeShards
+
+try:  # optional fast JSON
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+FORMAT_VERSION = 1
+
+_FRAME = struct.Struct("<II")  # body length, crc32(body)
+_WAL_BATCH = 4096  # records serialized per write
+_STOP = object()
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def frame(obj: Any) -> bytes:
+    body = _dumps(obj)
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_records(path: str) -> Iterator[Any]:
+    """Records of one WAL/checkpoint file (mmap); stops at the first torn or corrupt record."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            off = 0
+            while off + _FRAME.size <= size:
+                n, crc = _FRAME.unpack_from(mm, off)
+                start, end = off + _FRAME.size, off + _FRAME.size + n
+                if end > size:
+                    return
+                body = mm[start:end]
+                if zlib.crc32(body) != crc:
+                    return
+                yield _loads(body)
+                off = end
+
+
+def _seq(path: str) -> int:
+    return int(os.path.basename(path).split("-", 1)[1].split(".", 1)[0])
+
+
+@dataclass
+class HomeImage:
+    """Plain-dict image of one home, built from a checkpoint and folded WAL records."""
+    telemetry: Dict[DeviceId, Dict[str, Any]] = field(default_factory=dict)
+    state: Dict[DeviceId, Dict[str, Any]] = field(default_factory=dict)
+    rule_active: Dict[str, bool] = field(default_factory=dict)
+    last_trigger_ts: Dict[str, float] = field(default_factory=dict)
+    devices: Dict[DeviceId, Dict[str, Any]] = field(default_factory=dict)
+    config: Optional[Dict[str, Any]] = None
+    # consumption rollups (rollup.ConsumptionRollups.dump) covering samples up to rollup_seq
+    rollups: Dict[DeviceId, Dict[str, List[str]]] = field(default_factory=dict)
+    rollup_seq: int = 0
+    # (seq, device_id, ts, delta) of WAL "sample" records; never written to a checkpoint
+    samples: List[Tuple[int, DeviceId, float, Any]] = field(default_factory=list, init=False, repr=False)
+
+    def apply(self, kind: str, key: Optional[str], value: Any) -> None:
+        if kind == "telemetry":
+            self.telemetry[key] = value
+        elif kind == "state":
+            self.state[key] = value
+        elif kind == "devices":
+            if value is None:
+                self.devices.pop(key, None)
+            else:
+                self.devices[key] = value
+        elif kind == "config":
+            self.config = value
+        elif kind == "rule_active":
+            self.rule_active.update(value)
+        elif kind == "trigger":
+            self.last_trigger_ts[key] = value
+        elif kind == "sample":
+            # additive, not last-writer-wins: samples the checkpoint already holds are skipped by seq
+            seq, ts, delta = value
+            if seq > self.rollup_seq:
+                self.samples.append((seq, key, ts, delta))
+
+    @classmethod
+    def capture(cls, shard: HomeShard) -> "HomeImage":
+        snap = shard.store.snapshot()
+        rules = shard.store.rule_state()
+        rollup_seq, rollups = shard.store.rollup_state()
+        return cls(
+            telemetry=snap.telemetry.to_dict(),
+            state=snap.state.to_dict(),
+            rule_active=rules["rule_active"],
+            last_trigger_ts=rules["last_trigger_ts"],
+            devices={k: dict(v.__dict__) for k, v in shard.registry.list_all().items()},
+            config=dict(shard.cfg.__dict__),
+            rollups=rollups,
+            rollup_seq=rollup_seq,
+        )
+
+    def restore_into(self, shard: HomeShard) -> None:
+        shard.store.restore(self.telemetry, self.state, self.rule_active, self.last_trigger_ts)
+        try:
+            shard.store.restore_rollups(self.rollups, self.rollup_seq, self.samples)
+        except ValueError:  # corrupt checkpointed rollups: keep what the WAL has
+            shard.store.restore_rollups({}, self.rollup_seq, self.samples)
+        shard.registry.restore(DeviceInfo(**d) for d in self.devices.values())
+        if self.config:
+            for k, v in self.config.items():
+                if hasattr(shard.cfg, k):
+                    setattr(shard.cfg, k, v)
+            try:
+                shard.configure_meters()
+            except ValueError:
+                shard.cfg.meter_detectors = {}
+                shard.configure_meters()
+
+
+# checkpoint keys HomeImage accepts; others (written by older or newer versions) are ignored
+_IMAGE_FIELDS = frozenset(f.name for f in fields(HomeImage) if f.init)
+
+
+@dataclass
+class RecoveryResult:
+    checkpoint: Optional[str]
+    homes: int = 0
+    devices: int = 0  # devices with last telemetry or state
+    wal_segments: int = 0
+    wal_records: int = 0
+    seconds: float = 0.0
+
+
+class StatePersistence:
+    """Checkpoint + WAL writer for all HomeShards, and startup recovery."""
+
+    def __init__(
+        self,
+        state_dir: str,
+        checkpoint_interval_s: float = 60.0,
+        max_wal_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = False,
+    ) -> None:
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.max_wal_bytes = max_wal_bytes
+        self.fsync = fsync
+
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._shards: Optional[HomeShards] = None
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0  # current WAL segment
+        self._wal_bytes = 0  # written since the last checkpoint (incl. replayed on startup)
+
+        self._lock = threading.Lock()  # guards counters only
+        self.records = 0
+        self.bytes = 0
+        self.checkpoints = 0
+        self.last_checkpoint_s = 0.0
+        self.recovery: Optional[RecoveryResult] = None
+
+    # -----------------------------
+    # Files
+    # -----------------------------
+    def _wal_path(self, seq: int) -> str:
+        return os.path.join(self.state_dir, f"wal-{seq:08d}.log")
+
+    def _checkpoint_path(self, seq: int) -> str:
+        return os.path.join(self.state_dir, f"checkpoint-{seq:08d}.ckpt")
+
+    def _files(self, prefix: str, suffix: str) -> List[Tuple[int, str]]:
+        paths = glob.glob(os.path.join(self.state_dir, f"{prefix}-*{suffix}"))
+        return sorted((_seq(p), p) for p in paths)
+
+    # -----------------------------
+    # Recovery
+    # -----------------------------
+    def load(self) -> Tuple[Dict[HomeId, HomeImage], RecoveryResult]:
+        """Fold the newest checkpoint and the WAL after it into per-home images."""
+        t0 = time.perf_counter()
+        images: Dict[HomeId, HomeImage] = {}
+        result = RecoveryResult(checkpoint=None)
+
+        base_seq = 0
+        for seq, path in reversed(self._files("checkpoint", ".ckpt")):
+            records = read_records(path)
+            header = next(records, None)
+            if not isinstance(header, dict) or header.get("format") != FORMAT_VERSION:
+                continue
+            homes: Dict[HomeId, HomeImage] = {}
+            for rec in records:
+                if rec.get("end"):
+                    break
+                homes[rec["home_id"]] = HomeImage(**{k: v for k, v in rec.items() if k in _IMAGE_FIELDS})
+            else:
+                continue  # no end marker: incomplete checkpoint, try an older one
+            images, base_seq, result.checkpoint = homes, seq, path
+            break
+
+        for seq, path in self._files("wal", ".log"):
+            if seq < base_seq:
+                continue
+            result.wal_segments += 1
+            for home_id, kind, key, value in read_records(path):
+                img = images.get(home_id)
+                if img is None:
+                    img = images[home_id] = HomeImage()
+                img.apply(kind, key, value)
+                result.wal_records += 1
+            self._wal_bytes += os.path.getsize(path)
+
+        result.homes = len(images)
+        result.devices = sum(len(set(i.telemetry) | set(i.state)) for i in images.values())
+        result.seconds = time.perf_counter() - t0
+        return images, result
+
+    def recover(self, shards: HomeShards) -> Optional[RecoveryResult]:
+        """Restore every persisted home into shards; None if nothing was persisted."""
+        t0 = time.perf_counter()
+        # millions of long-lived objects: cyclic GC passes would dominate the load time
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            images, result = self.load()
+            for home_id, img in images.items():
+                img.restore_into(shards.get(home_id))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        result.seconds = time.perf_counter() - t0
+        self.recovery = result
+        if result.checkpoint is None and not result.wal_records:
+            return None
+        return result
+
+    # -----------------------------
+    # Journaling
+    # -----------------------------
+    def attach(self, shard: HomeShard) -> None:
+        """Journal this shard's store, registry and config changes."""
+        home_id = shard.home_id
+        registry = shard.registry
+        put = self._queue.put
+
+        def journal(kind: str, key: Optional[str], value: Any) -> None:
+            if kind == "devices":
+                info = registry.get(key)
+                value = dict(info.__dict__) if info is not None else None
+            elif kind == "config":
+                value = dict(shard.cfg.__dict__)
+            put((home_id, kind, key, value))
+
+        shard.store.journal = journal
+
+    def start(self, shards: HomeShards) -> None:
+        """Attach to existing and future shards and start the writer (call after recover())."""
+        self._shards = shards
+        for home_id in shards.home_ids():
+            shard = shards.peek(home_id)
+            if shard is not None:
+                self.attach(shard)
+        shards.on_create = self.attach
+
+        existing = self._files("wal", ".log") + self._files("checkpoint", ".ckpt")
+        self._seq = max((seq for seq, _ in existing), default=0) + 1
+        self._thread = threading.Thread(target=self._run, name="state-wal", daemon=True)
+        self._thread.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything journaled so far is written."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def checkpoint(self, timeout: Optional[float] = None) -> bool:
+        """Ask the writer for a checkpoint now and wait for it."""
+        done = threading.Event()
+        self._queue.put(("checkpoint", done))
+        return done.wait(timeout)
+
+    def close(self, checkpoint: bool = True, timeout: Optional[float] = 30.0) -> None:
+        """Write pending records (and a final checkpoint for a fast next start), then stop."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        if checkpoint:
+            self.checkpoint(timeout)
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {
+                "wal_segment": self._seq,
+                "wal_records": self.records,
+                "wal_bytes": self.bytes,
+                "wal_bytes_since_checkpoint": self._wal_bytes,
+                "pending": self._queue.qsize(),
+                "checkpoints": self.checkpoints,
+                "last_checkpoint_s": round(self.last_checkpoint_s, 6),
+            }
+        if self.recovery is not None:
+            out["recovery"] = dict(self.recovery.__dict__)
+        return out
+
+    # -----------------------------
+    # Writer thread
+    # -----------------------------
+    def _open_segment(self) -> Any:
+        return open(self._wal_path(self._seq), "ab")
+
+    def _sync(self, f: Any) -> None:
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _write_checkpoint(self, f: Any) -> Any:
+        """Switch to a new WAL segment, write checkpoint-<new seq>, drop older files."""
+        t0 = time.perf_counter()
+        self._sync(f)
+        f.close()
+        self._seq += 1
+        seq = self._seq
+        f = self._open_segment()
+
+        path = self._checkpoint_path(seq)
+        tmp = path + ".tmp"
+        shards = self._shards
+        with open(tmp, "wb") as out:
+            out.write(frame({"format": FORMAT_VERSION, "wal_seq": seq, "created": time.time()}))
+            for home_id in (shards.home_ids() if shards is not None else []):
+                shard = shards.peek(home_id)
+                if shard is None:
+                    continue
+                rec = dict(HomeImage.capture(shard).__dict__)
+                del rec["samples"]
+                rec["home_id"] = home_id
+                out.write(frame(rec))
+            out.write(frame({"end": True}))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, path)
+
+        for old_seq, old in self._files("wal", ".log") + self._files("checkpoint", ".ckpt"):
+            if old_seq < seq:
+                os.remove(old)
+        with self._lock:
+            self._wal_bytes = 0
+            self.checkpoints += 1
+            self.last_checkpoint_s = time.perf_counter() - t0
+        return f
+
+    def _run(self) -> None:
+        f = self._open_segment()
+        next_checkpoint = time.monotonic() + self.checkpoint_interval_s
+        try:
+            while True:
+                timeout = max(0.0, next_checkpoint - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                records: List[Any] = []
+                controls: List[Any] = []
+                while item is not None:
+                    if isinstance(item, tuple) and len(item) == 4:
+                        records.append(item)
+                    else:
+                        controls.append(item)
+                    if len(records) >= _WAL_BATCH or controls:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+
+                if records:
+                    data = b"".join(frame(list(r)) for r in records)
+                    f.write(data)
+                    with self._lock:
+                        self.records += len(records)
+                        self.bytes += len(data)
+                        self._wal_bytes += len(data)
+
+                wanted = [c for c in controls if isinstance(c, tuple)]
+                if (
+                    wanted
+                    or time.monotonic() >= next_checkpoint
+                    or self._wal_bytes >= self.max_wal_bytes
+                ):
+                    f = self._write_checkpoint(f)
+                    next_checkpoint = time.monotonic() + self.checkpoint_interval_s
+                elif records and self._queue.empty():
+                    self._sync(f)
+
+                for c in controls:
+                    if isinstance(c, tuple):
+                        c[1].set()
+                    elif isinstance(c, threading.Event):
+                        self._sync(f)
+                        c.set()
+                    elif c is _STOP:
+                        return
+        finally:
+            self._sync(f)
+            f.close()
@@ -0,0 +1,150 @@
+"""
+Immutable hash map with structural sharing (copy-on-write), used for
+StateStore snapshots.
+
+Layout: a fixed two-level trie, 64 x 64 leaf dicts selected by hash bits.
+set()/delete() copy one leaf dict and the two 64-slot nodes on its path and
+share everything else, so a write costs O(n / 4096 + 64) and taking a
+snapshot is just keeping a reference. Nodes are plain lists/dicts (cheapest
+to copy) but are never mutated after they are published, so readers need
+no lock.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple
+
+_BITS = 6
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+
+_Leaf = Optional[Dict[Hashable, Any]]
+_Mid = List[_Leaf]
+
+# shared and never mutated
+_EMPTY_MID: _Mid = [None] * _WIDTH
+_EMPTY_ROOT: List[_Mid] = [_EMPTY_MID] * _WIDTH
+
+
+def _replace(node: List[Any], i: int, value: Any) -> List[Any]:
+    new = node.copy()
+    new[i] = value
+    return new
+
+
+class PMap(Mapping[Hashable, Any]):
+    __slots__ = ("_root", "_len")
+
+    def __init__(self) -> None:
+        self._root = _EMPTY_ROOT
+        self._len = 0
+
+    @classmethod
+    def _make(cls, root: List[_Mid], length: int) -> "PMap":
+        m = cls.__new__(cls)
+        m._root = root
+        m._len = length
+        return m
+
+    @classmethod
+    def from_dict(cls, items: Mapping[Hashable, Any]) -> "PMap":
+        """Bulk build in O(n) (e.g. on recovery) instead of n set() calls."""
+        root = list(_EMPTY_ROOT)
+        for key, value in items.items():
+            h = hash(key)
+            i, j = h & _MASK, (h >> _BITS) & _MASK
+            mid = root[i]
+            if mid is _EMPTY_MID:
+                mid = root[i] = [None] * _WIDTH
+            leaf = mid[j]
+            if leaf is None:
+                leaf = mid[j] = {}
+            leaf[key] = value
+        return cls._make(root, len(items))
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def _leaf(self, key: Hashable) -> _Leaf:
+        h = hash(key)
+        return self._root[h & _MASK][(h >> _BITS) & _MASK]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        leaf = self._leaf(key)
+        if leaf is None:
+            raise KeyError(key)
+        return leaf[key]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        leaf = self._leaf(key)
+        return default if leaf is None else leaf.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        leaf = self._leaf(key)  # type: ignore[arg-type]
+        return leaf is not None and key in leaf
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Hashable]:
+        for mid in self._root:
+            if mid is _EMPTY_MID:
+                continue
+            for leaf in mid:
+                if leaf:
+                    yield from leaf
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:  # type: ignore[override]
+        for mid in self._root:
+            if mid is _EMPTY_MID:
+                continue
+            for leaf in mid:
+                if leaf:
+                    yield from leaf.items()
+
+    def to_dict(self) -> Dict[Hashable, Any]:
+        out: Dict[Hashable, Any] = {}
+        for mid in self._root:
+            if mid is _EMPTY_MID:
+                continue
+            for leaf in mid:
+                if leaf:
+                    out.update(leaf)
+        return out
+
+    def __repr__(self) -> str:
+        return f"PMap({self.to_dict()!r})"
+
+    # -----------------------------
+    # Writes (return a new map)
+    # -----------------------------
+    def set(self, key: Hashable, value: Any) -> "PMap":
+        h = hash(key)
+        i, j = h & _MASK, (h >> _BITS) & _MASK
+        mid = self._root[i]
+        leaf = mid[j]
+        if leaf is None:
+            new_leaf = {key: value}
+            added = 1
+        else:
+            added = 0 if key in leaf else 1
+            new_leaf = leaf.copy()
+            new_leaf[key] = value
+        return PMap._make(_replace(self._root, i, _replace(mid, j, new_leaf)), self._len + added)
+
+    def delete(self, key: Hashable) -> "PMap":
+        """New map without key (self if key is absent)."""
+        h = hash(key)
+        i, j = h & _MASK, (h >> _BITS) & _MASK
+        mid = self._root[i]
+        leaf = mid[j]
+        if leaf is None or key not in leaf:
+            return self
+        new_leaf: _Leaf = leaf.copy()
+        del new_leaf[key]
+        if not new_leaf:
+            new_leaf = None
+        new_mid = _replace(mid, j, new_leaf)
+        if not any(new_mid):
+            new_mid = _EMPTY_MID
+        return PMap._make(_replace(self._root, i, new_mid), self._len - 1)
@@ -0,0 +1,217 @@
+"""
+Offline replay of recorded telemetry for threshold backtesting.
+
+A capture is JSONL of envelopes as produced by models.make_envelope (one per
+line, optionally gzipped), e.g. recorded with
+
+    mosquitto_sub -t 'home/+/+/telemetry' > capture.jsonl
+
+Each message goes through rules.process_message exactly like the manager
+does, minus broker, decoding and command dispatch. A virtual clock follows
+the envelope timestamps, so cooldowns and windowed aggregates behave as
+they did live while the replay runs as fast as the CPU allows.
+
+    python -m src.replay capture.jsonl --set temp_threshold=50,60 --set gas_spike_ratio=2,3 --processes 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+
+from .models import envelope_ts
+from .rule_engine import RuleEngine, load_rule_specs
+from .rules import process_message
+from .state import Config, HomeShard, StateStore
+
+
+class VirtualClock:
+    """Clock driven by message timestamps; never goes backwards."""
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now_s = start
+
+    def __call__(self) -> float:
+        return self.now_s
+
+    def advance_to(self, ts: Optional[float]) -> None:
+        if ts is not None and ts > self.now_s:
+            self.now_s = ts
+
+
+def _open(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def load_capture(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield envelopes from a JSONL capture; malformed lines are skipped."""
+    with _open(path) as f:
+        for line in f:
+            try:
+                env = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(env, dict) and env.get("home_id") and env.get("device_id"):
+                yield env
+
+
+@dataclass
+class ReplayResult:
+    config: Dict[str, Any]
+    messages: int = 0
+    skipped: int = 0  # no usable timestamp
+    triggers: Dict[str, int] = field(default_factory=dict)  # logged rule name -> count
+    commands: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def msgs_per_s(self) -> float:
+        return self.messages / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "config": self.config,
+            "messages": self.messages,
+            "skipped": self.skipped,
+            "triggers": dict(sorted(self.triggers.items())),
+            "total_triggers": sum(self.triggers.values()),
+            "commands": self.commands,
+            "elapsed_s": round(self.elapsed_s, 6),
+            "msgs_per_s": round(self.msgs_per_s, 1),
+        }
+
+
+def replay(messages: Iterable[Dict[str, Any]], cfg: Config, channel: str = "telemetry") -> ReplayResult:
+    """
+    Feed envelopes through rules.process_message with a fresh store per
+    home and a copy of cfg for each home. Messages without a timestamp are
+    skipped (their time is unknown, so cooldowns could not be honoured).
+    """
+    clock = VirtualClock()
+    shards: Dict[str, HomeShard] = {}
+    result = ReplayResult(config={k: v for k, v in cfg.__dict__.items() if k != "custom_rules"})
+    t0 = time.perf_counter()
+    for env in messages:
+        ts = envelope_ts(env)
+        if ts is None:
+            result.skipped += 1
+            continue
+        clock.advance_to(ts)
+
+        home_id = env["home_id"]
+        shard = shards.get(home_id)
+        if shard is None:
+            shard = HomeShard(home_id, cfg=Config(**cfg.__dict__), store=StateStore(clock=clock))
+            if cfg.custom_rules:
+                engine = RuleEngine(cfg.custom_rules)
+                # windowed series are only recorded for the "stat" leaves that read them
+                shard.store.set_series_fields("rules", engine.series_fields)
+                shard.engine = engine if engine.rules else None
+            shards[home_id] = shard
+
+        commands, events = process_message(shard, channel, env, clock.now_s)
+        result.messages += 1
+        result.commands += len(commands)
+        for e in events:
+            result.triggers[e["rule"]] = result.triggers.get(e["rule"], 0) + 1
+    result.elapsed_s = time.perf_counter() - t0
+    return result
+
+
+def replay_file(path: str, cfg: Config) -> ReplayResult:
+    return replay(load_capture(path), cfg)
+
+
+def sweep(path: str, configs: List[Config], processes: int = 1) -> List[ReplayResult]:
+    """Replay one capture once per config, in parallel processes when processes > 1."""
+    if processes <= 1 or len(configs) <= 1:
+        return [replay_file(path, c) for c in configs]
+    with ProcessPoolExecutor(max_workers=min(processes, len(configs))) as pool:
+        return list(pool.map(replay_file, itertools.repeat(path), configs))
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+_CONFIG_TYPES = {f.name: f.type for f in fields(Config) if f.name not in ("custom_rules", "meter_detectors")}
+
+
+def _parse_value(name: str, raw: str) -> Any:
+    kind = _CONFIG_TYPES[name]
+    if kind in ("bool", bool):
+        if raw.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"{name}: expected true/false, got {raw}")
+        return raw.lower() in ("true", "1")
+    return float(raw)
+
+
+def _parse_sets(items: List[str]) -> Dict[str, List[Any]]:
+    """["temp_threshold=50,60", ...] -> {"temp_threshold": [50.0, 60.0], ...}"""
+    grid: Dict[str, List[Any]] = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        if name not in _CONFIG_TYPES or not values:
+            raise ValueError(f"bad --set {item!r}; fields: {', '.join(_CONFIG_TYPES)}")
+        grid[name] = [_parse_value(name, v) for v in values.split(",")]
+    return grid
+
+
+def config_grid(base: Config, grid: Dict[str, List[Any]]) -> List[Config]:
+    """Cartesian product of the grid values applied on top of base."""
+    names = list(grid)
+    out = []
+    for values in itertools.product(*(grid[n] for n in names)):
+        c = Config(**base.__dict__)
+        for n, v in zip(names, values):
+            setattr(c, n, v)
+        out.append(c)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Replay a telemetry capture against one or more configs")
+    ap.add_argument("capture", help="JSONL (or .jsonl.gz) of telemetry envelopes")
+    ap.add_argument("--set", action="append", default=[], metavar="FIELD=V1,V2",
+                    help="Config field values to sweep (repeatable; all combinations are replayed)")
+    ap.add_argument("--armed", action="store_true", help="replay with the system armed")
+    ap.add_argument("--rules", default=None, help="custom rules file (.json/.yaml) to replay as well")
+    ap.add_argument("--processes", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print one JSON object per config")
+    args = ap.parse_args()
+
+    base = Config(armed=args.armed)
+    if args.rules:
+        base.custom_rules = load_rule_specs(args.rules)
+    try:
+        configs = config_grid(base, _parse_sets(args.set))
+    except ValueError as e:
+        ap.error(str(e))
+
+    t0 = time.perf_counter()
+    results = sweep(args.capture, configs, args.processes)
+    wall = time.perf_counter() - t0
+
+    swept = [item.partition("=")[0] for item in args.set]
+    for r in results:
+        if args.json:
+            print(json.dumps(r.to_dict()))
+        else:
+            params = " ".join(f"{n}={r.config[n]}" for n in swept) or "(base config)"
+            triggers = ", ".join(f"{k}={v}" for k, v in sorted(r.triggers.items())) or "none"
+            print(f"{params}: {sum(r.triggers.values())} triggers ({triggers}), "
+                  f"{r.messages} msgs at {r.msgs_per_s:,.0f} msg/s")
+    if not args.json:
+        total = sum(r.messages for r in results)
+        print(f"{len(results)} configs, {total} messages in {wall:.2f}s ({total / wall:,.0f} msg/s overall)")
+
+
+if __name__ == "__main__":
+    main()
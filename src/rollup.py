@@ -0,0 +1,243 @@
+"""
+Consumption rollups of utility meters: the telemetry `delta` of every
+gas/electricity/water meter summed into minute, hour and day buckets on
+ingest, so consumption queries never scan raw samples.
+
+Samples are bucketed by the envelope "ts" (the device's reading time), so
+late or replayed messages land in the bucket they were measured in; the
+ingest time is used when the envelope has no usable ts or one too far in
+the future (MAX_CLOCK_SKEW_S, a wrong device clock).
+
+Each level of a meter is three parallel arrays (bucket number, sum of
+deltas, sample count) kept sorted by bucket: only buckets that received a
+sample are stored (20 bytes each), appending to the newest bucket is O(1),
+and a range is found by bisection. Buckets older than the level's
+retention are trimmed as new ones are appended.
+
+Rollups are persisted (see persist.py) as the base64 bytes of those arrays
+in each checkpoint, plus one WAL "sample" record per meter delta after it.
+
+A query reads one level only: the coarsest whose width divides the
+requested step (15 min -> minute buckets, 6 h -> hour buckets, 1 week ->
+day buckets).
+"""
+
+from __future__ import annotations
+
+import base64
+import math
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import DeviceId, envelope_ts
+
+# (name, bucket width in seconds, buckets retained), finest first
+LEVELS: Tuple[Tuple[str, int, int], ...] = (
+    ("minute", 60, 24 * 60),  # 1 day
+    ("hour", 3600, 31 * 24),  # 31 days
+    ("day", 86400, 2 * 366),  # 2 years
+)
+
+# buckets past the retention that may linger before a trim (amortizes the memmove)
+_TRIM_SLACK = 64
+
+# envelope timestamps further ahead of the ingest time fall back to the ingest time
+MAX_CLOCK_SKEW_S = 300.0
+
+_STEP_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_step(value: str) -> int:
+    """Seconds of a step: a level name ("hour"), seconds ("900") or "<n><s|m|h|d|w>" ("15m")."""
+    for name, width, _ in LEVELS:
+        if value == name:
+            return width
+    try:
+        step = int(value[:-1]) * _STEP_UNITS[value[-1]] if value[-1:] in _STEP_UNITS else int(value)
+    except ValueError:
+        raise ValueError(f"bad step: {value!r}") from None
+    if step <= 0 or step % LEVELS[0][1]:
+        raise ValueError(f"step must be a positive multiple of {LEVELS[0][1]} s")
+    return step
+
+
+def sample_time(message: Dict[str, Any], ingest_ts: float) -> float:
+    """Bucketing time of a meter sample: its envelope ts when plausible, else ingest_ts."""
+    ts = envelope_ts(message)
+    if ts is None or ts > ingest_ts + MAX_CLOCK_SKEW_S:
+        return ingest_ts
+    return ts
+
+
+def level_for(step: int) -> int:
+    """Index in LEVELS of the coarsest level whose width divides step."""
+    for i in range(len(LEVELS) - 1, -1, -1):
+        if step % LEVELS[i][1] == 0:
+            return i
+    raise ValueError(f"step must be a positive multiple of {LEVELS[0][1]} s")
+
+
+class RollupLevel:
+    """Sparse, sorted buckets of one resolution."""
+
+    __slots__ = ("width", "retention", "_buckets", "_sums", "_counts")
+
+    def __init__(self, width: int, retention: int) -> None:
+        self.width = width
+        self.retention = retention
+        self._buckets = array("q")
+        self._sums = array("d")
+        self._counts = array("I")
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def add(self, ts: float, value: float) -> None:
+        b = int(ts // self.width)
+        buckets = self._buckets
+        n = len(buckets)
+        if n and buckets[-1] == b:
+            self._sums[-1] += value
+            self._counts[-1] += 1
+            return
+        if not n or buckets[-1] < b:
+            buckets.append(b)
+            self._sums.append(value)
+            self._counts.append(1)
+            if b - buckets[0] >= self.retention + _TRIM_SLACK:
+                cut = bisect_left(buckets, b - self.retention + 1)
+                del buckets[:cut], self._sums[:cut], self._counts[:cut]
+            return
+        # late sample (clock step back, replayed capture): rare, O(n) insert
+        if b <= buckets[-1] - self.retention:
+            return
+        i = bisect_left(buckets, b)
+        if buckets[i] == b:
+            self._sums[i] += value
+            self._counts[i] += 1
+        else:
+            buckets.insert(i, b)
+            self._sums.insert(i, value)
+            self._counts.insert(i, 1)
+
+    def oldest(self) -> Optional[float]:
+        """Start of the oldest bucket within the retention (None when empty)."""
+        if not self._buckets:
+            return None
+        return max(self._buckets[0], self._buckets[-1] - self.retention + 1) * float(self.width)
+
+    def grouped(self, g0: int, g1: int, per: int) -> Tuple[List[float], List[int]]:
+        """Sums and counts of groups g0..g1-1 of `per` consecutive buckets (bisect + one pass)."""
+        sums = [0.0] * (g1 - g0)
+        counts = [0] * (g1 - g0)
+        buckets = self._buckets
+        i, j = bisect_left(buckets, g0 * per), bisect_left(buckets, g1 * per)
+        for k in range(i, j):
+            g = buckets[k] // per - g0
+            sums[g] += self._sums[k]
+            counts[g] += self._counts[k]
+        return sums, counts
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self._buckets, self._sums, self._counts))
+
+    def dump(self) -> List[str]:
+        """The three arrays as base64 (native byte order)."""
+        return [base64.b64encode(a.tobytes()).decode("ascii") for a in (self._buckets, self._sums, self._counts)]
+
+    def load(self, dumped: List[str]) -> None:
+        arrays = [array(a.typecode) for a in (self._buckets, self._sums, self._counts)]
+        for a, data in zip(arrays, dumped):
+            a.frombytes(base64.b64decode(data))
+        if len({len(a) for a in arrays}) != 1:
+            raise ValueError("rollup arrays differ in length")
+        self._buckets, self._sums, self._counts = arrays
+
+
+class ConsumptionRollup:
+    """All levels of one meter."""
+
+    __slots__ = ("levels",)
+
+    def __init__(self) -> None:
+        self.levels = [RollupLevel(width, retention) for _, width, retention in LEVELS]
+
+    def add(self, ts: float, delta: float) -> None:
+        for level in self.levels:
+            level.add(ts, delta)
+
+    def query(self, start: float, end: float, step: int) -> Dict[str, Any]:
+        """Consumption per step-aligned bucket covering [start, end), from one level."""
+        idx = level_for(step)
+        level = self.levels[idx]
+        g0, g1 = math.floor(start / step), max(math.ceil(end / step), math.floor(start / step) + 1)
+        sums, counts = level.grouped(g0, g1, step // level.width)
+        return {
+            "level": LEVELS[idx][0],
+            "step": step,
+            "from": g0 * step,
+            "to": g1 * step,
+            "retained_from": level.oldest(),
+            "total": round(math.fsum(sums), 6),
+            "buckets": [
+                {"ts": (g0 + i) * step, "consumption": round(s, 6), "samples": c}
+                for i, (s, c) in enumerate(zip(sums, counts))
+            ],
+        }
+
+    def nbytes(self) -> int:
+        return sum(level.nbytes() for level in self.levels)
+
+    def dump(self) -> Dict[str, List[str]]:
+        return {name: level.dump() for (name, _, _), level in zip(LEVELS, self.levels)}
+
+    def load(self, dumped: Dict[str, List[str]]) -> None:
+        """Levels missing from `dumped` stay empty (e.g. a level added since the checkpoint)."""
+        for (name, _, _), level in zip(LEVELS, self.levels):
+            if name in dumped:
+                level.load(dumped[name])
+
+
+class ConsumptionRollups:
+    """Rollups of all meters of one home. Not thread-safe: StateStore calls it under its lock."""
+
+    def __init__(self) -> None:
+        self._meters: Dict[DeviceId, ConsumptionRollup] = {}
+
+    def __len__(self) -> int:
+        return len(self._meters)
+
+    def observe(self, device_id: DeviceId, ts: float, delta: Any) -> bool:
+        """Add one delta; False (nothing recorded) unless it is a finite number."""
+        if isinstance(delta, bool) or not isinstance(delta, (int, float)) or not math.isfinite(delta):
+            return False
+        r = self._meters.get(device_id)
+        if r is None:
+            r = self._meters[device_id] = ConsumptionRollup()
+        r.add(ts, float(delta))
+        return True
+
+    def forget(self, device_id: DeviceId) -> None:
+        self._meters.pop(device_id, None)
+
+    def query(self, device_id: DeviceId, start: float, end: float, step: int) -> Optional[Dict[str, Any]]:
+        r = self._meters.get(device_id)
+        return r.query(start, end, step) if r is not None else None
+
+    def nbytes(self) -> int:
+        return sum(r.nbytes() for r in self._meters.values())
+
+    def dump(self) -> Dict[DeviceId, Dict[str, List[str]]]:
+        return {device_id: r.dump() for device_id, r in self._meters.items()}
+
+    def load(self, dumped: Dict[DeviceId, Dict[str, List[str]]]) -> None:
+        """Replace all rollups with a dump(); ValueError on corrupt data."""
+        meters: Dict[DeviceId, ConsumptionRollup] = {}
+        for device_id, levels in dumped.items():
+            r = meters[device_id] = ConsumptionRollup()
+            try:
+                r.load(levels)
+            except (ValueError, TypeError) as e:  # binascii.Error is a ValueError
+                raise ValueError(f"{device_id}: {e}") from None
+        self._meters = meters
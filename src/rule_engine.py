@@ -0,0 +1,315 @@
+"""
+Declarative site-specific rules, compiled once into closures.
+
+Rule spec (JSON/YAML):
+
+    {
+      "name": "freeze_protection",
+      "when": {"all": [
+        {"device_type": "environment", "field": "temperature", "op": "<=", "value": 3.0},
+        {"config": "armed", "op": "==", "value": false}
+      ]},
+      "edge": true,                 # fire on False->True only (default true)
+      "cooldown_s": 60,             # default: Config.cooldown_seconds
+      "actions": [{"target_id": "water_meter", "action": "set", "params": {"supply_on": false}}]
+    }
+
+Conditions:
+  - {"all": [...]}, {"any": [...]}, {"not": cond}
+  - telemetry leaf: {"device_type", "field", "op", "value", "agg": "any"|"all"}
+    "any": at least one device of that type satisfies it (default),
+    "all": every device of that type reporting the field satisfies it
+    optional "stat": compare a windowed aggregate of the device's recent
+    samples instead of the last value (count|last|mean|min|max|ewma|rate,
+    see StateStore.series_stat); bool fields also have "<field>:rises",
+    e.g. {"field": "open:rises", "stat": "count", "op": ">=", "value": 3}
+  - config leaf: {"config": <Config field>, "op", "value"}
+
+Identical sub-expressions (by canonical JSON) are compiled once and shared
+by every rule using them. Telemetry leaves keep the set of satisfying
+devices up to date on each message, so a leaf is O(1) to read and a
+message only touches the leaves/rules that depend on its device type.
+"""
+
+from __future__ import annotations
+
+import json
+import operator
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .models import Command, DeviceId
+from .series import STATS
+from .state import Config, StateStore
+
+
+OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+RESERVED_NAMES = ("intrusion", "fire", "gas", "meter_anomaly")  # builtin rules in rules.py
+
+
+class _Leaf:
+    """Telemetry leaf: tracks which devices of device_type currently satisfy field <op> value."""
+
+    def __init__(self, device_type: str, field: str, op: str, value: Any, agg: str, stat: Optional[str] = None) -> None:
+        self.device_type = device_type
+        self.field = field
+        self.data_field = field.split(":", 1)[0]  # "open:rises" is fed by "open"
+        self.test = OPS[op]
+        self.value = value
+        self.agg = agg
+        self.stat = stat
+        self.matching: Set[DeviceId] = set()
+        self.reporting: Set[DeviceId] = set()
+        self.rules: Set[str] = set()
+
+    def update(self, device_id: DeviceId, data: Dict[str, Any], store: Optional[StateStore] = None) -> None:
+        if self.stat is None:
+            v = data.get(self.field)
+        elif store is not None:
+            v = store.series_stat(device_id, self.field, self.stat)
+        else:
+            v = None
+        if v is None:
+            return
+        self.reporting.add(device_id)
+        try:
+            ok = bool(self.test(v, self.value))
+        except TypeError:
+            ok = False
+        if ok:
+            self.matching.add(device_id)
+        else:
+            self.matching.discard(device_id)
+
+    def __call__(self, _cfg: Config) -> bool:
+        if self.agg == "all":
+            return bool(self.reporting) and len(self.matching) == len(self.reporting)
+        return bool(self.matching)
+
+
+@dataclass
+class CompiledRule:
+    name: str
+    predicate: Callable[[Config], bool]
+    edge: bool
+    cooldown_s: Optional[float]
+    actions: List[Command]
+    device_types: Set[str]
+    config_fields: Set[str]
+
+
+class RuleEngine:
+    """Compiled rule set of one home. Not thread-safe: callers hold the home lock."""
+
+    def __init__(self, specs: List[Dict[str, Any]]) -> None:
+        self.specs = specs
+        self._nodes: Dict[str, Callable[[Config], bool]] = {}
+        self._leaves: Dict[str, _Leaf] = {}
+        self._leaves_by_type: Dict[str, List[_Leaf]] = {}
+        self._rules_by_config: Dict[str, Set[str]] = {}
+        self.rules: Dict[str, CompiledRule] = {}
+
+        for spec in specs:
+            rule = self._compile_rule(spec)
+            self.rules[rule.name] = rule
+            for f in rule.config_fields:
+                self._rules_by_config.setdefault(f, set()).add(rule.name)
+
+    # -----------------------------
+    # Compilation
+    # -----------------------------
+    def _compile_rule(self, spec: Dict[str, Any]) -> CompiledRule:
+        if not isinstance(spec, dict):
+            raise ValueError("rule must be an object")
+        name = spec.get("name")
+        if not isinstance(name, str) or not name:
+            raise ValueError("rule.name is required")
+        if name in RESERVED_NAMES or name in self.rules:
+            raise ValueError(f"duplicate or reserved rule name: {name}")
+        if "when" not in spec:
+            raise ValueError(f"{name}: 'when' is required")
+
+        device_types: Set[str] = set()
+        config_fields: Set[str] = set()
+        predicate = self._compile(spec["when"], name, device_types, config_fields)
+
+        actions = []
+        for a in spec.get("actions", []):
+            if not isinstance(a, dict) or not a.get("target_id"):
+                raise ValueError(f"{name}: every action needs a target_id")
+            actions.append(Command(target_id=a["target_id"], action=a.get("action", "set"), params=dict(a.get("params", {}))))
+
+        cooldown = spec.get("cooldown_s")
+        if cooldown is not None and (
+            isinstance(cooldown, bool) or not isinstance(cooldown, (int, float)) or not cooldown >= 0
+        ):
+            raise ValueError(f"{name}: cooldown_s must be a non-negative number")
+        edge = spec.get("edge", True)
+        if not isinstance(edge, bool):
+            raise ValueError(f"{name}: edge must be true or false")
+        return CompiledRule(
+            name=name,
+            predicate=predicate,
+            edge=edge,
+            cooldown_s=float(cooldown) if cooldown is not None else None,
+            actions=actions,
+            device_types=device_types,
+            config_fields=config_fields,
+        )
+
+    def _compile(self, node: Any, rule: str, types: Set[str], fields: Set[str]) -> Callable[[Config], bool]:
+        if not isinstance(node, dict):
+            raise ValueError(f"{rule}: condition must be an object")
+        key = json.dumps(node, sort_keys=True)
+
+        if "device_type" in node:
+            leaf = self._leaves.get(key)
+            if leaf is None:
+                op = node.get("op", "==")
+                if op not in OPS or "field" not in node or "value" not in node:
+                    raise ValueError(f"{rule}: telemetry condition needs field, op in {sorted(OPS)}, value")
+                agg = node.get("agg", "any")
+                if agg not in ("any", "all"):
+                    raise ValueError(f"{rule}: agg must be 'any' or 'all'")
+                stat = node.get("stat")
+                if stat is not None and stat not in STATS:
+                    raise ValueError(f"{rule}: stat must be one of {list(STATS)}")
+                leaf = _Leaf(node["device_type"], node["field"], op, node["value"], agg, stat)
+                self._leaves[key] = leaf
+                self._leaves_by_type.setdefault(leaf.device_type, []).append(leaf)
+                self._nodes[key] = leaf
+            leaf.rules.add(rule)
+            types.add(leaf.device_type)
+            return leaf
+
+        if "config" in node:
+            cfg_field, op = node["config"], node.get("op", "==")
+            if cfg_field not in Config.__dataclass_fields__ or op not in OPS:
+                raise ValueError(f"{rule}: unknown config field or op: {cfg_field} {op}")
+            fields.add(cfg_field)
+            fn = self._nodes.get(key)
+            if fn is None:
+                test, value = OPS[op], node.get("value", True)
+                fn = lambda cfg, f=cfg_field: bool(test(getattr(cfg, f), value))  # noqa: E731
+                self._nodes[key] = fn
+            return fn
+
+        if "not" in node:
+            inner = self._compile(node["not"], rule, types, fields)
+            fn = self._nodes.setdefault(key, lambda cfg: not inner(cfg))
+            return fn
+
+        for kind, combine in (("all", all), ("any", any)):
+            if kind in node:
+                children = node[kind]
+                if not isinstance(children, list) or not children:
+                    raise ValueError(f"{rule}: '{kind}' needs a non-empty list")
+                parts = tuple(self._compile(c, rule, types, fields) for c in children)
+                fn = self._nodes.setdefault(key, lambda cfg, p=parts, c=combine: c(f(cfg) for f in p))
+                return fn
+
+        raise ValueError(f"{rule}: unknown condition {node}")
+
+    @property
+    def uses_series(self) -> bool:
+        """True if any leaf reads windowed aggregates (StateStore series)."""
+        return any(leaf.stat is not None for leaf in self._leaves.values())
+
+    @property
+    def series_fields(self) -> Dict[str, Set[str]]:
+        """device_type -> series names read by "stat" leaves (see StateStore.set_series_fields)."""
+        out: Dict[str, Set[str]] = {}
+        for leaf in self._leaves.values():
+            if leaf.stat is not None:
+                out.setdefault(leaf.device_type, set()).add(leaf.field)
+        return out
+
+    # -----------------------------
+    # Runtime
+    # -----------------------------
+    def seed(self, store: StateStore) -> None:
+        """Build leaf state from the telemetry already in the store (once, on load)."""
+        for device_id, msg in store.snapshot().telemetry.items():
+            self.on_telemetry(device_id, msg.get("device_type"), msg.get("data"), store)
+
+    def on_telemetry(
+        self,
+        device_id: DeviceId,
+        device_type: Optional[str],
+        data: Any,
+        store: Optional[StateStore] = None,
+    ) -> Set[str]:
+        """
+        Update leaves for this message; return names of rules that read it.
+        `store` (already updated with this message) feeds "stat" leaves.
+        """
+        leaves = self._leaves_by_type.get(device_type or "")
+        if not leaves or not isinstance(data, dict):
+            return set()
+        touched: Set[str] = set()
+        for leaf in leaves:
+            if leaf.data_field in data:
+                leaf.update(device_id, data, store)
+                touched |= leaf.rules
+        return touched
+
+    def rules_for_config(self, changed_fields: Set[str]) -> Set[str]:
+        out: Set[str] = set()
+        for f in changed_fields:
+            out |= self._rules_by_config.get(f, set())
+        return out
+
+    def evaluate(
+        self,
+        names: Set[str],
+        store: StateStore,
+        cfg: Config,
+        now_s: float,
+    ) -> Tuple[List[Command], List[Dict[str, Any]]]:
+        """Evaluate only the named rules (edge detection + cooldown as in rules.evaluate_rules)."""
+        commands: List[Command] = []
+        events: List[Dict[str, Any]] = []
+        if not names:
+            return commands, events
+
+        active = store.rule_flags(names)
+        flags: Dict[str, bool] = {}
+        for name in sorted(names):
+            rule = self.rules.get(name)
+            if rule is None:
+                continue
+            cond = rule.predicate(cfg)
+            prev = active.get(name, False)
+            cooldown = cfg.cooldown_seconds if rule.cooldown_s is None else rule.cooldown_s
+            if cond and (not rule.edge or not prev) and store.can_trigger(name, now_s, cooldown):
+                commands += rule.actions
+                events.append({"rule": name, "ts_unix": now_s, "actions": [c.__dict__ for c in rule.actions]})
+                store.mark_trigger(name, now_s)
+            flags[name] = bool(cond)
+
+        store.set_rule_flags(flags)
+        return commands, events
+
+
+def load_rule_specs(path: str) -> List[Dict[str, Any]]:
+    """Read rule specs from a .json or .yaml/.yml file (a list, or {"rules": [...]})."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml  # optional dependency, only needed for YAML rule files
+
+            doc = yaml.safe_load(f)
+        else:
+            doc = json.load(f)
+    if isinstance(doc, dict):
+        doc = doc.get("rules", [])
+    if not isinstance(doc, list):
+        raise ValueError("rules file must contain a list of rules")
+    return doc
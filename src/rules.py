@@ -1,58 +1,140 @@
 from __future__ import annotations
 
-import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
-from .models import Command
-from .state import Config, StateStore
+from . import metrics
+from .models import Command, DeviceId
+from .state import METER_TYPES, Config, HomeShard, StateStore
 
 
-def _find_any_open_door_or_window(state: Dict[str, Any]) -> bool:
+def _find_any_open_door_or_window(store: StateStore) -> bool:
     """
     Door/Window sensor: open/closed detection
     Assumed telemetry data includes: data.open -> bool
     """
-    for msg in state["telemetry"].values():
-        dtype = msg.get("device_type")
-        if dtype == "door_window":
-            data = msg.get("data", {})
-            if bool(data.get("open")):
-                return True
-    return False
+    return store.open_contact_count() > 0
 
 
-def _read_environment(state: Dict[str, Any]) -> Tuple[float | None, float | None]:
+def _read_environment(store: StateStore) -> Tuple[float | None, float | None]:
     """
     Environmental Monitoring provides temperature and PM10.
     """
-    for msg in state["telemetry"].values():
-        if msg.get("device_type") == "environment":
-            d = msg.get("data", {})
-            return d.get("temperature"), d.get("pm10")
-    return None, None
+    d = store.environment_reading()
+    if d is None:
+        return None, None
+    return d.get("temperature"), d.get("pm10")
 
 
-def _read_gas_delta(state: Dict[str, Any]) -> float | None:
+# -----------------------------
+# Rule dependencies
+# -----------------------------
+RULE_NAMES: Tuple[str, ...] = ("intrusion", "fire", "gas", "meter_anomaly")
+
+# device_type -> telemetry data fields each rule reads
+RULE_TELEMETRY_DEPS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "intrusion": {"door_window": ("open",)},
+    "fire": {"environment": ("temperature", "pm10")},
+    "gas": {"gas_meter": ("delta",)},
+    "meter_anomaly": {t: ("delta",) for t in METER_TYPES},
+}
+
+# Config fields each rule reads (detector settings apply at ingest, see HomeShard.configure_meters)
+RULE_CONFIG_DEPS: Dict[str, Tuple[str, ...]] = {
+    "intrusion": ("armed", "rule_intrusion_enabled", "cooldown_seconds"),
+    "fire": ("temp_threshold", "pm10_threshold", "rule_fire_enabled", "cooldown_seconds"),
+    "gas": ("gas_spike_ratio", "gas_min_delta", "rule_gas_enabled", "cooldown_seconds"),
+    "meter_anomaly": ("meter_detectors", "rule_meter_anomaly_enabled", "cooldown_seconds"),
+}
+
+# Commands issued when a rule fires, and the name it is logged under. The meter
+# rules also shut off the supply of the flagged meters (see rule_commands).
+RULE_ACTIONS: Dict[str, Tuple[Tuple[str, Dict[str, Any]], ...]] = {
+    "intrusion": (("alarm_controller", {"on": True}), ("mobile_light", {"on": True, "level": "HIGH"})),
+    "fire": (("alarm_controller", {"on": True}), ("sprinkler", {"on": True})),
+    "gas": (("alarm_controller", {"on": True}),),
+    "meter_anomaly": (),
+}
+RULE_EVENT_NAMES: Dict[str, str] = {
+    "intrusion": "intrusion",
+    "fire": "fire",
+    "gas": "gas_spike",
+    "meter_anomaly": "meter_anomaly",
+}
+
+_SIREN_ON = ("alarm_controller", {"on": True})
+
+
+def rule_commands(rule: str, meters: Optional[Dict[DeviceId, Dict[str, Any]]] = None) -> List[Command]:
     """
-    Gas Metering includes gas consumption sensor.
-    Used a simple 'delta' field sent by the meter emulator.
+    Commands of a fired rule. meters: the flagged meters of "gas" (each gets
+    supply_on=False) or "meter_anomaly" (siren and shut-off as configured per
+    meter type).
     """
-    for msg in state["telemetry"].values():
-        if msg.get("device_type") == "gas_meter":
-            d = msg.get("data", {})
-            return d.get("delta")
-    return None
+    actions = list(RULE_ACTIONS[rule])
+    if meters:
+        if rule == "meter_anomaly" and any(m["alarm"] for m in meters.values()):
+            actions.append(_SIREN_ON)
+        for device_id, m in meters.items():
+            if rule == "gas" or m["shutoff"]:
+                actions.append((device_id, {"supply_on": False}))
+    return [Command(target_id=t, action="set", params=dict(p)) for t, p in actions]
+
+
+def rule_event(
+    rule: str,
+    now_s: float,
+    commands: List[Command],
+    meters: Optional[Dict[DeviceId, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    event = {"rule": RULE_EVENT_NAMES[rule], "ts_unix": now_s, "actions": [c.__dict__ for c in commands]}
+    if meters is not None:
+        event["meters"] = meters
+    return event
+
+
+# Inverted index: device_type -> [(rule, fields)]
+_DEPS_BY_TYPE: Dict[str, List[Tuple[str, FrozenSet[str]]]] = {}
+for _rule, _deps in RULE_TELEMETRY_DEPS.items():
+    for _dtype, _fields in _deps.items():
+        _DEPS_BY_TYPE.setdefault(_dtype, []).append((_rule, frozenset(_fields)))
+
 
+def rules_for_telemetry(device_type: Optional[str], data: Any) -> Set[str]:
+    """Rules whose outcome can change after this telemetry message."""
+    deps = _DEPS_BY_TYPE.get(device_type or "")
+    if not deps or not isinstance(data, dict):
+        return set()
+    return {rule for rule, fields in deps if not fields.isdisjoint(data)}
 
-def evaluate_rules(store: StateStore, cfg: Config) -> Tuple[List[Command], List[Dict[str, Any]]]:
+
+def rules_for_config(fields: Iterable[str]) -> Set[str]:
+    """Rules whose outcome can change after these config fields changed."""
+    changed = set(fields)
+    return {rule for rule, deps in RULE_CONFIG_DEPS.items() if not changed.isdisjoint(deps)}
+
+
+def evaluate_rules(
+    store: StateStore,
+    cfg: Config,
+    rules: Optional[Iterable[str]] = None,
+    now_s: Optional[float] = None,
+) -> Tuple[List[Command], List[Dict[str, Any]]]:
     """
-    Evaluate 3 rules described in the proposal:
+    Evaluate 3 rules described in the proposal, plus meter anomalies:
     - Intrusion (armed + door/window opens) -> siren ON + lights ON
     - Fire (temp & PM10 exceed) -> siren ON + sprinkler ON
-    - Gas spike -> siren ON + gas supply OFF
+    - Gas spike (a gas meter's delta vs. its own previous one) -> siren ON + its supply OFF
+    - Meter anomaly (z-score/CUSUM per meter) -> supply OFF / siren per meter type
+
+    rules: subset of RULE_NAMES to evaluate (default: all). Rules not listed
+    keep their edge-detection flag untouched.
+    now_s: evaluation time (default: the store's clock).
     """
-    snap = store.snapshot()
-    now_s = time.time()
+    selected = set(RULE_NAMES) if rules is None else set(rules)
+    rule_active = store.rule_flags(RULE_NAMES)
+    prev_flags = dict(rule_active)
+    if now_s is None:
+        now_s = store.now()
 
     commands: List[Command] = []
     events: List[Dict[str, Any]] = []
@@ -60,71 +142,163 @@ def evaluate_rules(store: StateStore, cfg: Config) -> Tuple[List[Command], List[
     # -------------------------
     # Rule 1: Intrusion
     # -------------------------
-    intrusion_cond = cfg.rule_intrusion_enabled and cfg.armed and _find_any_open_door_or_window(snap)
-    prev_intrusion = snap["rule_active"].get("intrusion", False)
+    if "intrusion" in selected:
+        intrusion_cond = cfg.rule_intrusion_enabled and cfg.armed and _find_any_open_door_or_window(store)
+        prev_intrusion = rule_active.get("intrusion", False)
+
+        if intrusion_cond and not prev_intrusion and store.can_trigger("intrusion", now_s, cfg.cooldown_seconds):
+            fired = rule_commands("intrusion")
+            commands += fired
+            events.append(rule_event("intrusion", now_s, fired))
+            store.mark_trigger("intrusion", now_s)
 
-    if intrusion_cond and not prev_intrusion and store.can_trigger("intrusion", now_s, cfg.cooldown_seconds):
-        commands += [
-            Command(target_id="alarm_controller", action="set", params={"on": True}),
-            Command(target_id="mobile_light", action="set", params={"on": True, "level": "HIGH"}),
-        ]
-        events.append({"rule": "intrusion", "ts_unix": now_s, "actions": [c.__dict__ for c in commands[-2:]]})
-        store.mark_trigger("intrusion", now_s)
+        rule_active["intrusion"] = bool(intrusion_cond)
 
     # -------------------------
     # Rule 2: Fire
     # -------------------------
-    temp, pm10 = _read_environment(snap)
-    fire_cond = (
-        cfg.rule_fire_enabled
-        and temp is not None and pm10 is not None
-        and float(temp) >= cfg.temp_threshold
-        and float(pm10) >= cfg.pm10_threshold
-    )
-    prev_fire = snap["rule_active"].get("fire", False)
-
-    if fire_cond and not prev_fire and store.can_trigger("fire", now_s, cfg.cooldown_seconds):
-        commands += [
-            Command(target_id="alarm_controller", action="set", params={"on": True}),
-            Command(target_id="sprinkler", action="set", params={"on": True}),
-        ]
-        events.append({"rule": "fire", "ts_unix": now_s, "actions": [c.__dict__ for c in commands[-2:]]})
-        store.mark_trigger("fire", now_s)
+    if "fire" in selected:
+        temp, pm10 = _read_environment(store)
+        fire_cond = (
+            cfg.rule_fire_enabled
+            and temp is not None and pm10 is not None
+            and float(temp) >= cfg.temp_threshold
+            and float(pm10) >= cfg.pm10_threshold
+        )
+        prev_fire = rule_active.get("fire", False)
+
+        if fire_cond and not prev_fire and store.can_trigger("fire", now_s, cfg.cooldown_seconds):
+            fired = rule_commands("fire")
+            commands += fired
+            events.append(rule_event("fire", now_s, fired))
+            store.mark_trigger("fire", now_s)
+
+        rule_active["fire"] = bool(fire_cond)
 
     # -------------------------
     # Rule 3: Gas spike suspicion
     # -------------------------
-    gas_delta = _read_gas_delta(snap)
-    prev_delta = store.get_last_gas_delta()
-
-    gas_cond = False
-    if cfg.rule_gas_enabled and gas_delta is not None and float(gas_delta) >= cfg.gas_min_delta:
-        if prev_delta is not None and prev_delta > 0:
-            ratio = float(gas_delta) / float(prev_delta)
-            gas_cond = ratio >= cfg.gas_spike_ratio
-
-    prev_gas = snap["rule_active"].get("gas", False)
-
-    if gas_cond and not prev_gas and store.can_trigger("gas", now_s, cfg.cooldown_seconds):
-        commands += [
-            Command(target_id="alarm_controller", action="set", params={"on": True}),
-            Command(target_id="gas_meter", action="set", params={"supply_on": False}),
-        ]
-        events.append({"rule": "gas_spike", "ts_unix": now_s, "actions": [c.__dict__ for c in commands[-2:]]})
-        store.mark_trigger("gas", now_s)
-
-    
-    # Update edge-detection flags and gas baseline
-    snap2 = store.snapshot()
-    snap2["rule_active"]["intrusion"] = bool(intrusion_cond)
-    snap2["rule_active"]["fire"] = bool(fire_cond)
-    snap2["rule_active"]["gas"] = bool(gas_cond)
-
-    # Persist rule active flags into the store:
-    # Reuse update_state on a pseudo-device "manager_rules" to keep everything uniform.
-    store.update_state("manager_rules", {"rule_active": snap2["rule_active"]})
-
-    if gas_delta is not None:
-        store.set_last_gas_delta(float(gas_delta))
+    if "gas" in selected:
+        # spikes are detected per meter at ingest (anomaly.MeterDetector); only spiking meters are read
+        spiking = store.spiking_meters("gas_meter") if cfg.rule_gas_enabled else {}
+        gas_cond = bool(spiking)
+        prev_gas = rule_active.get("gas", False)
+
+        if gas_cond and not prev_gas and store.can_trigger("gas", now_s, cfg.cooldown_seconds):
+            fired = rule_commands("gas", spiking)
+            commands += fired
+            events.append(rule_event("gas", now_s, fired, spiking))
+            store.mark_trigger("gas", now_s)
 
+        rule_active["gas"] = gas_cond
+
+    # -------------------------
+    # Rule 4: Meter anomaly (gas/water/electricity)
+    # -------------------------
+    if "meter_anomaly" in selected:
+        anomalous = store.anomalous_meters() if cfg.rule_meter_anomaly_enabled else {}
+        anomaly_cond = bool(anomalous)
+        prev_anomaly = rule_active.get("meter_anomaly", False)
+
+        if anomaly_cond and not prev_anomaly and store.can_trigger("meter_anomaly", now_s, cfg.cooldown_seconds):
+            fired = rule_commands("meter_anomaly", anomalous)
+            commands += fired
+            events.append(rule_event("meter_anomaly", now_s, fired, anomalous))
+            store.mark_trigger("meter_anomaly", now_s)
+
+        rule_active["meter_anomaly"] = anomaly_cond
+
+    # Persist edge-detection flags so the next (possibly partial) evaluation sees them.
+    # Also mirrored on a pseudo-device "manager_rules" to keep /status uniform
+    # (only rewritten when a flag changed, so unchanged evaluations keep the store version).
+    store.set_rule_flags(rule_active)
+    if rule_active != prev_flags or "manager_rules" not in store.last_state:
+        store.update_state("manager_rules", {"rule_active": rule_active})
+
+    return commands, events
+
+
+# -----------------------------
+# One message of one home
+# -----------------------------
+_STORE_TELEMETRY_SECONDS = metrics.STORE_UPDATE_SECONDS.labels("telemetry")
+_STORE_STATE_SECONDS = metrics.STORE_UPDATE_SECONDS.labels("state")
+_EVAL_BUILTIN_SECONDS = metrics.EVALUATE_SECONDS.labels("builtin")
+_EVAL_CUSTOM_SECONDS = metrics.EVALUATE_SECONDS.labels("custom")
+
+
+def rules_for_home_config(shard: HomeShard, changed_fields: Iterable[str]) -> Set[str]:
+    """Builtin and custom rules of a home reading these config fields."""
+    changed = set(changed_fields)
+    rules = rules_for_config(changed)
+    if shard.engine is not None:
+        rules |= shard.engine.rules_for_config(changed)
+    return rules
+
+
+def process_message(
+    shard: HomeShard,
+    channel: str,
+    data: Dict[str, Any],
+    now_s: Optional[float] = None,
+    deferred: Optional[Set[str]] = None,
+) -> Tuple[List[Command], List[Dict[str, Any]]]:
+    """
+    Store update + evaluation of the rules affected by one decoded
+    telemetry/state message of a home. Caller holds shard.lock.
+    Only rules that read this device type/fields (or config changed since
+    the last message) are re-evaluated.
+    deferred: if given, affected builtin rules are added to it instead of
+    evaluated (batch mode, see batch.BatchRuleScheduler); custom rules are
+    still evaluated here.
+    """
+    device_id = data.get("device_id")
+    if not device_id:
+        return [], []
+    now = shard.store.now() if now_s is None else now_s
+
+    affected: Set[str] = set()
+    if channel == "telemetry":
+        t0 = metrics.clock()
+        shard.store.update_telemetry(device_id, data, now)
+        _STORE_TELEMETRY_SECONDS.observe_since(t0)
+        affected = rules_for_telemetry(data.get("device_type"), data.get("data"))
+        if shard.engine is not None:
+            affected |= shard.engine.on_telemetry(device_id, data.get("device_type"), data.get("data"), shard.store)
+    elif channel == "state":
+        t0 = metrics.clock()
+        shard.store.update_state(device_id, data, now)
+        _STORE_STATE_SECONDS.observe_since(t0)
+
+    # Allow Alarm Switch device to arm/disarm by publishing state/telemetry
+    if data.get("device_type") == "alarm_switch":
+        d = data.get("data", {})
+        if isinstance(d, dict) and "armed" in d and bool(d["armed"]) != shard.cfg.armed:
+            shard.cfg.armed = bool(d["armed"])
+            shard.store.touch("config")
+            affected |= rules_for_home_config(shard, {"armed"})
+
+    if shard.pending_rules:
+        affected |= shard.pending_rules
+        shard.pending_rules = set()
+    if not affected:
+        return [], []
+
+    builtin = affected.intersection(RULE_NAMES)
+    custom = affected - builtin
+    if deferred is not None:
+        deferred |= builtin
+        builtin = set()
+    commands: List[Command] = []
+    events: List[Dict[str, Any]] = []
+    if builtin:
+        t0 = metrics.clock()
+        commands, events = evaluate_rules(shard.store, shard.cfg, builtin, now)
+        _EVAL_BUILTIN_SECONDS.observe_since(t0)
+    if shard.engine is not None and custom:
+        t0 = metrics.clock()
+        c2, e2 = shard.engine.evaluate(custom, shard.store, shard.cfg, now)
+        _EVAL_CUSTOM_SECONDS.observe_since(t0)
+        commands += c2
+        events += e2
     return commands, events
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+STATS = ("count", "last", "mean", "min", "max", "ewma", "rate")
+
+
+class RingSeries:
+    """
+    Fixed-capacity ring buffer of (ts, value) samples covering at most the
+    last `window_s` seconds. Aggregates over the window are maintained on
+    insert/evict:
+      - sum (-> mean) in O(1)
+      - min/max with monotonic deques, amortized O(1)
+      - EWMA over every sample seen (not windowed)
+    Memory is bounded by `capacity` regardless of the message rate.
+    """
+
+    __slots__ = ("capacity", "window_s", "alpha", "_ts", "_vals", "_head", "_count", "_seq",
+                 "_sum", "_ewma", "_minq", "_maxq")
+
+    def __init__(self, capacity: int = 256, window_s: float = 60.0, alpha: float = 0.2) -> None:
+        self.capacity = max(1, capacity)
+        self.window_s = window_s
+        self.alpha = alpha
+        self._ts = array("d", bytes(8 * self.capacity))
+        self._vals = array("d", bytes(8 * self.capacity))
+        self._head = 0  # next write slot
+        self._count = 0
+        self._seq = 0  # samples ever pushed; sample i lives in slot i % capacity
+        self._sum = 0.0
+        self._ewma: Optional[float] = None
+        self._minq: Deque[Tuple[int, float]] = deque()
+        self._maxq: Deque[Tuple[int, float]] = deque()
+
+    def _evict_oldest(self) -> None:
+        oldest = self._seq - self._count
+        slot = oldest % self.capacity
+        self._sum -= self._vals[slot]
+        if self._minq and self._minq[0][0] == oldest:
+            self._minq.popleft()
+        if self._maxq and self._maxq[0][0] == oldest:
+            self._maxq.popleft()
+        self._count -= 1
+        if self._count == 0:
+            self._sum = 0.0  # drop accumulated float error
+
+    def _oldest_slot(self) -> int:
+        return (self._seq - self._count) % self.capacity
+
+    def push(self, ts: float, value: float) -> None:
+        while self._count and (
+            self._count >= self.capacity or ts - self._ts[self._oldest_slot()] > self.window_s
+        ):
+            self._evict_oldest()
+
+        slot = self._head
+        self._ts[slot] = ts
+        self._vals[slot] = value
+        self._head = (slot + 1) % self.capacity
+        self._count += 1
+        self._sum += value
+
+        while self._maxq and self._maxq[-1][1] <= value:
+            self._maxq.pop()
+        self._maxq.append((self._seq, value))
+        while self._minq and self._minq[-1][1] >= value:
+            self._minq.pop()
+        self._minq.append((self._seq, value))
+        self._seq += 1
+
+        self._ewma = value if self._ewma is None else self._ewma + self.alpha * (value - self._ewma)
+
+    def expire(self, now_s: float) -> None:
+        """Drop samples older than the window (readers call this so idle series age out)."""
+        while self._count and now_s - self._ts[self._oldest_slot()] > self.window_s:
+            self._evict_oldest()
+
+    # -----------------------------
+    # Reads (all O(1))
+    # -----------------------------
+    def __len__(self) -> int:
+        return self._count
+
+    def last(self) -> Optional[float]:
+        return self._vals[(self._head - 1) % self.capacity] if self._count else None
+
+    def mean(self) -> Optional[float]:
+        return self._sum / self._count if self._count else None
+
+    def min(self) -> Optional[float]:
+        return self._minq[0][1] if self._count else None
+
+    def max(self) -> Optional[float]:
+        return self._maxq[0][1] if self._count else None
+
+    def ewma(self) -> Optional[float]:
+        return self._ewma
+
+    def rate(self) -> Optional[float]:
+        """(last - oldest) / elapsed over the window, per second."""
+        if self._count < 2:
+            return None
+        first, last = self._oldest_slot(), (self._head - 1) % self.capacity
+        dt = self._ts[last] - self._ts[first]
+        return (self._vals[last] - self._vals[first]) / dt if dt > 0 else None
+
+    def stat(self, name: str) -> Optional[float]:
+        if name == "count":
+            return float(self._count)
+        return getattr(self, name)() if name in STATS else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_s": self.window_s,
+            "capacity": self.capacity,
+            "count": self._count,
+            "last": self.last(),
+            "mean": self.mean(),
+            "min": self.min(),
+            "max": self.max(),
+            "ewma": self.ewma(),
+            "rate": self.rate(),
+        }
+
+    def points(self) -> List[Tuple[float, float]]:
+        """Samples in the window, oldest first (O(window), for REST)."""
+        start = self._oldest_slot()
+        out = []
+        for i in range(self._count):
+            slot = (start + i) % self.capacity
+            out.append((self._ts[slot], self._vals[slot]))
+        return out
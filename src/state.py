@@ -1,12 +1,26 @@
 from __future__ import annotations
 
+import gzip
 import json
+import logging
 import os
+import queue
+import shutil
 import threading
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Tuple
 
-from .models import DeviceId, DeviceInfo
+from . import metrics
+from .anomaly import MeterDetectors, configs_for
+from .models import DeviceId, DeviceInfo, HomeId
+from .pmap import PMap
+from .rollup import ConsumptionRollups, sample_time
+from .series import RingSeries
+
+if TYPE_CHECKING:
+    from .rule_engine import RuleEngine
 
 
 @dataclass
@@ -33,21 +47,76 @@ class Config:
     # Cooldown to avoid command spamming in demos
     cooldown_seconds: float = 5.0
 
+    # Per-meter anomaly detection (see anomaly.py): rule toggle, and overrides of
+    # METER_DETECTORS fields per meter type, e.g. {"water_meter": {"z_threshold": 5}}
+    rule_meter_anomaly_enabled: bool = True
+    meter_detectors: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    # Site-specific declarative rules (see rule_engine.py), compiled per home
+    custom_rules: List[Dict[str, Any]] = field(default_factory=list)
+
 
 class DeviceRegistry:
-    """In-memory registry of devices (minimal CRUD)."""
+    """
+    In-memory registry of devices, indexed by device_type and kind.
+    Listing is keyset-paginated by device_id: the sorted id list of each
+    (device_type, kind) filter is built on first use and dropped on the next
+    change, so a bulk onboarding sorts once rather than once per device.
+    """
 
     def __init__(self) -> None:
-        self._lock = threading.Lock()
+        self._lock = metrics.new_lock("device_registry")
         self._devices: Dict[DeviceId, DeviceInfo] = {}
+        self._by_type: Dict[str, Set[DeviceId]] = {}
+        self._by_kind: Dict[str, Set[DeviceId]] = {}
+        self._sorted: Dict[Tuple[Optional[str], Optional[str]], List[DeviceId]] = {}
+        # called with the device_id after add/remove (HomeShard records it in the store changelog)
+        self.on_change: Optional[Callable[[DeviceId], None]] = None
+
+    def _index(self, info: DeviceInfo) -> None:
+        prev = self._devices.get(info.device_id)
+        if prev is not None:
+            self._unindex(prev)
+        self._devices[info.device_id] = info
+        self._by_type.setdefault(info.device_type, set()).add(info.device_id)
+        self._by_kind.setdefault(info.kind, set()).add(info.device_id)
+
+    def _unindex(self, info: DeviceInfo) -> None:
+        for index, key in ((self._by_type, info.device_type), (self._by_kind, info.kind)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(info.device_id)
+                if not ids:
+                    del index[key]
 
     def add(self, info: DeviceInfo) -> None:
         with self._lock:
-            self._devices[info.device_id] = info
+            self._index(info)
+            self._sorted.clear()
+        if self.on_change is not None:
+            self.on_change(info.device_id)
+
+    def add_many(self, infos: Iterable[DeviceInfo]) -> int:
+        """Add or replace many devices under one lock acquisition; returns how many."""
+        added: List[DeviceId] = []
+        with self._lock:
+            for info in infos:
+                self._index(info)
+                added.append(info.device_id)
+            self._sorted.clear()
+        if self.on_change is not None:
+            for device_id in added:
+                self.on_change(device_id)
+        return len(added)
 
     def remove(self, device_id: DeviceId) -> None:
         with self._lock:
-            self._devices.pop(device_id, None)
+            removed = self._devices.pop(device_id, None)
+            if removed is not None:
+                self._unindex(removed)
+                self._sorted.clear()
+        if removed is not None and self.on_change is not None:
+            self.on_change(device_id)
 
     def get(self, device_id: DeviceId) -> Optional[DeviceInfo]:
         with self._lock:
@@ -57,47 +126,436 @@ class DeviceRegistry:
         with self._lock:
             return dict(self._devices)
 
+    def ids(self, device_type: Optional[str] = None, kind: Optional[str] = None) -> List[DeviceId]:
+        """Sorted device_ids matching the filters (shared: callers must not mutate it)."""
+        with self._lock:
+            return self._ids(device_type, kind)
+
+    def _ids(self, device_type: Optional[str], kind: Optional[str]) -> List[DeviceId]:
+        key = (device_type, kind)
+        ids = self._sorted.get(key)
+        if ids is None:
+            if device_type is None and kind is None:
+                ids = sorted(self._devices)
+            elif kind is None:
+                ids = sorted(self._by_type.get(device_type, ()))
+            elif device_type is None:
+                ids = sorted(self._by_kind.get(kind, ()))
+            else:
+                ids = sorted(self._by_type.get(device_type, set()) & self._by_kind.get(kind, set()))
+            self._sorted[key] = ids
+        return ids
+
+    def count(self, device_type: Optional[str] = None, kind: Optional[str] = None) -> int:
+        with self._lock:
+            if device_type is None and kind is None:
+                return len(self._devices)
+            if kind is None:
+                return len(self._by_type.get(device_type, ()))
+            if device_type is None:
+                return len(self._by_kind.get(kind, ()))
+            return len(self._ids(device_type, kind))
+
+    def page(
+        self,
+        device_type: Optional[str] = None,
+        kind: Optional[str] = None,
+        after: Optional[DeviceId] = None,
+        limit: int = 1000,
+    ) -> Tuple[List[DeviceInfo], Optional[DeviceId]]:
+        """
+        Up to `limit` devices matching the filters with device_id > after, in
+        device_id order, and the cursor for the next page (None on the last).
+        """
+        with self._lock:
+            ids = self._ids(device_type, kind)
+            start = bisect_right(ids, after) if after is not None else 0
+            chunk = ids[start:start + limit]
+            out = [self._devices[d] for d in chunk]
+            more = start + limit < len(ids)
+        return out, (chunk[-1] if more and chunk else None)
+
+    def restore(self, devices: Iterable[DeviceInfo]) -> None:
+        """Replace all entries at once (recovery); on_change is not called."""
+        with self._lock:
+            self._devices = {}
+            self._by_type = {}
+            self._by_kind = {}
+            self._sorted.clear()
+            for info in devices:
+                self._index(info)
+
+
+METER_TYPES = ("gas_meter", "electricity_meter", "water_meter")
+
+# Windowed history per (device, numeric/bool telemetry field)
+SERIES_CAPACITY = 256
+SERIES_WINDOW_S = 60.0
+MAX_SERIES_PER_DEVICE = 16
+
+# Writes remembered for StoreSnapshot.changed_since(); older `since` versions get a full view
+CHANGELOG_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class StoreSnapshot:
+    """Consistent, immutable view of a StateStore at `version` (shares structure, no copies)."""
+    version: int
+    telemetry: PMap
+    state: PMap
+    rule_active: Dict[str, bool]
+    # changes[i] is the (kind, key) written at version changes_base + i + 1
+    changes: List[Tuple[str, Optional[DeviceId]]] = field(default_factory=list, repr=False)
+    changes_base: int = 0
+
+    def changed_since(self, since: int) -> Optional[Dict[str, Set[Optional[DeviceId]]]]:
+        """
+        kind ("telemetry", "state", "devices", "config") -> keys written after
+        version `since` up to this snapshot. None if `since` is older than the
+        retained changelog or newer than the snapshot (e.g. after a restart).
+        """
+        if since < self.changes_base or since > self.version:
+            return None
+        out: Dict[str, Set[Optional[DeviceId]]] = {}
+        for kind, key in self.changes[since - self.changes_base:self.version - self.changes_base]:
+            out.setdefault(kind, set()).add(key)
+        return out
+
 
 class StateStore:
-    """Stores last telemetry and last actuator states."""
+    """
+    Stores last telemetry and last actuator states.
+    last_telemetry/last_state are immutable PMaps replaced on every write, and
+    (version, telemetry, state, changelog) is published as one tuple, so
+    snapshots and per-device reads never take the lock and never copy.
+    Registry and config changes are recorded with touch() so one version
+    covers everything /status returns.
+    """
 
-    def __init__(self) -> None:
-        self._lock = threading.Lock()
-        self.last_telemetry: Dict[DeviceId, Dict[str, Any]] = {}
-        self.last_state: Dict[DeviceId, Dict[str, Any]] = {}
+    def __init__(
+        self,
+        series_capacity: int = SERIES_CAPACITY,
+        series_window_s: float = SERIES_WINDOW_S,
+        clock: Callable[[], float] = time.time,
+        changelog_size: int = CHANGELOG_SIZE,
+    ) -> None:
+        self._lock = metrics.new_lock("state_store")
+        # wall clock by default; replay passes a virtual clock so cooldowns/windows follow the capture
+        self.now = clock
+        self.last_telemetry = PMap()
+        self.last_state = PMap()
+        # bumped on every write; _published is swapped atomically
+        self.version = 0
+        # append-only between compactions, so published snapshots can slice it without the lock
+        self.changelog_size = changelog_size
+        self._changes: List[Tuple[str, Optional[DeviceId]]] = []
+        self._changes_base = 0
+        self._published: Tuple[int, PMap, PMap, List[Tuple[str, Optional[DeviceId]]], int] = (
+            0, self.last_telemetry, self.last_state, self._changes, 0)
+
+        # sorted device ids per device_type for paged /status (see device_ids()); the
+        # key set only grows, so (len(telemetry), len(state), _types_gen) identifies it
+        self._types_gen = 0
+        self._ids_cache: Tuple[Tuple[int, int, int], Dict[Optional[str], List[DeviceId]]] = ((0, 0, 0), {})
+
+        # indexes maintained by update_telemetry so rules never scan all devices
+        self._open_contacts: Set[DeviceId] = set()
+        self._env_by_node: Dict[DeviceId, Dict[str, Any]] = {}
+        self._meter_by_type: Dict[str, Dict[DeviceId, Dict[str, Any]]] = {t: {} for t in METER_TYPES}
 
-        # helper: last gas delta for spike detection
-        self._last_gas_delta: Optional[float] = None
+        # ring buffers per device and field; bool fields also get a "<field>:rises" series
+        # with one sample per False->True transition (e.g. door openings per window).
+        # Only series someone reads are recorded: device_type -> series names wanted,
+        # per source (see set_series_fields), and their union
+        self.series_capacity = series_capacity
+        self.series_window_s = series_window_s
+        self._series: Dict[DeviceId, Dict[str, RingSeries]] = {}
+        self._series_wanted: Dict[str, Dict[str, Set[str]]] = {}
+        self._series_fields: Dict[str, FrozenSet[str]] = {}
+
+        # per-meter spike/z-score/CUSUM detectors on telemetry "delta" (gas and meter_anomaly rules)
+        self.meters = MeterDetectors()
+        # minute/hour/day sums of every meter's "delta" for consumption queries; each
+        # recorded delta gets a sequence number so recovery applies it exactly once
+        self.rollups = ConsumptionRollups()
+        self._rollup_seq = 0
 
         # helper: edge detection for rules
-        self.rule_active: Dict[str, bool] = {"intrusion": False, "fire": False, "gas": False}
-        self.last_trigger_ts: Dict[str, float] = {"intrusion": 0.0, "fire": 0.0, "gas": 0.0}
+        self.rule_active: Dict[str, bool] = {"intrusion": False, "fire": False, "gas": False, "meter_anomaly": False}
+        self.last_trigger_ts: Dict[str, float] = {"intrusion": 0.0, "fire": 0.0, "gas": 0.0, "meter_anomaly": 0.0}
+
+        # when each device last reported telemetry/state in this process (not restored
+        # on recovery): the dispatcher only trusts fresh reports as confirmed state
+        self._reported: Dict[str, Dict[DeviceId, float]] = {"telemetry": {}, "state": {}}
+
+        # journal(kind, key, value) is called under the lock for every durable change
+        # (see persist.StatePersistence.attach); None = not persisted
+        self.journal: Optional[Callable[[str, Optional[str], Any], None]] = None
 
    
-    def update_telemetry(self, device_id: DeviceId, message: Dict[str, Any]) -> None:
+    def update_telemetry(self, device_id: DeviceId, message: Dict[str, Any], now_s: Optional[float] = None) -> None:
+        ts = self.now() if now_s is None else now_s
+        with self._lock:
+            prev = self.last_telemetry.get(device_id)
+            self.last_telemetry = self.last_telemetry.set(device_id, message)
+            self._reported["telemetry"][device_id] = ts
+            self._publish("telemetry", device_id)
+            if self.journal is not None:
+                self.journal("telemetry", device_id, message)
+            if prev is not None and prev.get("device_type") != message.get("device_type"):
+                self._types_gen += 1
+                self._unindex(device_id, prev.get("device_type"))
+                self.meters.forget(device_id)
+                self.rollups.forget(device_id)
+            self._index(device_id, message)
+            dtype = message.get("device_type")
+            if dtype in METER_TYPES:
+                data = message.get("data")
+                if isinstance(data, dict) and "delta" in data:
+                    self.meters.observe(device_id, dtype, data["delta"])
+                    sample_ts = sample_time(message, ts)
+                    if self.rollups.observe(device_id, sample_ts, data["delta"]):
+                        self._rollup_seq += 1
+                        if self.journal is not None:
+                            self.journal("sample", device_id, [self._rollup_seq, sample_ts, data["delta"]])
+            self._record_series(device_id, dtype, message.get("data"), prev.get("data") if prev else None, ts)
+
+    def _series_for(self, device_id: DeviceId, name: str) -> Optional[RingSeries]:
+        per_dev = self._series.get(device_id)
+        if per_dev is None:
+            per_dev = self._series[device_id] = {}
+        s = per_dev.get(name)
+        if s is None:
+            if len(per_dev) >= MAX_SERIES_PER_DEVICE:
+                return None
+            s = per_dev[name] = RingSeries(self.series_capacity, self.series_window_s)
+        return s
+
+    def _record_series(self, device_id: DeviceId, device_type: Any, data: Any, prev: Any, ts: float) -> None:
+        wanted = self._series_fields.get(device_type)
+        if not wanted or self.series_capacity <= 0 or not isinstance(data, dict):  # capacity 0 disables series
+            return
+        for name in wanted:
+            k, _, suffix = name.partition(":")
+            v = data.get(k)
+            if suffix == "rises":
+                if v is True and not (isinstance(prev, dict) and prev.get(k) is True):
+                    r = self._series_for(device_id, name)
+                    if r is not None:
+                        r.push(ts, 1.0)
+            elif suffix:
+                continue
+            elif isinstance(v, bool):
+                s = self._series_for(device_id, name)
+                if s is not None:
+                    s.push(ts, 1.0 if v else 0.0)
+            elif isinstance(v, (int, float)):
+                s = self._series_for(device_id, name)
+                if s is not None:
+                    s.push(ts, float(v))
+
+    def set_series_fields(self, source: str, fields: Mapping[str, Iterable[str]]) -> None:
+        """
+        Series `source` reads, as device_type -> series names ("temperature",
+        "open:rises"); replaces that source's previous set. Recording follows
+        the union of all sources; series no source wants any more are dropped.
+        """
         with self._lock:
-            self.last_telemetry[device_id] = message
+            self._series_wanted[source] = {t: set(names) for t, names in fields.items() if names}
+            self._update_series_fields()
 
-    def update_state(self, device_id: DeviceId, message: Dict[str, Any]) -> None:
+    def want_series(self, source: str, device_type: str, name: str) -> None:
+        """Add one series to `source`'s set (recorded from the next sample on)."""
         with self._lock:
-            self.last_state[device_id] = message
+            names = self._series_wanted.setdefault(source, {}).setdefault(device_type, set())
+            if name not in names:
+                names.add(name)
+                self._update_series_fields()
 
-    def snapshot(self) -> Dict[str, Any]:
+    def series_fields(self) -> Dict[str, List[str]]:
+        """device_type -> series names currently recorded."""
         with self._lock:
-            return {
-                "telemetry": dict(self.last_telemetry),
-                "state": dict(self.last_state),
-                "rule_active": dict(self.rule_active),
-            }
+            return {t: sorted(names) for t, names in sorted(self._series_fields.items())}
+
+    def _update_series_fields(self) -> None:
+        union: Dict[str, Set[str]] = {}
+        for wanted in self._series_wanted.values():
+            for device_type, names in wanted.items():
+                union.setdefault(device_type, set()).update(names)
+        self._series_fields = {t: frozenset(names) for t, names in union.items()}
+        for device_id in list(self._series):
+            keep = self._series_fields.get(self.device_type(device_id), frozenset())
+            per_dev = self._series[device_id]
+            for name in [n for n in per_dev if n not in keep]:
+                del per_dev[name]
+            if not per_dev:
+                del self._series[device_id]
+
+    def _index(self, device_id: DeviceId, message: Dict[str, Any]) -> None:
+        dtype = message.get("device_type")
+        data = message.get("data", {})
+        if dtype == "door_window":
+            if bool(data.get("open")):
+                self._open_contacts.add(device_id)
+            else:
+                self._open_contacts.discard(device_id)
+        elif dtype == "environment":
+            self._env_by_node[device_id] = data
+        elif dtype in self._meter_by_type:
+            self._meter_by_type[dtype][device_id] = data
+
+    def _unindex(self, device_id: DeviceId, dtype: Optional[str]) -> None:
+        if dtype == "door_window":
+            self._open_contacts.discard(device_id)
+        elif dtype == "environment":
+            self._env_by_node.pop(device_id, None)
+        elif dtype in self._meter_by_type:
+            self._meter_by_type[dtype].pop(device_id, None)
+
+    def update_state(self, device_id: DeviceId, message: Dict[str, Any], now_s: Optional[float] = None) -> None:
+        ts = self.now() if now_s is None else now_s
+        with self._lock:
+            prev = self.last_state.get(device_id)
+            if prev is not None and prev.get("device_type") != message.get("device_type"):
+                self._types_gen += 1
+            self.last_state = self.last_state.set(device_id, message)
+            self._reported["state"][device_id] = ts
+            self._publish("state", device_id)
+            if self.journal is not None:
+                self.journal("state", device_id, message)
+
+    def touch(self, kind: str, key: Optional[DeviceId] = None) -> None:
+        """Record a change kept outside the store ("devices", "config") as a new version."""
+        with self._lock:
+            self._publish(kind, key)
+            if self.journal is not None:
+                self.journal(kind, key, None)
+
+    def _publish(self, kind: str, key: Optional[DeviceId]) -> None:
+        self.version += 1
+        changes = self._changes
+        if len(changes) >= 2 * self.changelog_size:
+            # copy the tail into a fresh list; snapshots keep the old one
+            drop = len(changes) - self.changelog_size
+            self._changes = changes = changes[drop:]
+            self._changes_base += drop
+        changes.append((kind, key))
+        self._published = (self.version, self.last_telemetry, self.last_state, changes, self._changes_base)
+
+    def snapshot(self) -> StoreSnapshot:
+        """O(1): telemetry/state are the immutable maps at that version (rule flags are copied)."""
+        version, telemetry, state, changes, base = self._published
+        with self._lock:
+            flags = dict(self.rule_active)
+        return StoreSnapshot(version, telemetry, state, flags, changes, base)
+
+    def reported_at(self, kind: str, device_id: DeviceId) -> Optional[float]:
+        """When the device last sent `kind` ("telemetry"|"state") since this store started; None if not yet (restored values do not count). Lock-free."""
+        return self._reported[kind].get(device_id)
+
+    def device_type(self, device_id: DeviceId) -> Optional[str]:
+        """device_type from the last telemetry of this device (None if never seen). Lock-free."""
+        msg = self.last_telemetry.get(device_id)
+        return msg.get("device_type") if msg is not None else None
+
+    def device_ids(self, snap: StoreSnapshot, device_type: Optional[str] = None) -> List[DeviceId]:
+        """
+        Sorted ids with telemetry or state in snap (only those whose envelopes
+        carry device_type, if given). Lock-free; built once per device set and
+        type, then shared (callers must not mutate the list).
+        """
+        key = (len(snap.telemetry), len(snap.state), self._types_gen)
+        cache = self._ids_cache
+        if cache[0] != key:
+            cache = self._ids_cache = (key, {})
+        ids = cache[1].get(device_type)
+        if ids is None:
+            if device_type is None:
+                found = set(snap.telemetry)
+                found.update(snap.state)
+            else:
+                found = {d for d, m in snap.telemetry.items() if m.get("device_type") == device_type}
+                found.update(d for d, m in snap.state.items() if m.get("device_type") == device_type)
+            ids = cache[1][device_type] = sorted(found)
+        return ids
+
+    def open_contact_count(self) -> int:
+        """Number of door/window sensors currently reporting open."""
+        with self._lock:
+            return len(self._open_contacts)
+
+    def environment_reading(self) -> Optional[Dict[str, Any]]:
+        """Latest data of the first environment node seen (None if none yet)."""
+        with self._lock:
+            return next(iter(self._env_by_node.values()), None)
+
+    def meter_reading(self, meter_type: str) -> Optional[Dict[str, Any]]:
+        """Latest data of the first meter of this type seen (None if none yet)."""
+        with self._lock:
+            return next(iter(self._meter_by_type.get(meter_type, {}).values()), None)
+
+    def series_stat(self, device_id: DeviceId, name: str, stat: str, now_s: Optional[float] = None) -> Optional[float]:
+        """One windowed aggregate (see series.STATS) of a device field, None if no samples."""
+        with self._lock:
+            s = self._series.get(device_id, {}).get(name)
+            if s is None:
+                return None
+            s.expire(self.now() if now_s is None else now_s)
+            return s.stat(stat)
+
+    def series_stats(self, device_id: DeviceId, now_s: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """All windowed aggregates of a device, keyed by field."""
+        now = self.now() if now_s is None else now_s
+        with self._lock:
+            out = {}
+            for name, s in self._series.get(device_id, {}).items():
+                s.expire(now)
+                out[name] = s.stats()
+            return out
+
+    def series_points(self, device_id: DeviceId, name: str) -> Optional[List[Tuple[float, float]]]:
+        with self._lock:
+            s = self._series.get(device_id, {}).get(name)
+            return s.points() if s is not None else None
+
+    def rule_flags(self, names: Optional[Iterable[str]] = None) -> Dict[str, bool]:
+        with self._lock:
+            if names is None:
+                return dict(self.rule_active)
+            return {n: self.rule_active.get(n, False) for n in names}
+
+    def set_rule_flags(self, flags: Dict[str, bool]) -> None:
+        with self._lock:
+            if self.journal is not None:
+                changed = {k: v for k, v in flags.items() if self.rule_active.get(k) != v}
+                if changed:
+                    self.journal("rule_active", None, changed)
+            self.rule_active.update(flags)
 
    
-    def set_last_gas_delta(self, delta: float) -> None:
+    def configure_meters(self, configs: Dict[str, Any]) -> None:
+        """Detector parameters per meter type (anomaly.detector_configs)."""
+        with self._lock:
+            self.meters.configure(configs)
+
+    def spiking_meters(self, meter_type: str) -> Dict[DeviceId, Dict[str, Any]]:
+        """Meters of this type whose last delta spiked vs. their previous one (only those are visited)."""
+        with self._lock:
+            return self.meters.spiking(meter_type)
+
+    def anomalous_meters(self) -> Dict[DeviceId, Dict[str, Any]]:
+        """Meters whose last delta was flagged by z-score or CUSUM."""
         with self._lock:
-            self._last_gas_delta = delta
+            return self.meters.anomalous()
 
-    def get_last_gas_delta(self) -> Optional[float]:
+    def meter_detector(self, device_id: DeviceId) -> Optional[Dict[str, Any]]:
         with self._lock:
-            return self._last_gas_delta
+            return self.meters.get(device_id)
+
+    def consumption(self, device_id: DeviceId, start: float, end: float, step: int) -> Optional[Dict[str, Any]]:
+        """Consumption of a meter per step over [start, end) from one rollup level (see rollup.py); None if no samples."""
+        with self._lock:
+            return self.rollups.query(device_id, start, end, step)
 
    
     def can_trigger(self, rule_name: str, now_s: float, cooldown_s: float) -> bool:
@@ -107,18 +565,354 @@ class StateStore:
     def mark_trigger(self, rule_name: str, now_s: float) -> None:
         with self._lock:
             self.last_trigger_ts[rule_name] = now_s
+            if self.journal is not None:
+                self.journal("trigger", rule_name, now_s)
+
+    # -----------------------------
+    # Persistence (see persist.py)
+    # -----------------------------
+    def rule_state(self) -> Dict[str, Any]:
+        """Edge flags and cooldown timestamps, copied under the lock."""
+        with self._lock:
+            return {
+                "rule_active": dict(self.rule_active),
+                "last_trigger_ts": dict(self.last_trigger_ts),
+            }
+
+    def rollup_state(self) -> Tuple[int, Dict[DeviceId, Dict[str, List[str]]]]:
+        """(sequence number of the last recorded delta, rollups.dump()), taken together under the lock."""
+        with self._lock:
+            return self._rollup_seq, self.rollups.dump()
+
+    def restore(
+        self,
+        telemetry: Dict[DeviceId, Dict[str, Any]],
+        state: Dict[DeviceId, Dict[str, Any]],
+        rule_active: Dict[str, bool],
+        last_trigger_ts: Dict[str, float],
+    ) -> None:
+        """
+        Bulk load on recovery: replaces last values and rule state and
+        rebuilds the indexes (windowed series and meter detectors start
+        empty; rollups are loaded by restore_rollups). Not journaled.
+        """
+        with self._lock:
+            self.last_telemetry = PMap.from_dict(telemetry)
+            self.last_state = PMap.from_dict(state)
+            self._open_contacts.clear()
+            self._env_by_node.clear()
+            for by_meter in self._meter_by_type.values():
+                by_meter.clear()
+            self.meters = MeterDetectors(self.meters.configs)
+            self.rollups = ConsumptionRollups()
+            self._reported = {"telemetry": {}, "state": {}}
+            for device_id, message in telemetry.items():
+                self._index(device_id, message)
+            self._types_gen += 1
+            self.rule_active.update(rule_active)
+            self.last_trigger_ts.update(last_trigger_ts)
+            # a new version with an empty changelog: older versions get a full /status, not a delta
+            self.version += 1
+            self._changes_base = self.version
+            self._changes = []
+            self._published = (self.version, self.last_telemetry, self.last_state, self._changes, self._changes_base)
+
+    def restore_rollups(
+        self,
+        dumped: Dict[DeviceId, Dict[str, List[str]]],
+        seq: int,
+        samples: Iterable[Tuple[int, DeviceId, float, Any]],
+    ) -> None:
+        """
+        Bulk load on recovery: rollups from a checkpoint (recorded up to seq),
+        then the journaled (seq, device_id, ts, delta) samples after it.
+        Not journaled; ValueError on a corrupt dump.
+        """
+        with self._lock:
+            self.rollups.load(dumped)
+            for sample_seq, device_id, ts, delta in samples:
+                if sample_seq > seq:
+                    self.rollups.observe(device_id, ts, delta)
+                    seq = sample_seq
+            self._rollup_seq = seq
+
+
+@dataclass
+class HomeShard:
+    """All per-home state: config, registry, last values and pending rule work."""
+    home_id: HomeId
+    cfg: Config = field(default_factory=Config)
+    registry: DeviceRegistry = field(default_factory=DeviceRegistry)
+    store: StateStore = field(default_factory=StateStore)
+
+    # serializes message handling (rule evaluation) within one home only
+    lock: threading.Lock = field(default_factory=lambda: metrics.new_lock("home"), repr=False)
+
+    # rules invalidated by config changes, evaluated on the next message
+    pending_rules: Set[str] = field(default_factory=set)
+
+    # devices that talk the binary wire format (cmds to them are sent binary too)
+    binary_devices: Set[DeviceId] = field(default_factory=set)
+
+    # compiled cfg.custom_rules (None when the home has no custom rules)
+    engine: Optional["RuleEngine"] = None
+
+    def __post_init__(self) -> None:
+        # registry changes get a store version too, so /status ETags and deltas cover them
+        self.registry.on_change = lambda device_id: self.store.touch("devices", device_id)
+        self.configure_meters()
+
+    def configure_meters(self) -> None:
+        """Apply cfg's detector settings (ValueError on bad cfg.meter_detectors)."""
+        self.store.configure_meters(configs_for(self.cfg))
+
+
+class HomeShards:
+    """
+    Lazily created HomeShard per home_id.
+    The shard map is striped: each stripe has its own dict and lock, so
+    lookups/creations for different homes rarely touch the same lock.
+    """
+
+    def __init__(self, stripes: int = 64, series_fields: Optional[Mapping[str, Iterable[str]]] = None) -> None:
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+        # windowed series every home records (device_type -> series names), besides
+        # those its custom rules and REST reads ask for
+        self.series_fields = dict(series_fields or {})
+        # called with each newly created shard (persistence attaches its journal here)
+        self.on_create: Optional[Callable[[HomeShard], None]] = None
+
+    def _stripe(self, home_id: HomeId) -> Tuple[threading.Lock, Dict[HomeId, HomeShard]]:
+        return self._stripes[hash(home_id) % len(self._stripes)]
+
+    def get(self, home_id: HomeId) -> HomeShard:
+        """Return the shard for home_id, creating it on first use."""
+        lock, shards = self._stripe(home_id)
+        shard = shards.get(home_id)
+        if shard is not None:
+            return shard
+        with lock:
+            shard = shards.get(home_id)
+            if shard is None:
+                shard = HomeShard(home_id)
+                if self.series_fields:
+                    shard.store.set_series_fields("config", self.series_fields)
+                if self.on_create is not None:
+                    self.on_create(shard)
+                shards[home_id] = shard
+            return shard
+
+    def peek(self, home_id: HomeId) -> Optional[HomeShard]:
+        """Return the shard for home_id without creating it."""
+        return self._stripe(home_id)[1].get(home_id)
+
+    def home_ids(self) -> List[HomeId]:
+        ids: List[HomeId] = []
+        for lock, shards in self._stripes:
+            with lock:
+                ids.extend(shards)
+        return sorted(ids)
+
+
+_LOG_SECONDS = metrics.LOG_SECONDS.labels()
+_log = logging.getLogger(__name__)
 
 
 class EventLogger:
-    """Simple JSONL event logger for demo."""
+    """
+    Asynchronous JSONL event logger.
+    log() only enqueues; a background writer keeps the file open, writes in
+    batches, flushes every `flush_every` events or `flush_interval_ms`, and
+    rotates by size/age (optionally gzipping closed segments).
+    When the queue is full new events are dropped and counted. An event
+    that cannot be serialized, or an I/O error (the file is then reopened
+    on the next event), is counted in `errors` and reported through
+    logging; the writer keeps going.
+    """
 
-    def __init__(self, log_path: str) -> None:
+    def __init__(
+        self,
+        log_path: str,
+        max_queue: int = 10000,
+        flush_every: int = 100,
+        flush_interval_ms: float = 200.0,
+        fsync: bool = False,
+        max_bytes: int = 0,
+        rotate_interval_s: float = 0.0,
+        gzip_rotated: bool = False,
+    ) -> None:
         self.log_path = log_path
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        self._lock = threading.Lock()
 
+        self.flush_every = max(1, flush_every)
+        self.flush_interval_s = flush_interval_ms / 1000.0
+        self.fsync = fsync
+        self.max_bytes = max_bytes  # 0 = no size rotation
+        self.rotate_interval_s = rotate_interval_s  # 0 = no time rotation
+        self.gzip_rotated = gzip_rotated
+
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()  # guards counters only
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.errors = 0
+        self._size = 0
+        self._opened_at = time.time()
+
+        self._thread = threading.Thread(target=self._run, name="event-logger", daemon=True)
+        self._thread.start()
+
+    # -----------------------------
+    # Hot path
+    # -----------------------------
     def log(self, event: Dict[str, Any]) -> None:
-        line = json.dumps(event, ensure_ascii=False)
+        t0 = metrics.clock()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+        _LOG_SECONDS.observe_since(t0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "dropped": self.dropped,
+                "written": self.written,
+                "flushes": self.flushes,
+                "rotations": self.rotations,
+                "errors": self.errors,
+            }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything logged so far is written and flushed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Flush pending events and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    # -----------------------------
+    # Writer thread
+    # -----------------------------
+    def _open(self) -> IO[str]:
+        f = open(self.log_path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+        self._size = f.tell()
+        return f
+
+    def _flush_file(self, f: IO[str]) -> None:
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
         with self._lock:
-            with open(self.log_path, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+            self.flushes += 1
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and self._size >= self.max_bytes:
+            return True
+        if self.rotate_interval_s and self._size and time.time() - self._opened_at >= self.rotate_interval_s:
+            return True
+        return False
+
+    def _rotate(self, f: IO[str]) -> IO[str]:
+        self._flush_file(f)
+        f.close()
+
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        rotated = f"{self.log_path}.{stamp}"
+        n = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = f"{self.log_path}.{stamp}-{n}"
+            n += 1
+        os.replace(self.log_path, rotated)
+
+        if self.gzip_rotated:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(rotated + ".gz.tmp", rotated + ".gz")
+            os.remove(rotated)
+
+        with self._lock:
+            self.rotations += 1
+        return self._open()
+
+    def _error(self, what: str, exc: BaseException) -> None:
+        with self._lock:
+            self.errors += 1
+        _log.error("event log %s failed (%s): %s", what, self.log_path, exc)
+
+    def _timeout(self, pending: int, last_flush: float) -> Optional[float]:
+        """Seconds until the next pending flush or time-based rotation (None: wait for events)."""
+        deadlines = []
+        if pending:
+            deadlines.append(self.flush_interval_s - (time.monotonic() - last_flush))
+        if self.rotate_interval_s and self._size:
+            deadlines.append(self.rotate_interval_s - (time.time() - self._opened_at))
+        return max(0.0, min(deadlines)) if deadlines else None
+
+    def _run(self) -> None:
+        f: Optional[IO[str]] = None
+        pending = 0
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self._timeout(pending, last_flush))
+                except queue.Empty:
+                    item = None
+
+                try:
+                    if f is None:
+                        f = self._open()
+
+                    if isinstance(item, dict):
+                        try:
+                            line = json.dumps(item, ensure_ascii=False) + "\n"
+                        except (TypeError, ValueError) as e:
+                            self._error("serializing an event", e)
+                        else:
+                            f.write(line)
+                            self._size += len(line.encode("utf-8"))
+                            pending += 1
+                            with self._lock:
+                                self.written += 1
+
+                    barrier = item is _STOP or isinstance(item, threading.Event)
+                    if pending and (
+                        barrier
+                        or pending >= self.flush_every
+                        or time.monotonic() - last_flush >= self.flush_interval_s
+                    ):
+                        self._flush_file(f)
+                        pending = 0
+                        last_flush = time.monotonic()
+
+                    if self._should_rotate():
+                        f = self._rotate(f)
+                except OSError as e:
+                    self._error("write", e)
+                    if f is not None:
+                        try:
+                            f.close()
+                        except OSError:
+                            pass
+                    f, pending = None, 0  # reopened for the next event
+
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is _STOP:
+                    return
+        finally:
+            if f is not None:
+                f.close()
+
+
+_STOP = object()
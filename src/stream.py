@@ -0,0 +1,275 @@
+"""
+Live fan-out of applied telemetry/state updates and rule events to
+observers (SSE on GET /stream, WebSocket on WS /stream).
+
+Ingest workers only call StreamHub.publish(): a no-op while nobody is
+subscribed, otherwise one SimpleQueue.put. A hub thread drains that queue,
+serializes each update once and hands the batch to the event loop, which
+appends it to the bounded buffer of every matching subscriber.
+Subscribers with identical filters share a group, so matching runs once per
+distinct filter rather than once per observer. When a subscriber's buffer
+is full its oldest updates are dropped, and it receives a "dropped" notice
+before the next update it does get.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Set
+
+from .models import DeviceId, HomeId
+
+KINDS = ("telemetry", "state", "event")
+
+STREAM_BUFFER = 256  # updates buffered per subscriber before the oldest are dropped
+STREAM_MAX_PENDING = 50000  # updates waiting for the hub thread before new ones are dropped
+STREAM_BATCH = 1024  # updates handed to the event loop per call
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+
+class StreamItem:
+    """One update, serialized once (JSON text for WebSocket, an SSE frame for /stream)."""
+
+    __slots__ = ("kind", "home_id", "device_id", "device_type", "json", "sse")
+
+    def __init__(
+        self,
+        kind: str,
+        home_id: HomeId,
+        device_id: Optional[DeviceId],
+        device_type: Optional[str],
+        payload: Dict[str, Any],
+    ) -> None:
+        self.kind = kind
+        self.home_id = home_id
+        self.device_id = device_id
+        self.device_type = device_type
+        self.json = _dumps({"kind": kind, "home_id": home_id, "device_id": device_id, "message": payload})
+        self.sse = f"event: {kind}\ndata: {self.json}\n\n".encode("utf-8")
+
+    @classmethod
+    def dropped(cls, count: int) -> "StreamItem":
+        return cls("dropped", "", None, None, {"count": count})
+
+
+def _csv(value: Optional[str]) -> Optional[FrozenSet[str]]:
+    if not value:
+        return None
+    items = frozenset(v.strip() for v in value.split(",") if v.strip())
+    return items or None
+
+
+@dataclass(frozen=True)
+class StreamFilter:
+    """
+    None = no restriction. Device filters apply to telemetry/state only;
+    rule events are per home and pass them.
+    """
+    home_ids: Optional[FrozenSet[HomeId]] = None
+    device_types: Optional[FrozenSet[str]] = None
+    device_ids: Optional[FrozenSet[DeviceId]] = None
+    kinds: FrozenSet[str] = frozenset(KINDS)
+
+    @classmethod
+    def parse(
+        cls,
+        home_id: Optional[str] = None,
+        device_type: Optional[str] = None,
+        device_id: Optional[str] = None,
+        kinds: Optional[str] = None,
+    ) -> "StreamFilter":
+        """From comma-separated query values; ValueError on unknown kinds."""
+        kind_set = _csv(kinds) or frozenset(KINDS)
+        unknown = kind_set - set(KINDS)
+        if unknown:
+            raise ValueError(f"unknown kinds: {', '.join(sorted(unknown))} (expected {', '.join(KINDS)})")
+        return cls(_csv(home_id), _csv(device_type), _csv(device_id), kind_set)
+
+    def matches(self, item: StreamItem) -> bool:
+        if item.kind not in self.kinds:
+            return False
+        if self.home_ids is not None and item.home_id not in self.home_ids:
+            return False
+        if item.kind == "event":
+            return True
+        if self.device_types is not None and item.device_type not in self.device_types:
+            return False
+        return self.device_ids is None or item.device_id in self.device_ids
+
+
+class Subscriber:
+    """Bounded buffer of one observer; filled and drained on the event loop."""
+
+    def __init__(self, filt: StreamFilter, max_buffer: int = STREAM_BUFFER) -> None:
+        self.filter = filt
+        self.max_buffer = max(1, max_buffer)
+        self.buffer: Deque[StreamItem] = deque()
+        self.dropped = 0  # not yet reported to the observer
+        self._wake = asyncio.Event()
+
+    def push(self, items: List[StreamItem]) -> int:
+        """Buffer items; returns how many (oldest) updates were dropped to make room."""
+        buf = self.buffer
+        buf.extend(items)
+        overflow = len(buf) - self.max_buffer
+        if overflow > 0:
+            for _ in range(overflow):
+                buf.popleft()
+            self.dropped += overflow
+        self._wake.set()
+        return max(overflow, 0)
+
+    async def get(self, timeout: Optional[float] = None) -> List[StreamItem]:
+        """Everything buffered, waiting up to timeout for the first update ([] on timeout)."""
+        if not self.buffer:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        items = list(self.buffer)
+        self.buffer.clear()
+        if self.dropped:
+            items.insert(0, StreamItem.dropped(self.dropped))
+            self.dropped = 0
+        return items
+
+
+class StreamHub:
+    """
+    Fan-out of updates from ingest threads to subscribers on one event loop.
+    subscribe()/unsubscribe() must be called on that loop.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = STREAM_BUFFER,
+        max_pending: int = STREAM_MAX_PENDING,
+        batch_size: int = STREAM_BATCH,
+    ) -> None:
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._groups: Dict[StreamFilter, Set[Subscriber]] = {}
+        self._subscribers = 0  # read without a lock by publish()
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._dispatched = threading.Event()
+
+        self.published = 0
+        self.dropped_pending = 0  # hub queue full
+        self.dropped_slow = 0  # evicted from full subscriber buffers
+        self.delivered = 0
+
+    @property
+    def active(self) -> bool:
+        return self._subscribers > 0
+
+    # -----------------------------
+    # Ingest side (any thread)
+    # -----------------------------
+    def publish(
+        self,
+        kind: str,
+        home_id: HomeId,
+        device_id: Optional[DeviceId],
+        device_type: Optional[str],
+        payload: Dict[str, Any],
+    ) -> None:
+        """Queue an update for fan-out; never blocks. payload must not be mutated afterwards."""
+        if not self._subscribers:
+            return
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped_pending += 1
+            return
+        self._queue.put((kind, home_id, device_id, device_type, payload))
+
+    # -----------------------------
+    # Event loop side
+    # -----------------------------
+    def subscribe(self, filt: StreamFilter) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        sub = Subscriber(filt, self.buffer_size)
+        self._groups.setdefault(filt, set()).add(sub)
+        self._subscribers += 1
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="stream-hub", daemon=True)
+            self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        group = self._groups.get(sub.filter)
+        if group is None or sub not in group:
+            return
+        group.discard(sub)
+        if not group:
+            del self._groups[sub.filter]
+        self._subscribers -= 1
+
+    def _dispatch(self, items: List[StreamItem]) -> None:
+        try:
+            for filt, subs in list(self._groups.items()):
+                matched = [i for i in items if filt.matches(i)]
+                if matched:
+                    for sub in subs:
+                        self.dropped_slow += sub.push(matched)
+                    self.delivered += len(matched) * len(subs)
+        finally:
+            self._dispatched.set()
+
+    # -----------------------------
+    # Hub thread
+    # -----------------------------
+    def _run(self) -> None:
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            batch = [msg]
+            while len(batch) < self.batch_size:
+                try:
+                    msg = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if msg is None:
+                    self._queue.put(None)
+                    break
+                batch.append(msg)
+
+            items = [StreamItem(*m) for m in batch]
+            self.published += len(items)
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                continue
+            # one batch in flight: a busy loop makes the backlog build up in the queue, where it is bounded
+            self._dispatched.clear()
+            try:
+                loop.call_soon_threadsafe(self._dispatch, items)
+            except RuntimeError:
+                continue
+            self._dispatched.wait(1.0)
+
+    def stop(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=2.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self._subscribers,
+            "filter_groups": len(self._groups),
+            "pending": self._queue.qsize(),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_pending": self.dropped_pending,
+            "dropped_slow": self.dropped_slow,
+        }
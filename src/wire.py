@@ -0,0 +1,207 @@
+"""
+Compact binary wire format (alternative to JSON) for telemetry/state/cmd.
+
+    header  <B B B q   magic, device_type code, layout code, ts (epoch ms)
+    body    fixed struct layout of the data/params fields (see LAYOUTS)
+
+The magic byte 0xB1 can never start a UTF-8 JSON document, so receivers
+tell the formats apart from the first byte. Payloads that do not fit a
+known layout use layout 0 (JSON body) and still round-trip.
+home_id/device_id are not encoded: they are in the topic.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+import time
+from typing import Any, Dict, FrozenSet, List, Literal, Optional, Tuple
+
+from .models import DeviceId, HomeId, make_envelope
+
+WireFormat = Literal["json", "bin"]
+WIRE_FORMATS = ("json", "bin")
+
+MAGIC = 0xB1
+_MAGIC_BYTE = bytes([MAGIC])
+_HEADER = struct.Struct("<BBBq")
+
+DEVICE_TYPES: Tuple[str, ...] = (
+    "door_window",
+    "environment",
+    "alarm_controller",
+    "alarm_switch",
+    "mobile_light",
+    "sprinkler",
+    "gas_meter",
+    "electricity_meter",
+    "water_meter",
+)
+_NO_TYPE = 0xFF
+_TYPE_CODE = {t: i for i, t in enumerate(DEVICE_TYPES)}
+
+# enum-coded string fields
+ENUMS: Dict[str, Tuple[str, ...]] = {
+    "level": ("LOW", "MEDIUM", "HIGH"),
+    "unit": ("kg", "kWh", "L"),
+}
+_ENUM_CODE = {f: {v: i for i, v in enumerate(vals)} for f, vals in ENUMS.items()}
+
+ACTIONS: Tuple[str, ...] = ("set",)
+_ACTION_CODE = {a: i for i, a in enumerate(ACTIONS)}
+
+# layout code -> (fields in wire order, struct format). "?" bool, "d" float64, "B" enum
+LAYOUTS: Dict[int, Tuple[Tuple[str, ...], str]] = {
+    1: (("open",), "?"),
+    2: (("temperature", "pm10"), "dd"),
+    3: (("total", "delta", "unit", "supply_on"), "ddB?"),
+    4: (("supply_on",), "?"),
+    5: (("on",), "?"),
+    6: (("armed",), "?"),
+    7: (("energy_kwh", "on", "level"), "d?B"),
+    8: (("on", "level"), "?B"),
+}
+_GENERIC = 0
+
+_STRUCTS = {code: struct.Struct("<" + fmt) for code, (_, fmt) in LAYOUTS.items()}
+# layout code -> (struct, fields, [(field, enum values)]) for the decode hot path
+_DECODE = {
+    code: (_STRUCTS[code], fields, [(f, ENUMS[f]) for f, kind in zip(fields, fmt) if kind == "B"])
+    for code, (fields, fmt) in LAYOUTS.items()
+}
+_BY_FIELDS: Dict[FrozenSet[str], int] = {frozenset(fields): code for code, (fields, _) in LAYOUTS.items()}
+
+
+def is_binary(raw: bytes) -> bool:
+    return raw[:1] == _MAGIC_BYTE
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+# -----------------------------
+# data <-> body
+# -----------------------------
+def _pack_data(data: Dict[str, Any]) -> Tuple[int, bytes]:
+    code = _BY_FIELDS.get(frozenset(data))
+    if code is not None:
+        fields, fmt = LAYOUTS[code]
+        values: List[Any] = []
+        for f, kind in zip(fields, fmt):
+            v = data[f]
+            if kind == "B":
+                v = _ENUM_CODE[f].get(v)
+                if v is None:
+                    break
+            elif kind == "?":
+                if not isinstance(v, bool):
+                    break
+            elif not isinstance(v, (int, float)) or isinstance(v, bool):
+                break
+            values.append(v)
+        else:
+            return code, _STRUCTS[code].pack(*values)
+    return _GENERIC, json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _unpack_data(code: int, raw: bytes, offset: int) -> Dict[str, Any]:
+    if code == _GENERIC:
+        data = json.loads(raw[offset:].decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("generic body is not an object")
+        return data
+    st, fields, enums = _DECODE[code]
+    if len(raw) - offset != st.size:
+        raise ValueError(f"bad layout {code} body size")
+    data = dict(zip(fields, st.unpack_from(raw, offset)))
+    try:
+        for f, values in enums:
+            data[f] = values[data[f]]
+    except IndexError:
+        raise ValueError(f"bad enum value in layout {code}") from None
+    return data
+
+
+def _header(raw: bytes) -> Tuple[Optional[str], int, int]:
+    if len(raw) < _HEADER.size:
+        raise ValueError("short binary message")
+    magic, type_code, layout, ts_ms = _HEADER.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError("bad magic")
+    if layout != _GENERIC and layout not in _DECODE:
+        raise ValueError(f"unknown layout {layout}")
+    dtype = DEVICE_TYPES[type_code] if type_code < len(DEVICE_TYPES) else None
+    return dtype, layout, ts_ms
+
+
+# -----------------------------
+# telemetry / state envelopes
+# -----------------------------
+def encode_envelope_bin(device_type: str, data: Dict[str, Any], ts_ms: Optional[int] = None) -> bytes:
+    layout, body = _pack_data(data)
+    ts = now_ms() if ts_ms is None else ts_ms
+    return _HEADER.pack(MAGIC, _TYPE_CODE.get(device_type, _NO_TYPE), layout, ts) + body
+
+
+def decode_envelope_bin(raw: bytes, home_id: HomeId, device_id: DeviceId) -> Dict[str, Any]:
+    """Binary -> envelope dict shaped like make_envelope(), with integer epoch-ms ts."""
+    dtype, layout, ts_ms = _header(raw)
+    if dtype is None:
+        raise ValueError("binary envelope without device_type")
+    return {
+        "ts": ts_ms,
+        "home_id": home_id,
+        "device_id": device_id,
+        "device_type": dtype,
+        "data": _unpack_data(layout, raw, _HEADER.size),
+    }
+
+
+def pack_envelope(
+    home_id: HomeId,
+    device_id: DeviceId,
+    device_type: str,
+    payload: Dict[str, Any],
+    wire: WireFormat = "json",
+) -> bytes:
+    """Encode a telemetry/state message in the requested wire format (JSON for unknown device types)."""
+    if wire == "bin" and device_type in _TYPE_CODE:
+        return encode_envelope_bin(device_type, payload)
+    return json.dumps(make_envelope(home_id, device_id, device_type, payload)).encode("utf-8")
+
+
+# -----------------------------
+# commands
+# -----------------------------
+def pack_cmd(home_id: HomeId, target_id: DeviceId, action: str, params: Dict[str, Any], wire: WireFormat = "json") -> bytes:
+    if wire == "bin" and action in _ACTION_CODE:
+        layout, body = _pack_data(params)
+        return _HEADER.pack(MAGIC, _NO_TYPE, layout, now_ms()) + bytes([_ACTION_CODE[action]]) + body
+    payload = {
+        "ts_unix": time.time(),
+        "home_id": home_id,
+        "target_id": target_id,
+        "action": action,
+        "params": params,
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def unpack_cmd(raw: bytes, home_id: HomeId, target_id: DeviceId) -> Dict[str, Any]:
+    """Decode a cmd payload in either format. Raises ValueError if malformed."""
+    if not is_binary(raw):
+        cmd = json.loads(raw.decode("utf-8"))
+        if not isinstance(cmd, dict):
+            raise ValueError("cmd is not an object")
+        return cmd
+    _, layout, ts_ms = _header(raw)
+    if len(raw) <= _HEADER.size or raw[_HEADER.size] >= len(ACTIONS):
+        raise ValueError("bad cmd action")
+    return {
+        "ts_unix": ts_ms / 1000.0,
+        "home_id": home_id,
+        "target_id": target_id,
+        "action": ACTIONS[raw[_HEADER.size]],
+        "params": _unpack_data(layout, raw, _HEADER.size + 1),
+    }
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+
+from src.anomaly import (
+    CUSUM,
+    SPIKE,
+    ZSCORE,
+    DetectorConfig,
+    MeterDetector,
+    MeterDetectors,
+    detector_configs,
+)
+
+
+def _noisy(level: float, n: int, noise: float = 0.1) -> List[float]:
+    """Deterministic series alternating level -/+ noise (std ~= noise)."""
+    return [level + (noise if i % 2 else -noise) for i in range(n)]
+
+
+def _trained(c: DetectorConfig, n: int = 60) -> MeterDetector:
+    d = MeterDetector()
+    for x in _noisy(1.0, n):
+        assert d.update(x, c) == 0
+    return d
+
+
+def test_spike_needs_ratio_and_min_delta():
+    c = DetectorConfig(enabled=False, spike_ratio=2.0, spike_min_delta=0.5)
+    d = MeterDetector()
+    assert d.update(0.2, c) == 0
+    assert d.update(0.4, c) == 0  # doubled, but under spike_min_delta
+    assert d.update(1.0, c) == SPIKE
+    assert d.update(1.5, c) == 0
+
+
+def test_no_zscore_flags_during_warmup():
+    c = DetectorConfig(warmup=30)
+    d = MeterDetector()
+    for x in _noisy(1.0, 29) + [100.0]:
+        assert d.update(x, c) == 0
+
+
+def test_zscore_flags_a_jump():
+    c = DetectorConfig()
+    d = _trained(c)
+    assert d.update(2.0, c) & ZSCORE
+    assert d.z >= c.z_threshold
+
+
+def test_cusum_catches_a_slow_leak():
+    c = DetectorConfig()
+    d = _trained(c)
+    flags = [d.update(x, c) for x in _noisy(1.2, 20)]
+    assert not any(f & ZSCORE for f in flags)  # every single sample looks normal
+    assert any(f & CUSUM for f in flags)
+
+
+def test_cusum_is_capped_and_resets():
+    c = DetectorConfig(z_threshold=100.0)
+    d = _trained(c)
+    cusums = []
+    for x in _noisy(1.5, 40):
+        d.update(x, c)
+        cusums.append(d.cusum)
+    assert max(cusums) == 2.0 * c.cusum_h  # capped, so it drains quickly
+    assert d.flags & CUSUM
+
+    cusums = []
+    for x in _noisy(1.0, 20):
+        d.update(x, c)
+        cusums.append(d.cusum)
+    assert 0.0 in cusums[:10]
+    assert d.flags == 0
+
+
+def test_meter_detectors_index_flagged_meters():
+    dets = MeterDetectors({"gas_meter": DetectorConfig(warmup=5)})
+    for x in _noisy(1.0, 20):
+        dets.observe("gas_1", "gas_meter", x)
+        dets.observe("gas_2", "gas_meter", x)
+    dets.observe("gas_1", "gas_meter", 5.0)
+
+    assert list(dets.anomalous()) == ["gas_1"]
+    assert "zscore" in dets.get("gas_1")["flags"]
+
+    dets.forget("gas_1")
+    assert dets.anomalous() == {}
+    assert dets.get("gas_1") is None
+
+
+def test_meter_detectors_ignore_non_numeric_and_unknown_types():
+    dets = MeterDetectors()
+    dets.observe("gas_1", "gas_meter", True)
+    dets.observe("gas_1", "gas_meter", "1.0")
+    dets.observe("door_1", "door_window", 1.0)
+    assert len(dets) == 0
+
+
+def test_detector_configs_overrides():
+    out = detector_configs({"water_meter": {"warmup": 10, "shutoff": True}}, gas_spike_ratio=3.0)
+    assert out["water_meter"].warmup == 10 and out["water_meter"].shutoff is True
+    assert out["gas_meter"].spike_ratio == 3.0
+    assert not any(c.shutoff or c.alarm for t, c in out.items() if t != "water_meter")
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {"heat_meter": {}},
+        {"gas_meter": {"no_such_field": 1}},
+        {"gas_meter": {"alpha": 0}},
+        {"gas_meter": {"warmup": "10"}},
+        {"gas_meter": {"shutoff": 1}},
+        {"gas_meter": []},
+    ],
+)
+def test_detector_configs_reject_bad_overrides(overrides):
+    with pytest.raises(ValueError):
+        detector_configs(overrides)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+from src.ingest import IngestPipeline
+
+
+def _drain(submits: List[Tuple[str, str, Any, bool]], **kwargs: Any) -> Tuple[List[Tuple[str, str, Any]], IngestPipeline]:
+    """Queue everything before the worker starts (a backlog), then process it; handled items in order."""
+    handled: List[Tuple[str, str, Any]] = []
+    pipeline = IngestPipeline(lambda *item: handled.append(item), workers=1, **kwargs)
+    for key, channel, value, coalesce in submits:
+        pipeline.submit(key, key, channel, value, coalesce_key=(key, channel) if coalesce else None)
+    pipeline.start()
+    pipeline.stop()
+    return handled, pipeline
+
+
+def test_backlogged_samples_coalesce():
+    handled, pipeline = _drain([("env_1", "telemetry", i, True) for i in range(5)])
+    assert handled == [("env_1", "telemetry", 4)]
+    assert pipeline.stats()["coalesced"] == 4
+
+
+def test_other_devices_do_not_stop_coalescing():
+    handled, _ = _drain([
+        ("env_1", "telemetry", 1, True),
+        ("env_2", "telemetry", 1, True),
+        ("env_1", "telemetry", 2, True),
+    ])
+    assert handled == [("env_1", "telemetry", 2), ("env_2", "telemetry", 1)]
+
+
+def test_coalescing_keeps_per_device_order():
+    handled, pipeline = _drain([
+        ("light_1", "telemetry", 1, True),
+        ("light_1", "state", "on", False),
+        ("light_1", "telemetry", 2, True),
+        ("light_1", "telemetry", 3, True),
+    ])
+    assert handled == [("light_1", "telemetry", 1), ("light_1", "state", "on"), ("light_1", "telemetry", 3)]
+    assert pipeline.stats()["coalesced"] == 1
+
+
+def test_drop_oldest_bounds_the_queue():
+    handled, pipeline = _drain([("door_1", "telemetry", i, False) for i in range(10)], max_queue=4, policy="drop_oldest")
+    assert [v for _, _, v in handled] == [6, 7, 8, 9]
+    assert pipeline.stats()["dropped"] == 6
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import glob
+import os
+import time
+
+import pytest
+
+from src.persist import FORMAT_VERSION, StatePersistence, frame, read_records
+from src.state import HomeShards
+
+T0 = 1_767_225_600.0  # 2026-01-01T00:00:00Z
+
+
+def _env(device_type: str, data: dict, ts: float = T0) -> dict:
+    return {"ts": ts, "device_type": device_type, "data": data}
+
+
+def _running(state_dir: str) -> tuple:
+    p = StatePersistence(state_dir, checkpoint_interval_s=3600.0)
+    shards = HomeShards()
+    p.recover(shards)
+    p.start(shards)
+    return p, shards
+
+
+def _recovered(state_dir: str) -> HomeShards:
+    shards = HomeShards()
+    StatePersistence(state_dir).recover(shards)
+    return shards
+
+
+def _wal(state_dir: str) -> str:
+    (path,) = glob.glob(os.path.join(state_dir, "wal-*.log"))
+    return path
+
+
+def _door(shards: HomeShards, home_id: str, device_id: str) -> bool:
+    return shards.get(home_id).store.last_telemetry[device_id]["data"]["open"]
+
+
+def test_wal_round_trip(tmp_path):
+    p, shards = _running(str(tmp_path))
+    store = shards.get("h1").store
+    store.update_telemetry("door_1", _env("door", {"open": True}))
+    store.update_state("siren_1", _env("alarm_controller", {"on": True}))
+    store.mark_trigger("intrusion", 123.0)
+    assert p.flush(5)
+    p.close(checkpoint=False)
+
+    out = _recovered(str(tmp_path)).get("h1").store
+    assert out.last_telemetry["door_1"]["data"] == {"open": True}
+    assert out.last_state["siren_1"]["data"] == {"on": True}
+    assert out.rule_state()["last_trigger_ts"]["intrusion"] == 123.0
+
+
+def test_checkpoint_then_wal(tmp_path):
+    p, shards = _running(str(tmp_path))
+    store = shards.get("h1").store
+    store.update_telemetry("door_1", _env("door", {"open": True}))
+    assert p.checkpoint(5)
+    store.update_telemetry("door_1", _env("door", {"open": False}))
+    store.update_telemetry("door_2", _env("door", {"open": True}))
+    assert p.flush(5)
+    p.close(checkpoint=False)
+
+    recovered = _recovered(str(tmp_path))
+    assert _door(recovered, "h1", "door_1") is False
+    assert _door(recovered, "h1", "door_2") is True
+
+
+def test_truncated_wal_keeps_complete_records(tmp_path):
+    p, shards = _running(str(tmp_path))
+    store = shards.get("h1").store
+    for i in range(5):
+        store.update_telemetry(f"door_{i}", _env("door", {"open": True}))
+    assert p.flush(5)
+    p.close(checkpoint=False)
+
+    wal = _wal(str(tmp_path))
+    with open(wal, "r+b") as f:
+        f.truncate(os.path.getsize(wal) - 3)  # crash in the middle of the last record
+
+    telemetry = _recovered(str(tmp_path)).get("h1").store.last_telemetry
+    assert sorted(telemetry) == [f"door_{i}" for i in range(4)]
+
+
+def test_crc_mismatch_ends_the_segment(tmp_path):
+    p, shards = _running(str(tmp_path))
+    store = shards.get("h1").store
+    for i in range(3):
+        store.update_telemetry(f"door_{i}", _env("door", {"open": True}))
+    assert p.flush(5)
+    p.close(checkpoint=False)
+
+    wal = _wal(str(tmp_path))
+    with open(wal, "rb") as f:
+        data = bytearray(f.read())
+    second = data.index(b"door_1")
+    data[second] ^= 0xFF
+    with open(wal, "wb") as f:
+        f.write(data)
+
+    assert len(list(read_records(wal))) == 1
+    telemetry = _recovered(str(tmp_path)).get("h1").store.last_telemetry
+    assert sorted(telemetry) == ["door_0"]
+
+
+def _write_checkpoint(path: str, records: list, complete: bool = True) -> None:
+    with open(path, "wb") as f:
+        f.write(frame({"format": FORMAT_VERSION, "wal_seq": 1, "created": time.time()}))
+        for rec in records:
+            f.write(frame(rec))
+        if complete:
+            f.write(frame({"end": True}))
+
+
+def test_incomplete_checkpoint_falls_back_to_older(tmp_path):
+    door = _env("door", {"open": True})
+    _write_checkpoint(str(tmp_path / "checkpoint-00000001.ckpt"), [{"home_id": "h1", "telemetry": {"door_1": door}}])
+    _write_checkpoint(str(tmp_path / "checkpoint-00000002.ckpt"), [{"home_id": "h2"}], complete=False)
+
+    images, result = StatePersistence(str(tmp_path)).load()
+    assert result.checkpoint.endswith("checkpoint-00000001.ckpt")
+    assert set(images) == {"h1"}
+
+
+def test_unknown_checkpoint_keys_are_ignored(tmp_path):
+    door = _env("door", {"open": True})
+    rec = {"home_id": "h1", "telemetry": {"door_1": door}, "last_gas_delta": {}, "added_later": 1}
+    _write_checkpoint(str(tmp_path / "checkpoint-00000001.ckpt"), [rec])
+
+    assert _door(_recovered(str(tmp_path)), "h1", "door_1") is True
+
+
+@pytest.mark.parametrize("checkpoint_between", [False, True])
+def test_rollup_samples_counted_once(tmp_path, checkpoint_between):
+    p, shards = _running(str(tmp_path))
+    store = shards.get("h1").store
+    for i in range(10):
+        store.update_telemetry("gas_1", _env("gas_meter", {"delta": 1.0}, T0 + i))
+        if checkpoint_between and i == 4:
+            assert p.checkpoint(5)
+    assert p.flush(5)
+    p.close(checkpoint=False)
+
+    out = _recovered(str(tmp_path)).get("h1").store
+    assert out.consumption("gas_1", T0, T0 + 60, 60)["total"] == 10.0
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import pytest
+
+from src.rollup import (
+    LEVELS,
+    MAX_CLOCK_SKEW_S,
+    ConsumptionRollup,
+    ConsumptionRollups,
+    RollupLevel,
+    level_for,
+    parse_step,
+    sample_time,
+)
+from src.state import StateStore
+
+T0 = 1_767_225_600.0  # 2026-01-01T00:00:00Z, on a day boundary
+MINUTE, HOUR, DAY = 60, 3600, 86400
+
+
+def _consumption(r: ConsumptionRollup, start: float, end: float, step: int) -> list:
+    return [b["consumption"] for b in r.query(start, end, step)["buckets"]]
+
+
+def test_samples_on_a_boundary_start_the_next_bucket():
+    r = ConsumptionRollup()
+    r.add(T0 - 0.001, 1.0)
+    r.add(T0, 2.0)
+    r.add(T0 + MINUTE - 0.001, 4.0)
+    r.add(T0 + MINUTE, 8.0)
+
+    assert _consumption(r, T0 - MINUTE, T0 + 2 * MINUTE, MINUTE) == [1.0, 6.0, 8.0]
+    assert _consumption(r, T0 - DAY, T0 + DAY, DAY) == [1.0, 14.0]
+
+
+def test_query_range_is_aligned_to_the_step():
+    r = ConsumptionRollup()
+    for i in range(120):
+        r.add(T0 + i * MINUTE, 1.0)
+
+    out = r.query(T0 + 10, T0 + HOUR + 10, HOUR)
+    assert (out["from"], out["to"]) == (T0, T0 + 2 * HOUR)
+    assert out["level"] == "hour"
+    assert [b["samples"] for b in out["buckets"]] == [60, 60]
+    assert out["total"] == 120.0
+
+
+@pytest.mark.parametrize("step,level", [(MINUTE, "minute"), (15 * MINUTE, "minute"), (6 * HOUR, "hour"), (7 * DAY, "day")])
+def test_level_for_picks_the_coarsest_divisor(step, level):
+    assert LEVELS[level_for(step)][0] == level
+
+
+def test_steps_across_levels_agree():
+    r = ConsumptionRollup()
+    for i in range(3 * 24 * 6):
+        r.add(T0 + i * 10 * MINUTE, 0.5)
+    last_day = (T0 + 2 * DAY, T0 + 3 * DAY)
+    by_minute = r.query(*last_day, 15 * MINUTE)["total"]
+    by_hour = r.query(*last_day, HOUR)["total"]
+    by_day = r.query(*last_day, DAY)["total"]
+    assert by_minute == by_hour == by_day == 72.0
+    assert r.query(T0, T0 + DAY, 15 * MINUTE)["total"] == 0.0  # past the minute retention
+    assert r.query(T0, T0 + DAY, HOUR)["total"] == 72.0
+
+
+def test_retention_trims_old_buckets():
+    level = RollupLevel(MINUTE, retention=10)
+    for i in range(200):
+        level.add(T0 + i * MINUTE, 1.0)
+
+    assert len(level) < 10 + 64 + 1
+    assert level.oldest() == T0 + (200 - 10) * MINUTE
+    sums, _ = level.grouped(int(T0 // MINUTE), int(T0 // MINUTE) + 200, 1)
+    assert sum(sums) >= 10
+
+
+def test_late_samples():
+    level = RollupLevel(MINUTE, retention=10)
+    level.add(T0 + 5 * MINUTE, 1.0)
+    level.add(T0 + 2 * MINUTE, 2.0)  # late, inserted before
+    level.add(T0 + 5 * MINUTE + 1, 4.0)
+    level.add(T0 - 10 * MINUTE, 8.0)  # older than the retention: dropped
+
+    b0 = int(T0 // MINUTE)
+    sums, counts = level.grouped(b0 - 20, b0 + 10, 1)
+    assert sum(sums) == 7.0
+    assert sums[22] == 2.0 and sums[25] == 5.0 and counts[25] == 2
+
+
+@pytest.mark.parametrize(
+    "value,seconds",
+    [("minute", 60), ("hour", 3600), ("day", 86400), ("900", 900), ("15m", 900), ("6h", 21600), ("1w", 604800)],
+)
+def test_parse_step(value, seconds):
+    assert parse_step(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["", "abc", "0", "-60", "90", "30s", "m"])
+def test_parse_step_rejects(value):
+    with pytest.raises(ValueError):
+        parse_step(value)
+
+
+def test_sample_time():
+    ingest = T0 + 1000
+    assert sample_time({"ts": T0}, ingest) == T0
+    assert sample_time({"ts": T0 * 1000}, ingest) == T0  # epoch ms
+    assert sample_time({"ts": "2026-01-01T00:00:00Z"}, ingest) == T0
+    assert sample_time({}, ingest) == ingest
+    assert sample_time({"ts": "yesterday"}, ingest) == ingest
+    assert sample_time({"ts": ingest + MAX_CLOCK_SKEW_S + 1}, ingest) == ingest
+
+
+def test_observe_only_records_finite_numbers():
+    rollups = ConsumptionRollups()
+    assert rollups.observe("gas_1", T0, 1) is True
+    for bad in (True, "1", None, float("nan"), float("inf")):
+        assert rollups.observe("gas_1", T0, bad) is False
+    assert rollups.query("gas_1", T0, T0 + MINUTE, MINUTE)["total"] == 1.0
+    assert rollups.query("gas_2", T0, T0 + MINUTE, MINUTE) is None
+
+
+def test_dump_load_round_trip():
+    rollups = ConsumptionRollups()
+    for i in range(500):
+        rollups.observe("gas_1", T0 + i * 37, 0.25)
+    copy = ConsumptionRollups()
+    copy.load(rollups.dump())
+    assert copy.query("gas_1", T0, T0 + DAY, HOUR) == rollups.query("gas_1", T0, T0 + DAY, HOUR)
+
+    with pytest.raises(ValueError):
+        copy.load({"gas_1": {"minute": ["AAAA", "", ""]}})
+
+
+def test_restore_rollups_applies_samples_after_the_checkpoint():
+    store = StateStore()
+    store.rollups.observe("gas_1", T0, 1.0)
+    seq, dumped = 1, store.rollups.dump()
+
+    samples = [(1, "gas_1", T0, 1.0), (2, "gas_1", T0 + 1, 2.0), (3, "gas_1", T0 + 2, 4.0)]
+    restored = StateStore()
+    restored.restore_rollups(dumped, seq, samples)
+
+    assert restored.consumption("gas_1", T0, T0 + MINUTE, MINUTE)["total"] == 7.0
+    assert restored.rollup_state()[0] == 3
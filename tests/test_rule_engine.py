@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import pytest
+
+from src.rule_engine import RuleEngine
+from src.state import Config, StateStore
+
+T0 = 1_767_225_600.0  # 2026-01-01T00:00:00Z
+DOOR_OPEN = {"device_type": "door_window", "field": "open", "op": "==", "value": True}
+HOT = {"device_type": "environment", "field": "temperature", "op": ">=", "value": 50}
+
+
+def _rule(name: str = "r", when: Any = DOOR_OPEN, **extra: Any) -> Dict[str, Any]:
+    return {"name": name, "when": when, "actions": [{"target_id": "siren_1", "params": {"on": True}}], **extra}
+
+
+class _Home:
+    """One home's store/config driven the way rules.process_message drives an engine."""
+
+    def __init__(self, specs: List[Dict[str, Any]], **cfg: Any) -> None:
+        self.engine = RuleEngine(specs)
+        self.now = T0
+        self.store = StateStore(clock=lambda: self.now)  # windowed stats follow the messages' time
+        self.store.set_series_fields("rules", self.engine.series_fields)
+        self.cfg = Config(**cfg)
+
+    def send(self, device_id: str, device_type: str, data: Dict[str, Any], t: float) -> List[str]:
+        """Telemetry at T0 + t; names of the rules that fired."""
+        self.now = T0 + t
+        self.store.update_telemetry(device_id, {"device_type": device_type, "data": data})
+        names = self.engine.on_telemetry(device_id, device_type, data, self.store)
+        _, events = self.engine.evaluate(names, self.store, self.cfg, self.now)
+        return [e["rule"] for e in events]
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        "not an object",
+        {"when": DOOR_OPEN},
+        _rule(name="intrusion"),
+        {"name": "r"},
+        _rule(when={"device_type": "door_window", "field": "open", "op": "~", "value": True}),
+        _rule(when={**DOOR_OPEN, "agg": "most"}),
+        _rule(when={**DOOR_OPEN, "stat": "median"}),
+        _rule(when={"config": "no_such_field"}),
+        {"name": "r", "when": DOOR_OPEN, "actions": [{"action": "set"}]},
+        _rule(cooldown_s=[1]),
+        _rule(cooldown_s=True),
+        _rule(cooldown_s=-1),
+        _rule(edge="false"),
+    ],
+)
+def test_bad_specs_raise_value_error(spec):
+    with pytest.raises(ValueError):
+        RuleEngine([spec])
+
+
+def test_duplicate_names_rejected():
+    with pytest.raises(ValueError):
+        RuleEngine([_rule(), _rule()])
+
+
+def test_edge_fires_once_per_rising_edge():
+    home = _Home([_rule(cooldown_s=0)])
+    assert home.send("door_1", "door_window", {"open": True}, 1.0) == ["r"]
+    assert home.send("door_1", "door_window", {"open": True}, 2.0) == []
+    assert home.send("door_1", "door_window", {"open": False}, 3.0) == []
+    assert home.send("door_1", "door_window", {"open": True}, 4.0) == ["r"]
+
+
+def test_level_rule_respects_cooldown():
+    home = _Home([_rule(edge=False, cooldown_s=10)])
+    fired = [t for t in range(0, 25) if home.send("door_1", "door_window", {"open": True}, float(t))]
+    assert fired == [0, 10, 20]
+
+
+def test_default_cooldown_comes_from_config():
+    home = _Home([_rule(edge=False)], cooldown_seconds=5)
+    fired = [t for t in range(0, 12) if home.send("door_1", "door_window", {"open": True}, float(t))]
+    assert fired == [0, 5, 10]
+
+
+def test_agg_any_and_all():
+    home = _Home([_rule("any_hot", HOT, cooldown_s=0), _rule("all_hot", {**HOT, "agg": "all"}, cooldown_s=0)])
+    assert home.send("env_1", "environment", {"temperature": 20}, 1.0) == []
+    assert home.send("env_2", "environment", {"temperature": 60}, 2.0) == ["any_hot"]
+    assert home.send("env_1", "environment", {"temperature": 55}, 3.0) == ["all_hot"]
+
+
+def test_boolean_combinators_and_config_leaf():
+    when = {"all": [DOOR_OPEN, {"config": "armed", "op": "==", "value": True}, {"not": HOT}]}
+    home = _Home([_rule(when=when, cooldown_s=0)])
+    assert home.send("door_1", "door_window", {"open": True}, 1.0) == []
+
+    home.cfg.armed = True
+    names = home.engine.rules_for_config({"armed"})
+    assert names == {"r"}
+    _, events = home.engine.evaluate(names, home.store, home.cfg, T0 + 2.0)
+    assert [e["rule"] for e in events] == ["r"]
+
+
+def test_shared_leaf_feeds_every_rule():
+    home = _Home([_rule("a", cooldown_s=0), _rule("b", {"any": [DOOR_OPEN, HOT]}, cooldown_s=0)])
+    assert home.engine.on_telemetry("door_1", "door_window", {"open": True}) == {"a", "b"}
+    assert home.engine.on_telemetry("env_1", "environment", {"temperature": 10}) == {"b"}
+    assert home.engine.on_telemetry("meter_1", "gas_meter", {"delta": 1.0}) == set()
+
+
+def test_windowed_stat_leaf():
+    rises = {"device_type": "door_window", "field": "open:rises", "stat": "count", "op": ">=", "value": 3}
+    home = _Home([_rule(when=rises, cooldown_s=0)])
+    assert home.engine.series_fields == {"door_window": {"open:rises"}}
+
+    fired = []
+    for i in range(6):
+        fired += home.send("door_1", "door_window", {"open": i % 2 == 0}, float(i))
+    assert fired == ["r"]  # third opening, at t=4
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from src.state import StateStore
+
+
+def _door(open_: bool) -> dict:
+    return {"device_type": "door_window", "data": {"open": open_}}
+
+
+def test_snapshot_is_immutable():
+    store = StateStore()
+    store.update_telemetry("door_1", _door(True))
+    snap = store.snapshot()
+
+    store.update_telemetry("door_1", _door(False))
+    store.update_telemetry("door_2", _door(True))
+
+    assert snap.telemetry["door_1"]["data"]["open"] is True
+    assert "door_2" not in snap.telemetry
+    assert store.snapshot().telemetry["door_1"]["data"]["open"] is False
+
+
+def test_version_counts_every_write():
+    store = StateStore()
+    store.update_telemetry("door_1", _door(True))
+    store.update_state("siren_1", {"device_type": "alarm_controller", "data": {"on": True}})
+    store.touch("config")
+    assert store.snapshot().version == 3
+
+
+def test_changed_since():
+    store = StateStore()
+    store.update_telemetry("door_1", _door(True))
+    v = store.snapshot().version
+    store.update_telemetry("door_2", _door(True))
+    store.update_state("siren_1", {"device_type": "alarm_controller", "data": {"on": True}})
+    store.touch("devices", "door_3")
+
+    snap = store.snapshot()
+    assert snap.changed_since(v) == {"telemetry": {"door_2"}, "state": {"siren_1"}, "devices": {"door_3"}}
+    assert snap.changed_since(snap.version) == {}
+    assert snap.changed_since(snap.version + 1) is None
+
+
+def test_changelog_compaction():
+    store = StateStore(changelog_size=4)
+    old = store.snapshot()
+    for i in range(20):
+        store.update_telemetry(f"door_{i}", _door(True))
+
+    snap = store.snapshot()
+    assert snap.changed_since(0) is None  # older than the retained changelog
+    assert snap.changed_since(snap.version - 2) == {"telemetry": {"door_18", "door_19"}}
+    assert old.changed_since(0) == {}  # snapshots keep the list they were taken with
+
+
+def test_restore_starts_a_new_changelog():
+    store = StateStore()
+    store.update_telemetry("door_1", _door(True))
+    before = store.snapshot().version
+
+    store.restore({"door_2": _door(False)}, {}, {"intrusion": True}, {"intrusion": 5.0})
+
+    snap = store.snapshot()
+    assert snap.version > before
+    assert snap.changed_since(before) is None
+    assert list(snap.telemetry) == ["door_2"]
+    assert snap.rule_active["intrusion"] is True
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("paho.mqtt.client")
+
+from src import manager  # noqa: E402
+from src.state import HomeShard  # noqa: E402
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(manager, "STATUS_CACHE_HOMES", 3)
+    manager._status_cache.clear()
+    yield manager._status_cache
+    manager._status_cache.clear()
+
+
+def _poll(shard: HomeShard) -> bytes:
+    snap = shard.store.snapshot()
+    return manager._status_body(shard, snap, f'"{shard.home_id}-{snap.version}"')
+
+
+def test_status_cache_is_bounded(cache):
+    shards = [HomeShard(f"home_{i}") for i in range(10)]
+    for shard in shards:
+        _poll(shard)
+        assert len(cache) <= 3
+    assert list(cache) == ["home_7", "home_8", "home_9"]
+
+
+def test_status_cache_evicts_least_recently_polled(cache):
+    a, b, c, d = (HomeShard(h) for h in "abcd")
+    for shard in (a, b, c):
+        _poll(shard)
+    _poll(a)  # a is now the most recently polled
+    _poll(d)
+    assert list(cache) == ["c", "a", "d"]
+
+
+def test_status_body_is_rendered_once_per_version(cache):
+    shard = HomeShard("home_1")
+    first = _poll(shard)
+    assert _poll(shard) is first
+
+    shard.store.update_telemetry("door_1", {"device_type": "door_window", "data": {"open": True}})
+    body = json.loads(_poll(shard))
+    assert body["last_telemetry"]["door_1"]["data"] == {"open": True}